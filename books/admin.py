@@ -1,10 +1,24 @@
 from django.contrib import admin
-from .models import User, Books, Review, GoogleBook
+from .models import User, Books, Review, GoogleBook, Genre
+from django.db.models import Q
 from django.utils.html import format_html
+from .search import search_google_book_ids
 
 
 # Register your models here.
-admin.site.register(Books)
+class BooksAdmin(admin.ModelAdmin):
+    list_display = ('title', 'author', 'price', 'rating_avg', 'rating_count')
+    list_filter = ('genres',)
+    filter_horizontal = ('genres',)
+    readonly_fields = ('rating_avg', 'rating_count', 'rating_histogram')
+
+class GenreAdmin(admin.ModelAdmin):
+    list_display = ('name', 'slug')
+    search_fields = ('name',)
+    prepopulated_fields = {'slug': ('name',)}
+
+admin.site.register(Books, BooksAdmin)
+admin.site.register(Genre, GenreAdmin)
 admin.site.register(User)
 
 class ReviewAdmin(admin.ModelAdmin):
@@ -30,6 +44,14 @@ class GoogleBookAdmin(admin.ModelAdmin):
     def get_authors_display(self, obj):
         return obj.get_authors_display()
     get_authors_display.short_description = 'Authors'
+
+    def get_search_results(self, request, queryset, search_term):
+        # The full-text index instead of LIKE scans over the JSON and description columns
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        ids = search_google_book_ids(search_term)
+        return queryset.filter(Q(pk__in=ids) | Q(google_id=search_term)), False
     
     def get_categories_display(self, obj):
         return obj.get_categories_display()
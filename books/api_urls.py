@@ -3,8 +3,12 @@ from . import api_views
 
 urlpatterns = [
     path('books/', api_views.BookListCreateAPIView.as_view(), name='api-book-list-create'),
+    path('books/batch/', api_views.BookBatchCreateAPIView.as_view(), name='api-book-batch-create'),
     path('books/<int:pk>/', api_views.BookRetrieveAPIView.as_view(), name='api-book-detail'),
     path('books/<int:pk>/reviews/', api_views.ReviewCreateAPIView.as_view(), name='api-review-create'),
+    path('reviews/batch/', api_views.ReviewBatchCreateAPIView.as_view(), name='api-review-batch-create'),
     path('reviews/<int:pk>/', api_views.ReviewUpdateDeleteAPIView.as_view(), name='api-review-update-delete'),
+    path('export/<str:kind>.<str:fmt>', api_views.CatalogExportAPIView.as_view(), name='api-catalog-export'),
+    path('google-books/search/', api_views.GoogleBookLocalSearchAPIView.as_view(), name='api-google-book-search'),
     path('search/', api_views.BookSearchAPIView.as_view(), name='api-book-search'),
 ] 
\ No newline at end of file
@@ -1,18 +1,41 @@
 from rest_framework import generics, permissions, filters, status
 from rest_framework.response import Response
-from rest_framework.exceptions import PermissionDenied
-from django.db.models import Q
-from .models import Books, Review
-from .serializers import BookSerializer, ReviewSerializer
+from rest_framework.exceptions import PermissionDenied, NotFound, ValidationError
+from rest_framework.views import APIView
+from rest_framework.utils.urls import replace_query_param
+from .models import Books, Review, GoogleBook
+from .serializers import BookSerializer, ReviewSerializer, ReviewBatchItemSerializer, GoogleBookSerializer
+from .signals import invalidate_cached_pages
+from . import search
+from django.db import IntegrityError, transaction
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from .pagination import BookCursorPagination, GoogleBookCursorPagination, KeysetPaginator, InvalidCursor
+from .cache import CATALOG_VERSION, cache_response, book_version_name, get_version_stamps
+from .export import FORMATS, ExportError, iter_export, parse_updated_since
+from .conditional import make_etag, latest, not_modified, set_validators
 
-# POST /books, GET /books (with pagination and filtering)
+
+class FullTextSearchFilter(filters.SearchFilter):
+    """
+    ?search= backed by the full-text index instead of LIKE lookups on search_fields
+    """
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query:
+            return queryset
+        return queryset.search(query)
+
+
+# POST /books, GET /books (with cursor pagination and filtering)
 class BookListCreateAPIView(generics.ListCreateAPIView):
-    queryset = Books.objects.all()
+    queryset = Books.objects.for_listing()
     serializer_class = BookSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
-    search_fields = ['title', 'author', 'genre']
-    ordering_fields = ['title', 'author', 'price']
+    filter_backends = [FullTextSearchFilter]
+    # ?ordering= is handled by the keyset paginator (title, author, price, newest)
+    pagination_class = BookCursorPagination
 
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -21,32 +44,64 @@ class BookListCreateAPIView(generics.ListCreateAPIView):
         if author:
             queryset = queryset.filter(author__icontains=author)
         if genre:
-            queryset = queryset.filter(genre__icontains=genre)
+            queryset = queryset.with_genre(genre)
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        # Every write that can change a listing (including deletions and rows moving
+        # between pages) bumps the catalog version, so it validates any page. Read it
+        # before the rows: a write committing in between then only costs a refetch.
+        (version, last_modified), = get_version_stamps(CATALOG_VERSION)
+        etag = make_etag(request.build_absolute_uri(), version, last_modified)
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+        books = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        response = self.get_paginated_response(self.get_serializer(books, many=True).data)
+        return set_validators(response, etag, last_modified)
+
     def perform_create(self, serializer):
         serializer.save()
 
 # GET /books/:id (details, avg rating, paginated reviews)
+# The payload is the same for every user, so authenticated requests are cached too
+@method_decorator(
+    cache_response('api_book_detail', lambda request, pk: [book_version_name(pk)], anonymous_only=False),
+    name='dispatch',
+)
 class BookRetrieveAPIView(generics.RetrieveAPIView):
-    queryset = Books.objects.all()
+    queryset = Books.objects.for_listing()
     serializer_class = BookSerializer
     permission_classes = [permissions.AllowAny]
 
+    reviews_page_size = 5
+
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
+        # Reviews, newest first, with a cursor for the next page
+        paginator = KeysetPaginator(instance.reviews.all(), 'recent', self.reviews_page_size)
+        try:
+            page = paginator.page(request.query_params.get('reviews_cursor'))
+        except InvalidCursor:
+            raise NotFound('Invalid cursor')
+
+        # Review writes bump the book's updated_at through its rating aggregates
+        etag = make_etag(
+            request.build_absolute_uri(), instance.pk, instance.updated_at,
+            [(review.pk, review.updated_at) for review in page], page.next_cursor,
+        )
+        last_modified = latest(instance.updated_at, *(review.updated_at for review in page))
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+
         data = self.get_serializer(instance).data
-        # Add paginated reviews
-        reviews = instance.reviews.all()
-        page = self.request.query_params.get('page', 1)
-        page_size = 5
-        start = (int(page) - 1) * page_size
-        end = start + page_size
-        reviews_page = reviews[start:end]
-        data['reviews'] = ReviewSerializer(reviews_page, many=True).data
-        data['reviews_count'] = reviews.count()
-        data['average_rating'] = instance.average_rating()
-        return Response(data)
+        data['reviews'] = ReviewSerializer(page, many=True).data
+        data['reviews_next'] = None
+        if page.next_cursor:
+            data['reviews_next'] = replace_query_param(request.build_absolute_uri(), 'reviews_cursor', page.next_cursor)
+        data['reviews_count'] = instance.rating_count
+        return set_validators(Response(data), etag, last_modified)
 
 # POST /books/:id/reviews (one per user per book)
 class ReviewCreateAPIView(generics.CreateAPIView):
@@ -61,6 +116,92 @@ class ReviewCreateAPIView(generics.CreateAPIView):
             raise PermissionDenied('You have already reviewed this book.')
         serializer.save(book=book, user=user)
 
+def batch_response(created, errors):
+    """
+    Per-item results in request order: 201 if every item was written, 207 if
+    only some were, 400 if none
+    """
+    results = [{'index': index, 'status': 'created', 'id': pk} for index, pk in created]
+    results += [{'index': index, 'status': 'error', 'errors': detail} for index, detail in errors.items()]
+    results.sort(key=lambda result: result['index'])
+    if not errors:
+        code = status.HTTP_201_CREATED
+    elif created:
+        code = status.HTTP_207_MULTI_STATUS
+    else:
+        code = status.HTTP_400_BAD_REQUEST
+    return Response({'created': len(created), 'failed': len(errors), 'results': results}, status=code)
+
+# POST /books/batch (a list of books, written with bulk inserts in one transaction)
+class BookBatchCreateAPIView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        valid, errors = BookSerializer(data=request.data, many=True).validate_items()
+        books, genre_names = [], []
+        for _, data in valid:
+            genre_names.append(data.pop('genres', None) or [])
+            books.append(Books(created_by=request.user, **data))
+
+        if books:
+            with transaction.atomic():
+                Books.objects.bulk_create(books)
+                Books.link_genre_names(books, genre_names)
+                # bulk_create skips the post_save signals that keep these in sync
+                for book, names in zip(books, genre_names):
+                    search.index_book(book, names)
+                invalidate_cached_pages(*(book.pk for book in books))
+
+        return batch_response([(index, book.pk) for (index, _), book in zip(valid, books)], errors)
+
+# POST /reviews/batch (a list of {book, rating, comment} by the current user, in one transaction)
+class ReviewBatchCreateAPIView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    # Inserts retried after losing a race with a concurrent request for the same books
+    max_attempts = 3
+
+    def post(self, request):
+        valid, errors = ReviewBatchItemSerializer(data=request.data, many=True).validate_items()
+        book_ids = {data['book'] for _, data in valid}
+        for attempt in range(self.max_attempts):
+            existing_books = set(Books.objects.filter(pk__in=book_ids).values_list('pk', flat=True))
+            reviewed = self.reviewed_books(request.user, book_ids)
+
+            reviews, indexes, ratings_by_book = [], [], {}
+            for index, data in valid:
+                book_id = data['book']
+                if book_id not in existing_books:
+                    errors[index] = {'book': [f'Invalid pk "{book_id}" - object does not exist.']}
+                elif book_id in reviewed:
+                    errors[index] = {'book': ['You have already reviewed this book.']}
+                else:
+                    reviewed.add(book_id)
+                    reviews.append(Review(book_id=book_id, user=request.user, rating=data['rating'], comment=data['comment']))
+                    indexes.append(index)
+                    ratings_by_book.setdefault(book_id, []).append(data['rating'])
+
+            if not reviews:
+                break
+            try:
+                with transaction.atomic():
+                    Review.objects.bulk_create(reviews)
+                    # bulk_create skips the signals that maintain the rating aggregates
+                    Books.add_ratings(ratings_by_book)
+                    invalidate_cached_pages(*ratings_by_book)
+                break
+            except IntegrityError:
+                # A concurrent request reviewed (or deleted) one of the books after the checks
+                # above; check again so those items are reported as errors and write the rest
+                if attempt == self.max_attempts - 1:
+                    raise
+
+        return batch_response([(index, review.pk) for index, review in zip(indexes, reviews)], errors)
+
+    @staticmethod
+    def reviewed_books(user, book_ids):
+        return set(Review.objects.filter(user=user, book_id__in=book_ids).values_list('book_id', flat=True))
+
 # PUT, DELETE /reviews/:id (user can update/delete own review)
 class ReviewUpdateDeleteAPIView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Review.objects.all()
@@ -73,11 +214,42 @@ class ReviewUpdateDeleteAPIView(generics.RetrieveUpdateDestroyAPIView):
             raise PermissionDenied('You can only modify your own reviews.')
         return obj
 
-# GET /search (search by title or author, partial, case-insensitive)
+# GET /search (full-text search over title, author and genres, ranked by relevance)
 class BookSearchAPIView(generics.ListAPIView):
     serializer_class = BookSerializer
     permission_classes = [permissions.AllowAny]
+    pagination_class = BookCursorPagination
 
     def get_queryset(self):
-        query = self.request.query_params.get('q', '')
-        return Books.objects.filter(Q(title__icontains=query) | Q(author__icontains=query)) 
\ No newline at end of file
+        query = self.request.query_params.get('q', '').strip()
+        books = Books.objects.for_listing()
+        return books.search(query) if query else books
+
+# GET /google-books/search (full-text search of the stored Google Books, no API calls)
+class GoogleBookLocalSearchAPIView(generics.ListAPIView):
+    serializer_class = GoogleBookSerializer
+    permission_classes = [permissions.AllowAny]
+    pagination_class = GoogleBookCursorPagination
+
+    def get_queryset(self):
+        query = self.request.query_params.get('q', '').strip()
+        books = GoogleBook.objects.all()
+        return books.search(query) if query else books
+
+# GET /export/<kind>.<ndjson|csv>?updated_since= (streamed books, reviews or google_books rows)
+# Staff only: the reviews export carries every reviewer's user_id
+class CatalogExportAPIView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, kind, fmt):
+        started = timezone.now()
+        try:
+            updated_since = parse_updated_since(request.query_params.get('updated_since'))
+            lines = iter_export(kind, fmt, updated_since)
+        except ExportError as e:
+            raise ValidationError(str(e))
+        response = StreamingHttpResponse(lines, content_type=FORMATS[fmt])
+        response['Content-Disposition'] = f'attachment; filename="{kind}.{fmt}"'
+        # Pass this back as updated_since for the next incremental pull
+        response['X-Export-Started'] = started.isoformat()
+        return response
@@ -0,0 +1,437 @@
+"""
+Two-tier cache and stale-while-revalidate helper.
+
+TieredCache is the 'default' cache backend. Reads go to a small in-process L1
+(LocMemCache, entries capped at L1_TIMEOUT seconds) and fall through to a
+shared L2 that every gunicorn worker sees (FileBasedCache, or Redis when
+REDIS_URL is set). Writes go to both tiers. A delete only clears the L1 of the
+worker that issued it, so other workers may serve an old value for up to
+L1_TIMEOUT seconds.
+"""
+import functools
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+from django.core.cache.backends.filebased import FileBasedCache
+from django.db import connection, transaction
+from django.db.models import F
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils import timezone
+from django.utils.http import parse_http_date_safe
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class TieredCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.l1_alias = options.get('L1', 'local')
+        self.l2_alias = options.get('L2', 'shared')
+        self.l1_timeout = options.get('L1_TIMEOUT', 60)
+
+    @property
+    def l1(self):
+        return caches[self.l1_alias]
+
+    @property
+    def l2(self):
+        return caches[self.l2_alias]
+
+    def _timeouts(self, timeout):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        l1_timeout = self.l1_timeout if timeout is None else min(timeout, self.l1_timeout)
+        return timeout, l1_timeout
+
+    def get(self, key, default=None, version=None):
+        value = self.l1.get(key, _MISSING, version=version)
+        if value is not _MISSING:
+            return value
+        value = self.l2.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            return default
+        self.l1.set(key, value, self.l1_timeout, version=version)
+        return value
+
+    def get_shared(self, key, default=None, version=None):
+        """
+        Read from L2 only (refreshing L1), skipping a possibly outdated local copy
+        """
+        value = self.l2.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            self.l1.delete(key, version=version)
+            return default
+        self.l1.set(key, value, self.l1_timeout, version=version)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout, l1_timeout = self._timeouts(timeout)
+        self.l2.set(key, value, timeout, version=version)
+        self.l1.set(key, value, l1_timeout, version=version)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout, l1_timeout = self._timeouts(timeout)
+        if not self.l2.add(key, value, timeout, version=version):
+            return False
+        self.l1.set(key, value, l1_timeout, version=version)
+        return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout, _ = self._timeouts(timeout)
+        self.l1.delete(key, version=version)
+        return self.l2.touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        l1_deleted = self.l1.delete(key, version=version)
+        return self.l2.delete(key, version=version) or l1_deleted
+
+    def has_key(self, key, version=None):
+        return self.get(key, _MISSING, version=version) is not _MISSING
+
+    def clear(self):
+        self.l1.clear()
+        self.l2.clear()
+
+    def close(self, **kwargs):
+        self.l1.close(**kwargs)
+        self.l2.close(**kwargs)
+
+
+# Value plus the time after which it should be refreshed; the cache entry
+# itself lives longer so the stale value can be served meanwhile.
+CacheEntry = namedtuple('CacheEntry', ['value', 'fresh_until'])
+
+# A recent failure of the producer, cached briefly so a failing upstream isn't
+# hammered by every request
+FailedEntry = namedtuple('FailedEntry', ['error'])
+
+
+class CachedFailure(Exception):
+    """
+    Raised by get_or_refresh while a recent failure for the key is negative-cached
+    """
+
+
+_refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='cache-refresh')
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def make_key(prefix, *parts):
+    """
+    Build a cache key that is safe for every backend (no spaces or control
+    characters, bounded length) by hashing the variable parts
+    """
+    digest = hashlib.sha256('\x1f'.join(str(part) for part in parts).encode('utf-8')).hexdigest()[:32]
+    return f'{prefix}_{digest}'
+
+
+def _lock_dir():
+    shared = getattr(cache, 'l2', cache)
+    return os.path.join(shared._dir, 'locks') if isinstance(shared, FileBasedCache) else None
+
+
+def acquire_lock(name, timeout):
+    """
+    Take the lock `name`, shared by every worker, for at most timeout seconds;
+    returns True if this caller got it. cache.add() is atomic on Redis and
+    LocMemCache, but on the file-based cache it is a has_key() followed by a
+    set(), so two workers can both win; there the lock is a file created with
+    O_CREAT | O_EXCL next to the cache files instead.
+    """
+    directory = _lock_dir()
+    if directory is None:
+        return cache.add(name, threading.get_ident(), timeout)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, make_key('lock', name))
+    for _ in range(2):
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            pass
+        try:
+            if time.time() - os.stat(path).st_mtime < timeout:
+                return False
+            # Left behind by a worker that died holding it
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    return False
+
+
+def release_lock(name):
+    directory = _lock_dir()
+    if directory is None:
+        cache.delete(name)
+        return
+    try:
+        os.remove(os.path.join(directory, make_key('lock', name)))
+    except FileNotFoundError:
+        pass
+
+
+def single_flight(key, producer):
+    """
+    Run producer() for key at most once at a time: concurrent callers in this
+    process wait for the same call, and callers in other workers wait for the
+    result to appear in the shared cache (up to SINGLE_FLIGHT_WAIT seconds)
+    before giving up and calling producer() themselves.
+    """
+    with _inflight_lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = _inflight[key] = Future()
+    if not leader:
+        return future.result()
+
+    try:
+        lock_name = f'{key}:fetching'
+        if not acquire_lock(lock_name, getattr(settings, 'CACHE_REFRESH_LOCK_TIMEOUT', 60)):
+            value = _wait_for_other_worker(key)
+            if value is not _MISSING:
+                future.set_result(value)
+                return value
+            lock_name = None
+        try:
+            value = producer()
+        finally:
+            if lock_name:
+                release_lock(lock_name)
+        future.set_result(value)
+        return value
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+
+def _wait_for_other_worker(key):
+    deadline = time.monotonic() + getattr(settings, 'SINGLE_FLIGHT_WAIT', 5)
+    read = getattr(cache, 'get_shared', cache.get)
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        entry = read(key)
+        if isinstance(entry, CacheEntry):
+            return entry.value
+        if isinstance(entry, FailedEntry):
+            raise CachedFailure(entry.error)
+    return _MISSING
+
+
+def _store(key, value, timeout, stale_timeout):
+    cache.set(key, CacheEntry(value, time.time() + timeout), timeout + stale_timeout)
+
+
+def refresh_in_background(key, fn):
+    """
+    Run fn() on the background refresh pool unless a worker is already
+    refreshing key (tracked by acquire_lock()). Returns True if scheduled.
+    """
+    if not acquire_lock(f'{key}:refreshing', getattr(settings, 'CACHE_REFRESH_LOCK_TIMEOUT', 60)):
+        return False
+    _refresh_executor.submit(_run_refresh, key, fn)
+    return True
+
+
+def _run_refresh(key, fn):
+    try:
+        fn()
+    except Exception as e:
+        logger.warning(f"Background refresh of {key} failed, keeping stale value: {e}")
+    finally:
+        release_lock(f'{key}:refreshing')
+        connection.close()
+
+
+def get_or_refresh(key, producer, timeout, stale_timeout=None, negative_timeout=None):
+    """
+    Return the cached value for key, calling producer() on a miss.
+
+    Once the value is older than timeout it is still returned straight away
+    for another stale_timeout seconds, while a single worker (whoever wins the
+    refresh lock, see acquire_lock()) recomputes it in the background.
+    Misses are coalesced with single_flight(). Exceptions from producer()
+    propagate on a miss and are remembered for negative_timeout seconds, during
+    which CachedFailure is raised instead of calling producer() again; on a
+    background refresh they are only logged.
+    """
+    if stale_timeout is None:
+        stale_timeout = getattr(settings, 'CACHE_STALE_TIMEOUT', 86400)
+    if negative_timeout is None:
+        negative_timeout = getattr(settings, 'CACHE_NEGATIVE_TIMEOUT', 60)
+    prefix = metrics.key_prefix(key)
+    entry = cache.get(key)
+    if isinstance(entry, FailedEntry):
+        metrics.inc('cache_lookups_total', prefix=prefix, result='failure')
+        raise CachedFailure(entry.error)
+    if isinstance(entry, CacheEntry) and entry.fresh_until <= time.time() and hasattr(cache, 'get_shared'):
+        # Our L1 copy may predate a refresh another worker already finished
+        entry = cache.get_shared(key)
+    if isinstance(entry, CacheEntry):
+        if entry.fresh_until <= time.time():
+            metrics.inc('cache_lookups_total', prefix=prefix, result='stale')
+            refresh_in_background(key, lambda: _store(key, producer(), timeout, stale_timeout))
+        else:
+            metrics.inc('cache_lookups_total', prefix=prefix, result='hit')
+        return entry.value
+    metrics.inc('cache_lookups_total', prefix=prefix, result='miss')
+
+    def fetch():
+        try:
+            value = producer()
+        except Exception as e:
+            if negative_timeout:
+                cache.set(key, FailedEntry(str(e)), negative_timeout)
+            raise
+        _store(key, value, timeout, stale_timeout)
+        return value
+
+    return single_flight(key, fetch)
+
+
+def refresh_ahead(key, producer, timeout, ahead, stale_timeout=None):
+    """
+    For scheduled warmers: store a new producer() value for key unless the
+    cached one stays fresh for more than `ahead` seconds. Returns True if
+    producer() ran; its exceptions propagate and the old entry is kept.
+    """
+    if stale_timeout is None:
+        stale_timeout = getattr(settings, 'CACHE_STALE_TIMEOUT', 86400)
+    entry = getattr(cache, 'get_shared', cache.get)(key)
+    if isinstance(entry, CacheEntry) and entry.fresh_until - time.time() > ahead:
+        return False
+    _store(key, producer(), timeout, stale_timeout)
+    return True
+
+
+# Version counters for response caching. Cached pages embed the versions they
+# were rendered under in their key; bumping a version after a write commits
+# makes every page that depended on it unreachable, so nothing stale is served.
+# The counters are CacheVersion rows: an UPDATE with F() is atomic across
+# workers, unlike incr() on the file-based cache (a get followed by a set).
+CATALOG_VERSION = 'catalog'
+
+
+def book_version_name(pk):
+    return f'book_{pk}'
+
+
+def get_version_stamps(*names):
+    """
+    (value, changed_at) of each counter; (0, None) for one never bumped
+    """
+    from .models import CacheVersion
+    found = {
+        name: (value, changed_at)
+        for name, value, changed_at in CacheVersion.objects.filter(name__in=names).values_list('name', 'value', 'changed_at')
+    }
+    return [found.get(name, (0, None)) for name in names]
+
+
+def get_versions(*names):
+    return [value for value, _ in get_version_stamps(*names)]
+
+
+def bump_version(*names):
+    from .models import CacheVersion
+    now = timezone.now()
+    with transaction.atomic():
+        CacheVersion.objects.filter(name__in=names).update(value=F('value') + 1, changed_at=now)
+        # New counters start from a value no cached page used; a conflict means
+        # another worker just created the row, which is a bump as well
+        CacheVersion.objects.bulk_create(
+            [CacheVersion(name=name, value=int(time.time() * 1000), changed_at=now) for name in set(names)],
+            ignore_conflicts=True,
+        )
+
+
+def bump_versions_on_commit(*names):
+    transaction.on_commit(lambda: bump_version(*names))
+
+
+# Response headers kept with a cached page
+CACHED_HEADERS = ('ETag', 'Last-Modified')
+
+
+def _normalized_params(request):
+    params = []
+    for name in sorted(request.GET):
+        values = [' '.join(value.split()) for value in request.GET.getlist(name)]
+        values = [value for value in values if value]
+        if values:
+            params.append((name, values))
+    return params
+
+
+def is_cacheable(request, anonymous_only=True):
+    """
+    Whether the response is the one every visitor gets: a GET without pending
+    flash messages, and (if anonymous_only) anonymous, since logged-in pages
+    carry per-request CSRF tokens
+    """
+    return request.method in ('GET', 'HEAD') and not (
+        anonymous_only and request.user.is_authenticated
+    ) and 'messages' not in request.COOKIES
+
+
+def cache_response(prefix, versions, timeout=None, anonymous_only=True):
+    """
+    Cache GET responses of a view under a key built from the host and path, the
+    normalized query parameters, the Accept header and the current values of
+    the version counters named by versions(request, **kwargs). Only anonymous
+    requests are served from the cache unless anonymous_only is False.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if not is_cacheable(request, anonymous_only):
+                return view(request, *args, **kwargs)
+
+            names = versions(request, *args, **kwargs)
+            key = make_key(
+                f'page_{prefix}', request.get_host(), request.path, _normalized_params(request),
+                request.META.get('HTTP_ACCEPT', ''), list(zip(names, get_versions(*names))),
+            )
+            cached = cache.get(key)
+            if cached is not None:
+                status, content_type, content, headers = cached
+                response = HttpResponse(content, status=status, content_type=content_type)
+                for name, value in headers.items():
+                    response[name] = value
+                response['X-Cache'] = 'HIT'
+                # Answer If-None-Match / If-Modified-Since from the stored validators
+                return get_conditional_response(
+                    request, etag=headers.get('ETag'),
+                    last_modified=parse_http_date_safe(headers.get('Last-Modified', '')), response=response,
+                )
+
+            response = view(request, *args, **kwargs)
+            if hasattr(response, 'render') and callable(response.render):
+                response = response.render()
+            if response.status_code == 200 and not response.streaming and not response.cookies:
+                headers = {name: response[name] for name in CACHED_HEADERS if response.has_header(name)}
+                cache.set(
+                    key, (response.status_code, response['Content-Type'], response.content, headers),
+                    timeout if timeout is not None else getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300),
+                )
+                response['X-Cache'] = 'MISS'
+            return response
+        return wrapped
+    return decorator
@@ -0,0 +1,46 @@
+"""
+Conditional GET (ETag / Last-Modified) helpers.
+
+Views compute their validators from the rows they are about to render (ids
+and updated_at timestamps, which cost one cheap query), or for listings from
+the catalog version counter (books/cache.py), which deletions bump as well,
+and call not_modified() before serializing or rendering anything, so a
+client that already has the current representation gets a bodiless 304.
+
+ETags are strong: they hash everything the body is built from, including the
+absolute request URL (responses embed absolute links) and the user when the
+page differs per user.
+"""
+import hashlib
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+def make_etag(*parts):
+    digest = hashlib.sha256('\x1f'.join(str(part) for part in parts).encode('utf-8')).hexdigest()[:32]
+    return quote_etag(digest)
+
+
+def latest(*timestamps):
+    timestamps = [ts for ts in timestamps if ts is not None]
+    return max(timestamps) if timestamps else None
+
+
+def not_modified(request, etag, last_modified=None):
+    """
+    The 304 (or 412) response if the request's preconditions say the client's copy is current, else None
+    """
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(last_modified.timestamp()) if last_modified else None,
+    )
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def set_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
+
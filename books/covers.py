@@ -0,0 +1,212 @@
+"""
+Local proxy cache for Google Books cover images.
+
+Covers are fetched once through the pooled Google client and stored on disk
+by the sha256 of their content (blobs/), so identical images share one file.
+A small ref file per source URL (refs/) maps the URL to its blob. Pages link
+to /google-books/book/<google_id>/cover/<key>/ where key is derived from the
+source URL, so the response can be cached as immutable: a new image_url gives
+a new address. Blobs are evicted least recently served first once the
+directory exceeds GOOGLE_COVER_CACHE_MAX_BYTES.
+
+A cold cover is fetched while the browser waits, so the fetch gets one short
+attempt (GOOGLE_COVER_FETCH_TIMEOUT, no retries) and the view redirects to
+Google's own URL when it fails; the body is streamed and abandoned as soon
+as it passes GOOGLE_COVER_MAX_IMAGE_BYTES.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit
+from django.conf import settings
+from django.urls import reverse
+from .google_client import get_client
+
+logger = logging.getLogger(__name__)
+
+# A served blob's mtime doubles as its last-use time; refresh it at most this often
+TOUCH_INTERVAL = 3600
+# Evict down to this share of the budget so every new cover doesn't trigger a scan
+EVICT_TO = 0.9
+CHUNK_SIZE = 64 * 1024
+
+
+class CoverError(Exception):
+    pass
+
+
+def source_url(image_url):
+    """
+    Google returns http:// thumbnail links; always fetch over https
+    """
+    parts = urlsplit(image_url)
+    return urlunsplit(('https', *parts[1:])) if parts.scheme == 'http' else image_url
+
+
+def cover_key(image_url):
+    return hashlib.sha256(source_url(image_url).encode('utf-8')).hexdigest()[:32]
+
+
+def cover_url(google_id, image_url):
+    return reverse('google_book_cover', args=[google_id, cover_key(image_url)])
+
+
+class CoverCache:
+    def __init__(self, root, max_bytes, max_image_bytes, timeout=3):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_image_bytes = max_image_bytes
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        # Running estimate of the blobs' total size in this process, None until scanned
+        self._usage = None
+
+    def _blob_path(self, digest):
+        return os.path.join(self.root, 'blobs', digest[:2], digest)
+
+    def _ref_path(self, key):
+        return os.path.join(self.root, 'refs', key[:2], key)
+
+    def get(self, key):
+        """
+        (path, content_type, digest) of the cached cover for key, or None
+        """
+        try:
+            with open(self._ref_path(key)) as f:
+                ref = json.load(f)
+            path = self._blob_path(ref['digest'])
+            mtime = os.stat(path).st_mtime
+        except (OSError, ValueError, KeyError):
+            return None
+        if time.time() - mtime > TOUCH_INTERVAL:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return path, ref['content_type'], ref['digest']
+
+    def fetch(self, image_url):
+        """
+        Download image_url and store it; returns the same tuple as get().
+        Workers racing on one cover write identical files, so no lock is needed.
+        """
+        url = source_url(image_url)
+        response = get_client().fetch(url, timeout=self.timeout, max_retries=0, stream=True)
+        try:
+            content_type = response.headers.get('Content-Type', '').split(';')[0].strip()
+            if not content_type.startswith('image/'):
+                raise CoverError(f'{url} returned {content_type or "no content type"}, not an image')
+            content = self._read(url, response)
+        finally:
+            response.close()
+
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._blob_path(digest)
+        if not os.path.exists(path):
+            self._write(path, content)
+            self._account(len(content))
+        else:
+            os.utime(path)
+        self._write(self._ref_path(cover_key(image_url)), json.dumps({
+            'digest': digest, 'content_type': content_type, 'source': url,
+        }).encode('utf-8'))
+        return path, content_type, digest
+
+    def _read(self, url, response):
+        declared = response.headers.get('Content-Length', '')
+        if declared.isdigit() and int(declared) > self.max_image_bytes:
+            raise CoverError(f'{url} is {declared} bytes, over the {self.max_image_bytes} byte limit')
+        chunks, size = [], 0
+        for chunk in response.iter_content(CHUNK_SIZE):
+            size += len(chunk)
+            if size > self.max_image_bytes:
+                raise CoverError(f'{url} is over the {self.max_image_bytes} byte limit')
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    def get_or_fetch(self, image_url):
+        return self.get(cover_key(image_url)) or self.fetch(image_url)
+
+    @staticmethod
+    def _write(path, content):
+        # Write then rename so readers never see a partial file
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            os.replace(temporary, path)
+        except BaseException:
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+            raise
+
+    def _blobs(self):
+        blobs = []
+        for directory in os.scandir(os.path.join(self.root, 'blobs')):
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory.path):
+                if entry.name.startswith('.tmp-'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                blobs.append((stat.st_mtime, stat.st_size, entry.path))
+        return blobs
+
+    def _account(self, added):
+        with self._lock:
+            if self._usage is not None:
+                self._usage += added
+                if self._usage <= self.max_bytes:
+                    return
+            self._usage = self.evict()
+
+    def evict(self):
+        """
+        Delete least recently served blobs until the cache fits the budget; returns the size left
+        """
+        blobs = self._blobs()
+        usage = sum(size for _, size, _ in blobs)
+        if usage <= self.max_bytes:
+            return usage
+        target = self.max_bytes * EVICT_TO
+        evicted = 0
+        # Other workers evict too: files may already be gone
+        for _, size, path in sorted(blobs):
+            if usage <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            usage -= size
+            evicted += 1
+        logger.info(f"Evicted {evicted} cached covers, {usage} bytes left")
+        return usage
+
+
+_cover_cache = None
+_cover_cache_lock = threading.Lock()
+
+
+def get_cover_cache():
+    global _cover_cache
+    if _cover_cache is None:
+        with _cover_cache_lock:
+            if _cover_cache is None:
+                _cover_cache = CoverCache(
+                    root=settings.GOOGLE_COVER_CACHE_DIR,
+                    max_bytes=getattr(settings, 'GOOGLE_COVER_CACHE_MAX_BYTES', 256 * 1024 * 1024),
+                    max_image_bytes=getattr(settings, 'GOOGLE_COVER_MAX_IMAGE_BYTES', 2 * 1024 * 1024),
+                    timeout=getattr(settings, 'GOOGLE_COVER_FETCH_TIMEOUT', 3),
+                )
+    return _cover_cache
@@ -0,0 +1,121 @@
+"""
+Streaming export of the catalog (books, reviews, Google Books rows) as NDJSON or CSV.
+
+Rows are read with QuerySet.iterator(chunk_size=...) and encoded one line at
+a time, so memory use does not grow with the table. Used by the
+/api/export/<kind>.<format> endpoint and the export_catalog command.
+"""
+import csv
+import datetime
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from .models import Books, Review, GoogleBook
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+# kind -> (queryset factory, exported columns). Columns are model attributes
+# except for the computed 'genres'.
+EXPORTS = {
+    'books': (
+        lambda: Books.objects.prefetch_related('genres'),
+        ['id', 'title', 'author', 'description', 'price', 'published_date', 'genres', 'created_by_id',
+         'rating_avg', 'rating_count', 'updated_at'],
+    ),
+    'reviews': (
+        lambda: Review.objects.all(),
+        ['id', 'book_id', 'user_id', 'rating', 'comment', 'updated_at'],
+    ),
+    'google_books': (
+        lambda: GoogleBook.objects.all(),
+        ['id', 'google_id', 'title', 'authors', 'description', 'published_date', 'page_count', 'categories',
+         'average_rating', 'ratings_count', 'image_url', 'preview_url', 'web_reader_url', 'is_ebook', 'price',
+         'currency', 'created_at', 'updated_at'],
+    ),
+}
+
+
+class ExportError(ValueError):
+    pass
+
+
+def parse_updated_since(value):
+    """
+    Accept an ISO 8601 datetime or date; naive values are taken in the current time zone
+    """
+    if not value:
+        return None
+    try:
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            moment = datetime.datetime.combine(day, datetime.time.min) if day else None
+    except ValueError:
+        moment = None
+    if moment is None:
+        raise ExportError(f'Invalid updated_since: {value!r}')
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def _value(obj, column):
+    if column == 'genres':
+        return [genre.name for genre in obj.genres.all()]
+    return getattr(obj, column)
+
+
+def _rows(queryset, columns, updated_since=None, chunk_size=2000):
+    queryset = queryset.order_by('pk')
+    if updated_since:
+        queryset = queryset.filter(updated_at__gte=updated_since)
+    for obj in queryset.iterator(chunk_size=chunk_size):
+        yield [_value(obj, column) for column in columns]
+
+
+class _Line:
+    """
+    File-like sink for csv.writer that hands back each written line
+    """
+    def write(self, value):
+        return value
+
+
+def _csv_cell(value):
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, cls=DjangoJSONEncoder)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def iter_export(kind, fmt='ndjson', updated_since=None, chunk_size=2000):
+    """
+    Return an iterator over the export's text lines, raising ExportError
+    up front for an unknown kind or format
+    """
+    if kind not in EXPORTS:
+        raise ExportError(f'Unknown export {kind!r}, expected one of {", ".join(EXPORTS)}')
+    if fmt not in FORMATS:
+        raise ExportError(f'Unknown format {fmt!r}, expected one of {", ".join(FORMATS)}')
+    make_queryset, columns = EXPORTS[kind]
+    rows = _rows(make_queryset(), columns, updated_since, chunk_size)
+    if fmt == 'csv':
+        return _csv_lines(columns, rows)
+    return _ndjson_lines(columns, rows)
+
+
+def _csv_lines(columns, rows):
+    writer = csv.writer(_Line())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow([_csv_cell(value) for value in row])
+
+
+def _ndjson_lines(columns, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder) + '\n'
@@ -1,6 +1,6 @@
 from django import forms
 from django.contrib.auth import get_user_model
-from .models import Review, Books
+from .models import Review, Books, Genre
 
 User = get_user_model()
 
@@ -25,21 +25,34 @@ class ReviewForm(forms.ModelForm):
         fields = ['rating', 'comment']
 
 class BookForm(forms.ModelForm):
+    genres = forms.CharField(
+        required=False,
+        label='Genres',
+        help_text='Enter multiple genres separated by commas (e.g., Fantasy, Adventure, Magic)',
+        widget=forms.TextInput(attrs={'class': 'w-full px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500 focus:border-transparent', 'placeholder': 'Genres (comma separated)'}),
+    )
+    field_order = ['title', 'author', 'genres', 'description']
+
     class Meta:
         model = Books
-        fields = ['title', 'author', 'genres', 'description', 'price', 'image', 'published_date']
+        fields = ['title', 'author', 'description', 'price', 'image', 'published_date']
         widgets = {
             'title': forms.TextInput(attrs={'class': 'w-full px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500 focus:border-transparent', 'placeholder': 'Book Title'}),
             'author': forms.TextInput(attrs={'class': 'w-full px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500 focus:border-transparent', 'placeholder': 'Author Name'}),
-            'genres': forms.TextInput(attrs={'class': 'w-full px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500 focus:border-transparent', 'placeholder': 'Genres (comma separated)'}),
             'description': forms.Textarea(attrs={'class': 'w-full px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500 focus:border-transparent', 'placeholder': 'Book Description', 'rows': 4}),
             'price': forms.NumberInput(attrs={'class': 'w-full px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500 focus:border-transparent', 'placeholder': 'Price'}),
             'published_date': forms.DateInput(attrs={'class': 'w-full px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500 focus:border-transparent', 'type': 'date'}),
             'image': forms.FileInput(attrs={'class': 'w-full px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500 focus:border-transparent'}),
         }
-        labels = {
-            'genres': 'Genres',
-        }
-        help_texts = {
-            'genres': 'Enter multiple genres separated by commas (e.g., Fantasy, Adventure, Magic)',
-        }
\ No newline at end of file
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk and not self.is_bound:
+            self.initial['genres'] = self.instance.get_genre_display()
+
+    def clean_genres(self):
+        return Genre.split(self.cleaned_data.get('genres'))
+
+    def _save_m2m(self):
+        super()._save_m2m()
+        self.instance.set_genre_names(self.cleaned_data['genres'])
\ No newline at end of file
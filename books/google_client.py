@@ -0,0 +1,171 @@
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class GoogleBooksClient:
+    """
+    Process-wide HTTP client for the Google Books API: one pooled keep-alive
+    session, retries with exponential backoff and jitter on 429/5xx and
+    connection errors, and per-call latency metrics.
+    """
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, base_url, api_key='', pool_size=10, max_retries=3, backoff=0.5, max_backoff=8, timeout=10):
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def get(self, path, params=None, timeout=None, deadline=None, max_retries=None):
+        """
+        GET base_url + path and return the successful response, raising
+        requests.RequestException once retries are exhausted. deadline caps
+        the seconds spent on the call, retries and backoff included.
+        """
+        params = dict(params or {})
+        if self.api_key:
+            params.setdefault('key', self.api_key)
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        return self._send(url, params, self._endpoint(path), timeout, deadline, max_retries)
+
+    def fetch(self, url, endpoint='cover', timeout=None, deadline=None, max_retries=None, stream=False):
+        """
+        GET an absolute Google URL (e.g. a cover image) through the same pooled
+        session, retries and metrics, without adding the API key. With stream
+        the body is left unread; close the response when done with it.
+        """
+        return self._send(url, None, endpoint, timeout, deadline, max_retries, stream)
+
+    def _send(self, url, params, endpoint, timeout, deadline=None, max_retries=None, stream=False):
+        timeout = timeout or self.timeout
+        max_retries = self.max_retries if max_retries is None else max_retries
+        give_up_at = time.monotonic() + deadline if deadline else None
+
+        def may_retry(attempt, delay):
+            # Only if the backoff still leaves time for another attempt
+            return attempt < max_retries and (give_up_at is None or time.monotonic() + delay < give_up_at)
+
+        attempt = 0
+        while True:
+            attempt_timeout = timeout if give_up_at is None else min(timeout, give_up_at - time.monotonic())
+            started = time.perf_counter()
+            try:
+                response = self.session.get(url, params=params, timeout=attempt_timeout, stream=stream)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._record(endpoint, time.perf_counter() - started, error=True)
+                delay = self._delay(attempt)
+                if not may_retry(attempt, delay):
+                    raise
+                logger.warning(f"Google Books {endpoint} failed ({e}), retrying in {delay:.2f}s")
+            else:
+                elapsed = time.perf_counter() - started
+                retryable = response.status_code in self.RETRY_STATUSES
+                delay = self._delay(attempt, response.headers.get('Retry-After')) if retryable else 0
+                if retryable and may_retry(attempt, delay):
+                    self._record(endpoint, elapsed, error=True)
+                    logger.warning(f"Google Books {endpoint} returned {response.status_code}, retrying in {delay:.2f}s")
+                else:
+                    self._record(endpoint, elapsed, error=response.status_code >= 400)
+                    response.raise_for_status()
+                    return response
+            attempt += 1
+            self._record_retry(endpoint)
+            time.sleep(delay)
+
+    def _delay(self, attempt, retry_after=None):
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        # Full jitter: uniform between 0 and the exponential backoff cap
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    @staticmethod
+    def _endpoint(path):
+        # '/volumes/<id>' -> 'volume_detail' so metrics don't fan out per book
+        parts = [part for part in path.split('/') if part]
+        return 'volume_detail' if len(parts) > 1 else (parts[0] if parts else 'root')
+
+    def _record(self, endpoint, elapsed, error=False):
+        with self._lock:
+            stats = self._metrics.setdefault(endpoint, {
+                'calls': 0, 'errors': 0, 'retries': 0, 'latency_total': 0.0, 'latency_max': 0.0,
+            })
+            stats['calls'] += 1
+            stats['errors'] += int(error)
+            stats['latency_total'] += elapsed
+            stats['latency_max'] = max(stats['latency_max'], elapsed)
+        metrics.observe('google_books_request_duration_seconds', elapsed, endpoint=endpoint,
+                        outcome='error' if error else 'ok')
+        logger.debug(f"Google Books {endpoint} took {elapsed * 1000:.1f}ms{' (error)' if error else ''}")
+
+    def _record_retry(self, endpoint):
+        with self._lock:
+            self._metrics[endpoint]['retries'] += 1
+        metrics.inc('google_books_retries_total', endpoint=endpoint)
+
+    def metrics(self):
+        """
+        Snapshot of per-endpoint call counts, errors, retries and latency (seconds)
+        """
+        with self._lock:
+            return {
+                endpoint: dict(stats, latency_avg=stats['latency_total'] / stats['calls'] if stats['calls'] else 0.0)
+                for endpoint, stats in self._metrics.items()
+            }
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = GoogleBooksClient(
+                    base_url=settings.GOOGLE_BOOKS_API_BASE_URL,
+                    api_key=settings.GOOGLE_BOOKS_API_KEY,
+                    pool_size=getattr(settings, 'GOOGLE_BOOKS_HTTP_POOL_SIZE', 10),
+                    max_retries=getattr(settings, 'GOOGLE_BOOKS_HTTP_MAX_RETRIES', 3),
+                    backoff=getattr(settings, 'GOOGLE_BOOKS_HTTP_BACKOFF', 0.5),
+                    timeout=getattr(settings, 'GOOGLE_BOOKS_HTTP_TIMEOUT', 10),
+                )
+    return _client
+
+
+@contextmanager
+def use_client(client):
+    """
+    Make get_client() return client inside the block (e.g. one pointed at a
+    local stub for benchmarks), restoring the previous client afterwards
+    """
+    global _client
+    with _client_lock:
+        previous, _client = _client, client
+    try:
+        yield client
+    finally:
+        with _client_lock:
+            _client = previous
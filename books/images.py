@@ -0,0 +1,125 @@
+"""
+Resized cover variants for Books.image.
+
+Every uploaded cover is rendered into a few fixed bounding boxes (card and
+detail size, each at 1x and 2x) as WebP and JPEG. The files are written
+through the image field's own storage (Cloudinary or the local
+FileSystemStorage), and their URLs and sizes are kept in
+Books.image_variants so templates can emit <picture>/srcset markup
+without touching the storage.
+"""
+import hashlib
+import io
+import logging
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# name -> bounding box (width, height); images are never upscaled
+VARIANTS = {
+    'card': (240, 320),
+    'card_2x': (480, 640),
+    'detail': (480, 720),
+    'detail_2x': (960, 1440),
+}
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+VARIANT_DIR = 'book_images/variants'
+
+
+def _flatten(image):
+    # JPEG has no alpha channel: composite transparent covers onto white
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def render(image, box, fmt):
+    """
+    Encode a copy of image fitted into box; returns (bytes, width, height)
+    """
+    variant = image.copy()
+    variant.thumbnail(box, Image.Resampling.LANCZOS)
+    pil_format, options = FORMATS[fmt]
+    buffer = io.BytesIO()
+    variant.save(buffer, pil_format, **options)
+    return buffer.getvalue(), variant.width, variant.height
+
+
+def generate_variants(book):
+    """
+    Render and store every variant of book.image and return the
+    image_variants value describing them ({} if there is no usable image)
+    """
+    if not book.image:
+        return {}
+    storage = book.image.storage
+    try:
+        with storage.open(book.image.name, 'rb') as f:
+            data = f.read()
+        source = _flatten(ImageOps.exif_transpose(Image.open(io.BytesIO(data))))
+    except (OSError, UnidentifiedImageError) as e:
+        logger.warning(f"Cannot render cover variants of book {book.pk} from {book.image.name}: {e}")
+        return {}
+
+    # Content-addressed names: re-uploading the same file reuses them, a new one busts caches
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    variants = {'source': book.image.name, 'files': []}
+    for name, box in VARIANTS.items():
+        entry = {}
+        for fmt in FORMATS:
+            content, entry['width'], entry['height'] = render(source, box, fmt)
+            path = f'{VARIANT_DIR}/{book.pk}/{name}-{digest}.{fmt}'
+            if storage.exists(path):
+                storage.delete(path)
+            saved = storage.save(path, ContentFile(content))
+            entry[fmt] = storage.url(saved)
+            variants['files'].append(saved)
+        variants[name] = entry
+    return variants
+
+
+def delete_variants(book, variants):
+    """
+    Remove variant files that are not part of book.image_variants any more
+    """
+    keep = set((book.image_variants or {}).get('files', []))
+    storage = book.image.storage
+    for name in (variants or {}).get('files', []):
+        if name not in keep:
+            try:
+                storage.delete(name)
+            except Exception as e:
+                logger.warning(f"Could not delete old cover variant {name}: {e}")
+
+
+def is_stale(book):
+    """
+    Whether book.image_variants were not made from the current image
+    """
+    current = book.image_variants or {}
+    source = book.image.name if book.image else None
+    return current.get('source') != source or (not source and bool(current))
+
+
+def refresh_variants(book, force=False):
+    """
+    Regenerate book.image_variants if the image changed (or force) and
+    persist it without re-running the save signals. Returns True if updated.
+    """
+    from .models import Books
+    if not force and not is_stale(book):
+        return False
+    previous = book.image_variants or {}
+    book.image_variants = generate_variants(book) if book.image else {}
+    Books.objects.filter(pk=book.pk).update(image_variants=book.image_variants)
+    # Also when the image was cleared: its variants would otherwise stay in storage
+    if previous:
+        delete_variants(book, previous)
+    return True
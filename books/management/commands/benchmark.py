@@ -0,0 +1,187 @@
+import json
+import random
+import statistics
+import time
+from urllib.parse import urlencode
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from books import google_client
+from books.models import Books, GoogleBook, Genre, User
+from books.perf import LAST_NAMES, WORDS, GoogleBooksStub, percentiles
+
+BENCHMARK_USER = 'benchmark_runner'
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the hot pages and API endpoints against the current database (seed it with seed_perf_data) '
+        'and a local Google Books stub. Reports p50/p95/p99 latency and SQL queries per request; save '
+        'the results with --json and pass them to --compare on a later commit to spot regressions.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=100, help='Measured requests per scenario')
+        parser.add_argument('--warmup', type=int, default=5, help='Unmeasured requests per scenario first')
+        parser.add_argument('--scenario', action='append', dest='scenarios', help='Only this scenario (repeatable)')
+        parser.add_argument('--google-latency', type=float, default=100, help='Stub Google Books API latency in ms')
+        parser.add_argument('--cold', action='store_true', help='Clear the cache before every request')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--json', dest='json_path', help='Write the results to this file')
+        parser.add_argument('--compare', help='Results file of an earlier run to compare against')
+        parser.add_argument('--fail-over', type=float, help='Exit with an error if any p95 grew by more than this percent')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 2:
+            raise CommandError('--iterations must be at least 2')
+        if not Books.objects.exists():
+            raise CommandError('No books to benchmark, run seed_perf_data first')
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+
+        rng = random.Random(options['seed'])
+        scenarios = self.scenarios(rng)
+        if options['scenarios']:
+            unknown = set(options['scenarios']) - set(scenarios)
+            if unknown:
+                raise CommandError(f'Unknown scenario(s) {", ".join(sorted(unknown))}; choose from {", ".join(scenarios)}')
+            scenarios = {name: scenarios[name] for name in options['scenarios']}
+
+        # A private cache so runs don't read or pollute the real one, and no strict query budgets
+        isolated = override_settings(
+            CACHES={
+                'default': {'BACKEND': 'books.cache.TieredCache'},
+                'local': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark-local'},
+                'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark-shared'},
+            },
+            SQL_INSTRUMENTATION=False, METRICS_DIR=None,
+        )
+        results = {}
+        with GoogleBooksStub(options['google_latency'] / 1000) as stub, isolated, \
+                google_client.use_client(google_client.GoogleBooksClient(base_url=stub.url, max_retries=0)):
+            # Left behind by an interrupted run
+            User.objects.filter(username=BENCHMARK_USER).delete()
+            user = User.objects.create_user(
+                email=f'{BENCHMARK_USER}@example.com', username=BENCHMARK_USER, password=BENCHMARK_USER,
+            )
+            try:
+                self.clients = {'anonymous': Client(), 'signed_in': Client()}
+                self.clients['signed_in'].force_login(user)
+                cache.clear()
+                for name, (client, method, requests) in scenarios.items():
+                    results[name] = self.run(client, method, requests, options)
+                    self.stdout.write(self.format_row(name, results[name], baseline))
+            finally:
+                # Cascades to the benchmark's reviews, whose signals restore the rating aggregates
+                user.delete()
+                GoogleBook.objects.filter(google_id__startswith='stub-').delete()
+
+        report = {
+            'books': Books.objects.count(),
+            'iterations': options['iterations'],
+            'google_latency_ms': options['google_latency'],
+            'cold': options['cold'],
+            'google_requests': stub.requests,
+            'results': results,
+        }
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f'Results written to {options["json_path"]}')
+        if baseline and options['fail_over'] is not None:
+            regressed = [
+                name for name, result in results.items()
+                if name in baseline['results']
+                and result['p95_ms'] > baseline['results'][name]['p95_ms'] * (1 + options['fail_over'] / 100)
+            ]
+            if regressed:
+                raise CommandError(f'p95 regressed by more than {options["fail_over"]}%: {", ".join(regressed)}')
+
+    def scenarios(self, rng):
+        """
+        name -> (client name, HTTP method, URL factory or (URL factory, data factory));
+        the factories take the iteration number
+        """
+        # The most reviewed books (largest review pages) plus a random spread of the rest
+        popular = list(Books.objects.order_by('-rating_count').values_list('pk', flat=True)[:10])
+        bounds = Books.objects.order_by('pk').values_list('pk', flat=True)
+        low, high = bounds.first(), bounds.last()
+        spread = [
+            Books.objects.filter(pk__gte=rng.randint(low, high)).order_by('pk').values_list('pk', flat=True).first()
+            for _ in range(10)
+        ]
+        book_ids = popular + [pk for pk in spread if pk]
+        genres = list(Genre.objects.values_list('slug', flat=True)) or ['fiction']
+        words = rng.sample(WORDS, 10)
+        # Books the benchmark user reviews, one per request; reused only if the catalog is tiny
+        review_targets = list(Books.objects.order_by('-pk').values_list('pk', flat=True)[:500])
+
+        def pick(values):
+            return lambda i: values[i % len(values)]
+
+        def url(name, *args, **query):
+            def build(i):
+                resolved = reverse(name, args=[arg(i) for arg in args])
+                params = urlencode({key: value(i) for key, value in query.items()})
+                return f'{resolved}?{params}' if params else resolved
+            return build
+
+        anonymous, signed_in = 'anonymous', 'signed_in'
+        return {
+            'home': (anonymous, 'get', url('home')),
+            'book_list': (anonymous, 'get', url('book_list')),
+            'book_list_search': (anonymous, 'get', url('book_list', search=pick(words))),
+            'book_list_genre': (anonymous, 'get', url('book_list', genre=pick(genres))),
+            'book_list_author': (anonymous, 'get', url('book_list', author=pick(LAST_NAMES))),
+            'review_detail': (anonymous, 'get', url('review_detail', pick(book_ids))),
+            'api_book_list': (signed_in, 'get', url('api-book-list-create')),
+            'api_book_list_ordered': (signed_in, 'get', url('api-book-list-create', ordering=lambda i: '-price')),
+            'api_book_detail': (signed_in, 'get', url('api-book-detail', pick(book_ids))),
+            'api_book_search': (signed_in, 'get', url('api-book-search', q=pick(words))),
+            'api_review_create': (signed_in, 'post', (
+                url('api-review-create', pick(review_targets)),
+                lambda i: {'rating': 1 + i % 5, 'comment': 'Benchmark review'},
+            )),
+        }
+
+    def run(self, client_name, method, request, options):
+        client = self.clients[client_name]
+        build_url, build_data = request if isinstance(request, tuple) else (request, lambda i: None)
+        timings, queries, statuses = [], [], set()
+        for i in range(options['warmup'] + options['iterations']):
+            if options['cold']:
+                cache.clear()
+            send = getattr(client, method)
+            data = build_data(i)
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = send(build_url(i), data) if data is not None else send(build_url(i))
+                elapsed = time.perf_counter() - started
+            if i < options['warmup']:
+                continue
+            timings.append(elapsed * 1000)
+            queries.append(len(captured))
+            statuses.add(response.status_code)
+        p50, p95, p99 = percentiles(timings)
+        return {
+            'p50_ms': round(p50, 2), 'p95_ms': round(p95, 2), 'p99_ms': round(p99, 2),
+            'mean_ms': round(statistics.fmean(timings), 2),
+            'queries_median': statistics.median(queries), 'queries_max': max(queries),
+            'statuses': sorted(statuses),
+        }
+
+    def format_row(self, name, result, baseline):
+        row = (
+            f'{name:<24} p50 {result["p50_ms"]:>8.2f}  p95 {result["p95_ms"]:>8.2f}  p99 {result["p99_ms"]:>8.2f} ms  '
+            f'queries {result["queries_median"]:g} (max {result["queries_max"]})  status {result["statuses"]}'
+        )
+        previous = (baseline or {}).get('results', {}).get(name)
+        if previous:
+            change = (result['p95_ms'] - previous['p95_ms']) / previous['p95_ms'] * 100 if previous['p95_ms'] else 0
+            row += f'  | p95 {change:+.0f}% queries {result["queries_median"] - previous["queries_median"]:+g}'
+        return row
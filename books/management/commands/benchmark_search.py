@@ -0,0 +1,80 @@
+import random
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from books.models import Books, Genre
+from books.perf import FIRST_NAMES, GENRES, LAST_NAMES, WORDS
+from books.search import InvertedIndexBackend, get_search_backend
+
+QUERIES = ['dragon', 'shadow king', 'sil', '"golden crown"', 'garcia', 'fantasy winter', 'mo', '"the river"*']
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure search latency of the LIKE scan vs. the full-text index on a synthetic catalog. '
+        'The catalog is generated inside a transaction that is rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            self.generate(rng, options['books'])
+            backends = [get_search_backend()]
+            if not isinstance(backends[0], InvertedIndexBackend):
+                backends.append(InvertedIndexBackend())
+            for backend in backends:
+                started = time.perf_counter()
+                backend.rebuild()
+                self.stdout.write(f'{backend.name}: indexed in {time.perf_counter() - started:.2f}s')
+
+            columns = ['like'] + [backend.name for backend in backends]
+            self.stdout.write('query'.ljust(20) + ''.join(f'{name} p50/p95 (ms)'.rjust(26) for name in columns))
+            for query in QUERIES:
+                row = [self.measure(lambda: list(self.like_scan(query)), options['repeat'])]
+                for backend in backends:
+                    row.append(self.measure(lambda: backend.search(query, limit=1000), options['repeat']))
+                self.stdout.write(query.ljust(20) + ''.join(f'{p50:.2f} / {p95:.2f}'.rjust(26) for p50, p95 in row))
+            transaction.set_rollback(True)
+
+    def like_scan(self, query):
+        query = query.strip('"*')
+        return Books.objects.filter(
+            Q(title__icontains=query) | Q(author__icontains=query) | Q(genres__name__icontains=query)
+        ).distinct().values_list('pk', flat=True)[:1000]
+
+    def measure(self, fn, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fn()
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        return statistics.median(timings), timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+
+    def generate(self, rng, count):
+        genres = Genre.from_names(GENRES)
+        books = [
+            Books(
+                title=' '.join(rng.choice(WORDS).capitalize() for _ in range(rng.randint(2, 5))),
+                author=f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                description='',
+                price=rng.randint(5, 60),
+            )
+            for _ in range(count)
+        ]
+        books = Books.objects.bulk_create(books, batch_size=5000)
+        through = Books.genres.through
+        links = [
+            through(books_id=book.pk, genre_id=genre.pk)
+            for book in books
+            for genre in rng.sample(genres, rng.randint(1, 3))
+        ]
+        through.objects.bulk_create(links, batch_size=5000)
+        self.stdout.write(f'Generated {count} books')
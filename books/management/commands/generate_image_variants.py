@@ -0,0 +1,44 @@
+import time
+from django.core.management.base import BaseCommand
+from books import images
+from books.cache import CATALOG_VERSION, book_version_name, bump_version
+from books.models import Books
+
+
+class Command(BaseCommand):
+    help = (
+        'Render the resized WebP/JPEG cover variants of books whose image has none yet (or changed '
+        'since they were made). New uploads get them on save; this backfills existing images.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Regenerate variants of every book with an image')
+        parser.add_argument('--book', type=int, action='append', dest='book_ids', help='Only this book id (repeatable)')
+        parser.add_argument('--chunk-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        books = Books.objects.exclude(image='').exclude(image__isnull=True).only('id', 'image', 'image_variants')
+        if options['book_ids']:
+            books = books.filter(pk__in=options['book_ids'])
+
+        started = time.monotonic()
+        rendered = skipped = failed = 0
+        for book in books.order_by('pk').iterator(chunk_size=options['chunk_size']):
+            if not images.refresh_variants(book, force=options['force']):
+                skipped += 1
+                continue
+            if book.image_variants:
+                rendered += 1
+                bump_version(book_version_name(book.pk))
+                self.stdout.write(f'Rendered variants of book {book.pk}')
+            else:
+                failed += 1
+                self.stderr.write(f'Could not read the image of book {book.pk} ({book.image.name})')
+
+        if rendered:
+            # Card markup on the list pages changes too
+            bump_version(CATALOG_VERSION)
+        self.stdout.write(self.style.SUCCESS(
+            f'{rendered} books rendered, {skipped} already up to date, {failed} failed '
+            f'in {time.monotonic() - started:.1f}s'
+        ))
@@ -0,0 +1,215 @@
+import csv
+import hashlib
+import json
+import os
+import time
+from decimal import Decimal, InvalidOperation
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.dateparse import parse_date
+from books.cache import CATALOG_VERSION, bump_version
+from books.models import Books, Genre, User
+from books.search import rebuild_index
+from books.services import normalize_query
+
+FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.json': 'jsonl'}
+# Books.price is an IntegerField; anything outside this range fails the whole INSERT
+PRICE_RANGE = (-2 ** 31, 2 ** 31 - 1)
+
+
+def dedupe_key(title, author):
+    """
+    16-byte digest of the normalized title and author, small enough to keep millions in a set
+    """
+    text = f'{normalize_query(title)}\x1f{normalize_query(author)}'
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+
+class RowError(ValueError):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Import books from a CSV or JSON Lines file (columns/keys: title, author, description, price, '
+        'published_date, genres). Rows whose title and author already exist are skipped. Progress is '
+        'checkpointed after every transaction so an interrupted import can be resumed by running it again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', dest='fmt', choices=['csv', 'jsonl'], help='Default: from the file extension')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per INSERT')
+        parser.add_argument('--transaction-size', type=int, default=10000, help='Rows per transaction and checkpoint')
+        parser.add_argument('--checkpoint', help='Checkpoint file (default: <path>.checkpoint)')
+        parser.add_argument('--restart', action='store_true', help='Ignore an existing checkpoint')
+        parser.add_argument('--created-by', help='Username to record as creator of the imported books')
+        parser.add_argument('--skip-index', action='store_true', help="Don't rebuild the search index afterwards")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f'No such file: {path}')
+        fmt = options['fmt'] or FORMATS.get(os.path.splitext(path)[1].lower())
+        if fmt is None:
+            raise CommandError('Cannot tell the file format from its extension, pass --format')
+        self.created_by = None
+        if options['created_by']:
+            self.created_by = User.objects.filter(username=options['created_by']).first()
+            if self.created_by is None:
+                raise CommandError(f'No user named {options["created_by"]}')
+
+        checkpoint_path = options['checkpoint'] or f'{path}.checkpoint'
+        state = {'rows': 0, 'imported': 0, 'duplicates': 0, 'errors': 0}
+        if os.path.exists(checkpoint_path) and not options['restart']:
+            with open(checkpoint_path) as f:
+                state.update(json.load(f))
+            self.stdout.write(f'Resuming after row {state["rows"]}')
+
+        # Existing books are loaded once; a crash between a commit and its
+        # checkpoint only makes the resumed run skip those rows as duplicates
+        self.seen = {dedupe_key(title, author) for title, author in Books.objects.values_list('title', 'author').iterator()}
+
+        started = time.monotonic()
+        resumed_at = state['rows']
+        pending = []
+        for row_number, row in enumerate(self.read(path, fmt), 1):
+            if row_number <= resumed_at:
+                continue
+            pending.append((row_number, row))
+            if len(pending) >= options['transaction_size']:
+                self.commit(pending, state, options['batch_size'], checkpoint_path, started, resumed_at)
+                pending = []
+        if pending:
+            self.commit(pending, state, options['batch_size'], checkpoint_path, started, resumed_at)
+
+        if state['imported'] and not options['skip_index']:
+            self.stdout.write('Rebuilding the search index...')
+            rebuild_index()
+        bump_version(CATALOG_VERSION)
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {state["imported"]} books ({state["duplicates"]} duplicates, {state["errors"]} invalid rows skipped)'
+        ))
+
+    def read(self, path, fmt):
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            if fmt == 'csv':
+                yield from csv.DictReader(f)
+            else:
+                for line in f:
+                    line = line.strip()
+                    try:
+                        yield json.loads(line) if line else {}
+                    except ValueError:
+                        yield None
+
+    def parse(self, row):
+        """
+        (unsaved book, genre names) for a row, or RowError: nothing in a row may abort the import
+        """
+        if not isinstance(row, dict):
+            raise RowError('not a JSON object')
+        title = self.text(row, 'title').strip()
+        author = self.text(row, 'author').strip()
+        if not title or not author:
+            raise RowError('title and author are required')
+        try:
+            price = Decimal(str(row.get('price') or 0))
+        except InvalidOperation:
+            raise RowError(f'invalid price {row.get("price")!r}')
+        if not price.is_finite() or not PRICE_RANGE[0] <= round(price) <= PRICE_RANGE[1]:
+            raise RowError(f'invalid price {row.get("price")!r}')
+        text = self.text(row, 'published_date').strip()
+        try:
+            published = parse_date(text) if text else None
+        except ValueError:
+            published = None
+        if text and published is None:
+            raise RowError(f'invalid published_date {text!r}')
+        book = Books(
+            title=title[:200],
+            author=author[:200],
+            description=self.text(row, 'description')[:9999],
+            price=round(price),
+            published_date=published,
+            created_by=self.created_by,
+        )
+        return book, self.genres(row)
+
+    @staticmethod
+    def text(row, name):
+        value = row.get(name)
+        if value is None:
+            return ''
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            raise RowError(f'{name} must be a string, not {value!r}')
+        return str(value)
+
+    @staticmethod
+    def genres(row):
+        genres = row.get('genres') or []
+        if isinstance(genres, str):
+            # A JSON list (as written by export_catalog) or a comma-separated string
+            if genres.startswith('['):
+                try:
+                    genres = json.loads(genres)
+                except ValueError:
+                    raise RowError(f'invalid genres {genres!r}')
+            else:
+                genres = Genre.split(genres)
+        if not isinstance(genres, list) or not all(isinstance(name, str) for name in genres):
+            raise RowError(f'genres must be a list of names or a comma-separated string, not {genres!r}')
+        return genres
+
+    def commit(self, pending, state, batch_size, checkpoint_path, started, resumed_at):
+        books, genre_names = [], []
+        for row_number, row in pending:
+            try:
+                book, genres = self.parse(row)
+            except (RowError, ValueError) as e:
+                state['errors'] += 1
+                self.stderr.write(f'Row {row_number}: {e}')
+                continue
+            key = dedupe_key(book.title, book.author)
+            if key in self.seen:
+                state['duplicates'] += 1
+                continue
+            self.seen.add(key)
+            books.append(book)
+            genre_names.append(genres)
+
+        with transaction.atomic():
+            Books.objects.bulk_create(books, batch_size=batch_size)
+            self.link_genres(books, genre_names, batch_size)
+
+        state['rows'] = pending[-1][0]
+        state['imported'] += len(books)
+        self.save_checkpoint(checkpoint_path, state)
+        elapsed = time.monotonic() - started
+        rate = (state['rows'] - resumed_at) / elapsed if elapsed else 0
+        self.stdout.write(
+            f'{state["rows"]} rows read, {state["imported"]} imported, {state["duplicates"]} duplicates, '
+            f'{state["errors"]} invalid ({rate:,.0f} rows/s)'
+        )
+
+    def link_genres(self, books, genre_names, batch_size):
+        if not any(genre_names):
+            return
+        if any(book.pk is None for book in books):
+            # Databases that don't return ids from bulk inserts: titles and authors are unique here
+            ids = {
+                (title, author): pk for pk, title, author in Books.objects.filter(
+                    title__in=[book.title for book in books]
+                ).values_list('pk', 'title', 'author')
+            }
+            for book in books:
+                book.pk = ids.get((book.title, book.author))
+        Books.link_genre_names(books, genre_names, batch_size)
+
+    def save_checkpoint(self, path, state):
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(state, f)
+        os.replace(temporary, path)
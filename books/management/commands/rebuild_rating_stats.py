@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from books.cache import CATALOG_VERSION, book_version_name, bump_version
+from books.models import Books, Review
+
+FIELDS = ['rating_avg', 'rating_count', 'rating_histogram', 'updated_at']
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the stored rating aggregates (average, count, histogram) of every book from its reviews'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        histograms = {}
+        rows = Review.objects.values('book_id', 'rating').annotate(n=Count('id')).order_by()
+        for row in rows.iterator():
+            histograms.setdefault(row['book_id'], {})[row['rating']] = row['n']
+
+        checked = updated = 0
+        now = timezone.now()
+        with transaction.atomic():
+            batch = []
+            books = Books.objects.select_for_update().only('rating_avg', 'rating_count', 'rating_histogram')
+            for book in books.iterator(chunk_size=batch_size):
+                checked += 1
+                stored = (book.rating_avg, book.rating_count, book.rating_histogram)
+                book.set_rating_histogram(histograms.get(book.pk, {}))
+                if (book.rating_avg, book.rating_count, book.rating_histogram) == stored:
+                    continue
+                book.updated_at = now
+                batch.append(book)
+                if len(batch) >= batch_size:
+                    updated += self.save(batch)
+                    batch = []
+            if batch:
+                updated += self.save(batch)
+            if updated:
+                # Cached pages and list validators show the ratings (bulk_update skips the signals)
+                bump_version(CATALOG_VERSION)
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rating stats for {checked} books, {updated} changed'))
+
+    @staticmethod
+    def save(batch):
+        Books.objects.bulk_update(batch, FIELDS)
+        bump_version(*(book_version_name(book.pk) for book in batch))
+        return len(batch)
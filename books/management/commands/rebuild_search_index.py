@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from books.search import BOOKS, GOOGLE_BOOKS, get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search indexes for local books and stored Google Books'
+
+    def handle(self, *args, **options):
+        for corpus, label in ((BOOKS, 'books'), (GOOGLE_BOOKS, 'Google Books')):
+            backend = get_search_backend(corpus)
+            count = backend.rebuild()
+            self.stdout.write(self.style.SUCCESS(f'Indexed {count} {label} with the {backend.name} backend'))
@@ -0,0 +1,50 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from books.cache import CATALOG_VERSION, bump_version
+from books.perf import SIZES, delete_catalog, generate_catalog
+from books.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate a deterministic synthetic catalog for benchmarks: books with Zipf-distributed genres '
+        'and long-tail review counts, owned by perf_user_* accounts (password "perf"). A previous '
+        'synthetic catalog is replaced; other data is left alone.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', choices=list(SIZES), default='10k')
+        parser.add_argument('--books', type=int, help='Exact number of books (overrides --size)')
+        parser.add_argument('--users', type=int, default=1000, help='Reviewer accounts to create')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Books per transaction')
+        parser.add_argument('--delete', action='store_true', help='Only remove the synthetic catalog')
+        parser.add_argument('--skip-index', action='store_true', help="Don't rebuild the search index afterwards")
+
+    def handle(self, *args, **options):
+        books = options['books'] if options['books'] is not None else SIZES[options['size']]
+        if books < 0 or options['users'] < 1:
+            raise CommandError('--books must be positive and --users at least 1')
+
+        started = time.monotonic()
+        deleted = delete_catalog()
+        if deleted:
+            self.stdout.write(f'Removed the previous synthetic catalog ({deleted} books)')
+        if not options['delete']:
+            def progress(books_done, reviews_done):
+                rate = books_done / (time.monotonic() - started)
+                self.stdout.write(f'{books_done}/{books} books, {reviews_done} reviews ({rate:,.0f} books/s)')
+
+            created, reviews = generate_catalog(
+                books, users=options['users'], seed=options['seed'], chunk_size=options['chunk_size'],
+                progress=progress,
+            )
+        if not options['skip_index']:
+            self.stdout.write('Rebuilding the search index...')
+            rebuild_index()
+        bump_version(CATALOG_VERSION)
+        if not options['delete']:
+            self.stdout.write(self.style.SUCCESS(
+                f'Created {created} books, {reviews} reviews and {options["users"]} users '
+                f'(seed {options["seed"]}) in {time.monotonic() - started:.1f}s'
+            ))
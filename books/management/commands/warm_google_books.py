@@ -0,0 +1,72 @@
+import time
+from django.core.management.base import BaseCommand
+from books.google_client import get_client
+from books.models import GoogleBook
+from books.services import GoogleBooksService
+
+
+class Command(BaseCommand):
+    help = (
+        'Refresh the cached featured Google Books searches and the most viewed book details before '
+        'they expire, so visitors never wait on the API for them. Meant to run from cron more often '
+        'than the refresh margin, e.g. every 10 minutes with the default --ahead.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--query', action='append', dest='queries',
+            help="Featured query to warm (repeatable). Default: DEFAULT_API_CONFIG['featured_categories']",
+        )
+        parser.add_argument('--details', type=int, default=50, help='How many of the most viewed books to warm')
+        parser.add_argument('--budget', type=int, default=100, help='Maximum Google Books API requests, retries included')
+        parser.add_argument('--ahead', type=int, default=900, help='Refresh entries that expire within this many seconds')
+
+    def handle(self, *args, **options):
+        service = GoogleBooksService()
+        queries = options['queries'] or service.FEATURED_QUERIES
+        popular = GoogleBook.objects.filter(view_count__gt=0).order_by('-view_count').values_list('google_id', flat=True)
+
+        # Featured lists first: every home page view needs them
+        tasks = [
+            (f'search "{query}"', lambda query=query: service.refresh_search(
+                query, service.FEATURED_PER_QUERY, ahead=options['ahead'],
+            ))
+            for query in queries
+        ]
+        tasks += [
+            (f'book {google_id}', lambda google_id=google_id: service.refresh_book_details(
+                google_id, ahead=options['ahead'],
+            ))
+            for google_id in popular[:options['details']]
+        ]
+
+        client = get_client()
+        calls_before = self.api_calls(client)
+        started = time.monotonic()
+        refreshed = fresh = failed = 0
+        for done, (label, task) in enumerate(tasks):
+            used = self.api_calls(client) - calls_before
+            if used >= options['budget']:
+                self.stdout.write(self.style.WARNING(
+                    f'Request budget of {options["budget"]} spent, {len(tasks) - done} entries left unwarmed'
+                ))
+                break
+            try:
+                if task():
+                    refreshed += 1
+                    self.stdout.write(f'Refreshed {label}')
+                else:
+                    fresh += 1
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f'Failed to refresh {label}: {e}')
+
+        used = self.api_calls(client) - calls_before
+        self.stdout.write(self.style.SUCCESS(
+            f'{refreshed} refreshed, {fresh} still fresh, {failed} failed; '
+            f'{used} API requests in {time.monotonic() - started:.1f}s'
+        ))
+
+    @staticmethod
+    def api_calls(client):
+        return sum(stats['calls'] for stats in client.metrics().values())
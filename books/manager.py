@@ -1,4 +1,8 @@
+import random
 from django.contrib.auth.base_user import BaseUserManager
+from django.db import models
+from django.db.models import Case, When, Value, IntegerField, Min, Max
+from django.utils.text import slugify
 
 class UserManager(BaseUserManager):
     use_in_migrations = True
@@ -22,4 +26,78 @@ class UserManager(BaseUserManager):
         if extra_fields.get('is_superuser') is not True:
             raise ValueError('Superuser must have is_superuser=True.')
 
-        return self.create_user(email, password, **extra_fields)
\ No newline at end of file
+        return self.create_user(email, password, **extra_fields)
+
+
+def _ranked(queryset, ids):
+    """
+    Rows with the given primary keys, annotated with their position as search_rank and ordered by it
+    """
+    if not ids:
+        return queryset.none()
+    rank = Case(*[When(pk=pk, then=Value(i)) for i, pk in enumerate(ids)], output_field=IntegerField())
+    return queryset.filter(pk__in=ids).annotate(search_rank=rank).order_by('search_rank')
+
+
+class BooksQuerySet(models.QuerySet):
+    def for_listing(self):
+        """
+        Everything a list/search page needs in a fixed number of queries: ratings are
+        read from the denormalized columns on Books, the creator is joined in and
+        genres are prefetched in one extra query.
+        """
+        return self.select_related('created_by').prefetch_related('genres')
+
+    def with_genre(self, genre):
+        return self.filter(genres__slug=slugify(genre.strip(), allow_unicode=True))
+
+    def search(self, query):
+        """
+        Full-text search (see books/search.py), ordered by relevance
+        """
+        from .search import search_book_ids
+        return _ranked(self, search_book_ids(query))
+
+    def random_sample(self, count, attempts=3):
+        """
+        Up to `count` random rows without loading or sorting the table: random
+        primary keys are drawn from the id range and looked up through the index,
+        oversampling to cover gaps left by deleted rows.
+        """
+        bounds = self.aggregate(low=Min('pk'), high=Max('pk'))
+        low, high = bounds['low'], bounds['high']
+        if low is None:
+            return []
+
+        picked = {}
+        for _ in range(attempts):
+            need = count - len(picked)
+            if need <= 0:
+                break
+            candidates = {random.randint(low, high) for _ in range(need * 4)} - picked.keys()
+            found = list(self.filter(pk__in=candidates))
+            for book in random.sample(found, min(need, len(found))):
+                picked[book.pk] = book
+
+        need = count - len(picked)
+        if need > 0:
+            # Very sparse ids: take a run of rows after a random starting point
+            start = random.randint(low, high)
+            rest = self.exclude(pk__in=picked.keys()).order_by('pk')
+            found = list(rest.filter(pk__gte=start)[:need])
+            if len(found) < need:
+                found += list(rest.filter(pk__lt=start)[:need - len(found)])
+            picked.update((book.pk, book) for book in found)
+
+        books = list(picked.values())
+        random.shuffle(books)
+        return books
+
+
+class GoogleBookQuerySet(models.QuerySet):
+    def search(self, query):
+        """
+        Full-text search of the local mirror over title, authors and categories, ordered by relevance
+        """
+        from .search import search_google_book_ids
+        return _ranked(self, search_google_book_ids(query))
@@ -0,0 +1,296 @@
+"""
+Process metrics in the Prometheus text format, aggregated across workers.
+
+Each process keeps counters and histograms in memory (a dict update under a
+lock per observation). Every METRICS_FLUSH_INTERVAL seconds, after a
+request, and at exit the process writes a snapshot of them to its own file
+in METRICS_DIR. The /metrics view merges every worker's file, with its own
+live values in place of its file, by summing. A worker's requests therefore
+show up at most one flush interval late. Without METRICS_DIR only the
+serving process is reported.
+
+Under gunicorn (gunicorn.conf.py) the master empties METRICS_DIR when it
+starts, and folds the file of each worker that exits into exited.json, so
+counters stay monotonic while the directory holds one file per live worker.
+"""
+import atexit
+import hmac
+import ipaddress
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from django.conf import settings
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    'http_request_duration_seconds': (
+        'histogram', 'Time spent handling requests, by view',
+        (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    ),
+    'http_responses_total': ('counter', 'Responses sent, by view and status code', None),
+    'db_queries_total': ('counter', 'SQL queries run while handling requests, by view', None),
+    'db_query_duration_seconds_total': ('counter', 'Time spent in SQL queries while handling requests, by view', None),
+    'google_books_request_duration_seconds': (
+        'histogram', 'Google Books API request latency, by endpoint and outcome, retries counted separately',
+        (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10),
+    ),
+    'google_books_retries_total': ('counter', 'Google Books API requests retried, by endpoint', None),
+    'cache_lookups_total': (
+        'counter', 'Cached upstream lookups by key prefix and result (hit, stale, miss, failure)', None,
+    ),
+}
+PREFIX = 'bookstore_'
+
+_DIGEST = re.compile(r'_[0-9a-f]{32}')
+
+
+def key_prefix(key):
+    """
+    'google_book_detail_<digest>' -> 'google_book_detail' (keys from books.cache.make_key)
+    """
+    return _DIGEST.sub('', key)
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        # (name, labels) -> [count per bucket..., count, sum]
+        self._histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        buckets = METRICS[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            series = self._histograms.get(key)
+            if series is None:
+                series = self._histograms[key] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                'histograms': [[name, list(labels), list(series)] for (name, labels), series in self._histograms.items()],
+            }
+
+
+registry = Registry()
+inc = registry.inc
+observe = registry.observe
+
+# Totals of workers that have exited, see mark_process_dead()
+EXITED_FILE = 'exited.json'
+
+# One file per process; the start time keeps a reused pid from overwriting a dead worker's totals
+_process_file = f'{os.getpid()}-{int(time.time() * 1000)}.json'
+_last_flush = 0.0
+_flush_lock = threading.Lock()
+
+
+def _metrics_dir():
+    return getattr(settings, 'METRICS_DIR', None)
+
+
+def _write_snapshot(directory, name, snapshot):
+    os.makedirs(directory, exist_ok=True)
+    fd, temporary = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(temporary, os.path.join(directory, name))
+
+
+def _read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # Vanished or half-written by a crashed worker
+        return None
+
+
+def flush(force=False):
+    """
+    Write this process's snapshot to METRICS_DIR if the flush interval has passed (or force)
+    """
+    global _last_flush
+    directory = _metrics_dir()
+    if not directory:
+        return
+    now = time.monotonic()
+    if not force and now - _last_flush < getattr(settings, 'METRICS_FLUSH_INTERVAL', 5):
+        return
+    if not _flush_lock.acquire(blocking=False):
+        return
+    try:
+        _last_flush = now
+        _write_snapshot(directory, _process_file, registry.snapshot())
+    finally:
+        _flush_lock.release()
+
+
+def _flush_at_exit():
+    # Only processes that served requests (and flushed before) leave a file, not every management command
+    if not _last_flush:
+        return
+    try:
+        flush(force=True)
+    except Exception:
+        pass
+
+
+atexit.register(_flush_at_exit)
+
+
+def reset():
+    """
+    Delete every snapshot in METRICS_DIR; run by the gunicorn master before it forks any worker
+    """
+    directory = _metrics_dir()
+    if not directory or not os.path.isdir(directory):
+        return
+    for entry in os.scandir(directory):
+        if entry.name.endswith('.json') or entry.name.startswith('.tmp-'):
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+def mark_process_dead(pid):
+    """
+    Fold the snapshot of exited worker pid into EXITED_FILE and delete it. Only the
+    gunicorn master calls this (child_exit), so the read-modify-write needs no lock.
+    """
+    directory = _metrics_dir()
+    if not directory or not os.path.isdir(directory):
+        return
+    files = [entry.path for entry in os.scandir(directory) if entry.name.startswith(f'{pid}-')]
+    if not files:
+        return
+    snapshots = [_read_snapshot(os.path.join(directory, EXITED_FILE))] + [_read_snapshot(path) for path in files]
+    counters, histograms = _merge(snapshot for snapshot in snapshots if snapshot)
+    _write_snapshot(directory, EXITED_FILE, {
+        'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+        'histograms': [[name, list(labels), series] for (name, labels), series in histograms.items()],
+    })
+    for path in files:
+        os.remove(path)
+
+
+def _merge(snapshots):
+    counters, histograms = {}, {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, series in snapshot['histograms']:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            merged = histograms.get(key)
+            histograms[key] = series if merged is None else [a + b for a, b in zip(merged, series)]
+    return counters, histograms
+
+
+def collect():
+    """
+    Merge the snapshots of every worker into {(name, labels): value or histogram series}
+    """
+    snapshots = [registry.snapshot()]
+    directory = _metrics_dir()
+    if directory and os.path.isdir(directory):
+        for entry in os.scandir(directory):
+            if entry.name == _process_file or entry.name.startswith('.tmp-') or not entry.name.endswith('.json'):
+                continue
+            snapshot = _read_snapshot(entry.path)
+            if snapshot:
+                snapshots.append(snapshot)
+    return _merge(snapshots)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def cache_hit_ratios(counters):
+    """
+    Share of cache lookups answered from the cache (fresh or stale), by key prefix
+    """
+    totals, hits = {}, {}
+    for (name, labels), value in counters.items():
+        if name != 'cache_lookups_total':
+            continue
+        labels = dict(labels)
+        totals[labels['prefix']] = totals.get(labels['prefix'], 0) + value
+        if labels['result'] in ('hit', 'stale'):
+            hits[labels['prefix']] = hits.get(labels['prefix'], 0) + value
+    return {prefix: hits.get(prefix, 0) / total for prefix, total in totals.items() if total}
+
+
+def render():
+    counters, histograms = collect()
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        series = histograms if kind == 'histogram' else counters
+        keys = sorted(key for key in series if key[0] == name)
+        lines.append(f'# HELP {PREFIX}{name} {help_text}')
+        lines.append(f'# TYPE {PREFIX}{name} {kind}')
+        for key in keys:
+            labels = key[1]
+            if kind == 'counter':
+                lines.append(f'{PREFIX}{name}{_labels(labels)} {_number(series[key])}')
+                continue
+            values = series[key]
+            for bound, count in zip(buckets, values):
+                lines.append(f'{PREFIX}{name}_bucket{_labels(labels, [("le", bound)])} {count}')
+            lines.append(f'{PREFIX}{name}_bucket{_labels(labels, [("le", "+Inf")])} {values[-2]}')
+            lines.append(f'{PREFIX}{name}_sum{_labels(labels)} {_number(values[-1])}')
+            lines.append(f'{PREFIX}{name}_count{_labels(labels)} {values[-2]}')
+
+    lines.append(f'# HELP {PREFIX}cache_hit_ratio Share of cached upstream lookups served from the cache, by key prefix')
+    lines.append(f'# TYPE {PREFIX}cache_hit_ratio gauge')
+    for prefix, ratio in sorted(cache_hit_ratios(counters).items()):
+        lines.append(f'{PREFIX}cache_hit_ratio{_labels([("prefix", prefix)])} {ratio!r}')
+    return '\n'.join(lines) + '\n'
+
+
+def is_internal(request):
+    """
+    Whether request may read /metrics: with the METRICS_TOKEN bearer token, or from
+    METRICS_ALLOWED_NETWORKS unless METRICS_REQUIRE_TOKEN (behind a proxy REMOTE_ADDR is the proxy's)
+    """
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return True
+    if getattr(settings, 'METRICS_REQUIRE_TOKEN', False):
+        return False
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(
+        address in ipaddress.ip_network(network)
+        for network in getattr(settings, 'METRICS_ALLOWED_NETWORKS', ['127.0.0.0/8', '::1/128'])
+    )
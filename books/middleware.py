@@ -0,0 +1,175 @@
+"""
+Per-request SQL instrumentation.
+
+QueryInstrumentationMiddleware counts every query a request runs (through
+connection.execute_wrapper, so nothing depends on DEBUG), sums their
+database time and groups them by shape: the SQL with literals and
+placeholder lists collapsed, so the 20 lookups of an N+1 loop share one
+shape. The totals go out as a Server-Timing header and a 'books.sql' log
+record. In strict mode (meant for the test suite) a request over its
+query budget, or repeating one shape more than SQL_DUPLICATE_QUERY_LIMIT
+times, raises QueryBudgetExceeded instead of returning.
+
+Enabled by SQL_INSTRUMENTATION; views can set their own limits with @query_budget.
+
+MetricsMiddleware feeds the always-on Prometheus metrics (books/metrics.py):
+latency, status and query count per view.
+"""
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from . import metrics
+
+logger = logging.getLogger('books.sql')
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'(?:%s|\?)(?:\s*,\s*(?:%s|\?))+')
+_SPACE = re.compile(r'\s+')
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_shape(sql):
+    """
+    SQL with literals replaced by ? and IN (...) lists collapsed
+    """
+    shape = _STRING.sub('?', sql)
+    shape = _NUMBER.sub('?', shape)
+    shape = shape.replace('%s', '?')
+    shape = _PLACEHOLDER_LIST.sub('?, ...', shape)
+    return _SPACE.sub(' ', shape).strip()
+
+
+class QueryRecorder:
+    """
+    execute_wrapper that tallies query count, duration and (unless shapes=False) shapes
+    """
+    def __init__(self, shapes=True):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter() if shapes else None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            if self.shapes is not None:
+                self.shapes[query_shape(sql)] += 1
+
+    def repeated(self, limit=1):
+        """
+        (shape, count) pairs run more than limit times, most repeated first
+        """
+        return [(shape, n) for shape, n in self.shapes.most_common() if n > limit]
+
+
+def query_budget(queries=None, duplicates=None):
+    """
+    Override SQL_QUERY_BUDGET / SQL_DUPLICATE_QUERY_LIMIT for one view
+    """
+    def decorator(view):
+        view.query_budget = (queries, duplicates)
+        return view
+    return decorator
+
+
+class QueryInstrumentationMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'SQL_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        request.query_budget = (None, None)
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        total = time.perf_counter() - started
+
+        queries, duplicates = request.query_budget
+        budget = queries if queries is not None else getattr(settings, 'SQL_QUERY_BUDGET', 50)
+        limit = duplicates if duplicates is not None else getattr(settings, 'SQL_DUPLICATE_QUERY_LIMIT', 5)
+        repeated = recorder.repeated(limit)
+
+        self.add_server_timing(response, recorder, total)
+        self.log(request, response, recorder, total, budget, repeated)
+        if getattr(settings, 'SQL_INSTRUMENTATION_STRICT', False):
+            if recorder.count > budget:
+                raise QueryBudgetExceeded(
+                    f'{request.method} {request.path} ran {recorder.count} queries, over its budget of {budget}'
+                )
+            if repeated:
+                shape, n = repeated[0]
+                raise QueryBudgetExceeded(
+                    f'{request.method} {request.path} ran the same query {n} times (limit {limit}): {shape}'
+                )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = getattr(view_func, 'view_class', view_func)
+        request.query_budget = getattr(view_func, 'query_budget', None) or getattr(view, 'query_budget', (None, None))
+
+    @staticmethod
+    def add_server_timing(response, recorder, total):
+        entries = [
+            f'db;dur={recorder.duration * 1000:.1f};desc="{recorder.count} queries"',
+            f'app;dur={total * 1000:.1f}',
+        ]
+        if response.has_header('Server-Timing'):
+            entries.insert(0, response['Server-Timing'])
+        response['Server-Timing'] = ', '.join(entries)
+
+    @staticmethod
+    def log(request, response, recorder, total, budget, repeated):
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': recorder.count,
+            'db_ms': round(recorder.duration * 1000, 1),
+            'total_ms': round(total * 1000, 1),
+            'repeated': [{'shape': shape, 'count': n} for shape, n in repeated[:3]],
+        }
+        level = logging.WARNING if repeated or recorder.count > budget else logging.INFO
+        logger.log(level, f"sql {json.dumps(record)}", extra={'sql': record})
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder(shapes=False)
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        # Unrouted paths share one label so scanners can't blow up the series count
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+        metrics.observe('http_request_duration_seconds', elapsed, view=view, method=request.method)
+        metrics.inc('http_responses_total', view=view, status=str(response.status_code))
+        metrics.inc('db_queries_total', recorder.count, view=view)
+        metrics.inc('db_query_duration_seconds_total', recorder.duration, view=view)
+        metrics.flush()
+        return response
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.3 on 2026-10-18 08:21
+
+from django.db import migrations, models
+
+
+def populate_rating_stats(apps, schema_editor):
+    Books = apps.get_model('books', 'Books')
+    Review = apps.get_model('books', 'Review')
+    histograms = {}
+    for row in Review.objects.values('book_id', 'rating').annotate(n=models.Count('id')).order_by():
+        histograms.setdefault(row['book_id'], {})[str(row['rating'])] = row['n']
+    books = []
+    for book in Books.objects.filter(pk__in=histograms):
+        histogram = histograms[book.pk]
+        book.rating_histogram = histogram
+        book.rating_count = sum(histogram.values())
+        book.rating_avg = sum(int(star) * n for star, n in histogram.items()) / book.rating_count
+        books.append(book)
+    Books.objects.bulk_update(books, ['rating_avg', 'rating_count', 'rating_histogram'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0006_googlebook'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='books',
+            name='rating_avg',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='books',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='books',
+            name='rating_histogram',
+            field=models.JSONField(blank=True, default=dict, help_text='Number of reviews per star rating'),
+        ),
+        migrations.RunPython(populate_rating_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.3 on 2026-10-18 09:02
+
+from django.db import migrations, models
+from django.utils.text import slugify
+
+
+def split_genres(apps, schema_editor):
+    Books = apps.get_model('books', 'Books')
+    Genre = apps.get_model('books', 'Genre')
+    genres = {}
+    links = []
+    for book in Books.objects.exclude(genres_text__isnull=True).exclude(genres_text='').only('pk', 'genres_text'):
+        seen = set()
+        for name in book.genres_text.split(','):
+            name = name.strip()[:100]
+            slug = slugify(name, allow_unicode=True)[:100]
+            if not slug or slug in seen:
+                continue
+            seen.add(slug)
+            if slug not in genres:
+                genres[slug] = Genre.objects.create(name=name, slug=slug)
+            links.append(Books.genres.through(books_id=book.pk, genre_id=genres[slug].pk))
+    Books.genres.through.objects.bulk_create(links, batch_size=500)
+
+
+def join_genres(apps, schema_editor):
+    Books = apps.get_model('books', 'Books')
+    for book in Books.objects.prefetch_related('genres'):
+        book.genres_text = ', '.join(genre.name for genre in book.genres.all()) or None
+        book.save(update_fields=['genres_text'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0007_books_rating_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Genre',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('slug', models.SlugField(allow_unicode=True, max_length=100, unique=True)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.RenameField(
+            model_name='books',
+            old_name='genres',
+            new_name='genres_text',
+        ),
+        migrations.AddField(
+            model_name='books',
+            name='genres',
+            field=models.ManyToManyField(blank=True, related_name='books', to='books.genre'),
+        ),
+        migrations.RunPython(split_genres, join_genres),
+        migrations.RemoveField(
+            model_name='books',
+            name='genres_text',
+        ),
+    ]
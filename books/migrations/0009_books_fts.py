@@ -0,0 +1,43 @@
+# Generated by Django 5.2.3 on 2026-10-18 09:40
+
+from django.db import migrations
+
+
+def create_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    Books = apps.get_model('books', 'Books')
+    Through = Books.genres.through
+    genres = {}
+    for book_id, name in Through.objects.values_list('books_id', 'genre__name'):
+        genres.setdefault(book_id, []).append(name)
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS books_books_fts USING fts5("
+            "title, author, genres, tokenize='unicode61 remove_diacritics 2')"
+        )
+        cursor.executemany(
+            'INSERT INTO books_books_fts (rowid, title, author, genres) VALUES (%s, %s, %s, %s)',
+            [
+                [book.pk, book.title, book.author, ' '.join(genres.get(book.pk, []))]
+                for book in Books.objects.only('pk', 'title', 'author')
+            ],
+        )
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS books_books_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0008_genre_books_genres'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
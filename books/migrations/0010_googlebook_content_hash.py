@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 08:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0009_books_fts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='googlebook',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', help_text='Hash of the last API payload stored in this row', max_length=64),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.3 on 2026-10-18 08:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0010_googlebook_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='books',
+            index=models.Index(fields=['title', 'id'], name='books_title_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='books',
+            index=models.Index(fields=['author', 'id'], name='books_author_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='books',
+            index=models.Index(fields=['price', 'id'], name='books_price_id_idx'),
+        ),
+    ]
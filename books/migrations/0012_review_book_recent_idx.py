@@ -0,0 +1,17 @@
+# Generated by Django 5.2.3 on 2026-10-18 08:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0011_books_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['book', '-updated_at', '-id'], name='books_review_book_recent_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 08:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0012_review_book_recent_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='books',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
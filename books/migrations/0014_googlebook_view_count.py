@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 08:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0013_books_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='googlebook',
+            name='view_count',
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+    ]
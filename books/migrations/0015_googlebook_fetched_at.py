@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 08:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0014_googlebook_view_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='googlebook',
+            name='fetched_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
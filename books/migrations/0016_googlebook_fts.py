@@ -0,0 +1,39 @@
+# Generated by Django 5.2.3 on 2026-10-18 10:12
+
+from django.db import migrations
+
+
+def create_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    GoogleBook = apps.get_model('books', 'GoogleBook')
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS books_googlebook_fts USING fts5("
+            "title, authors, categories, tokenize='unicode61 remove_diacritics 2')"
+        )
+        cursor.executemany(
+            'INSERT INTO books_googlebook_fts (rowid, title, authors, categories) VALUES (%s, %s, %s, %s)',
+            [
+                [book.pk, book.title, ' '.join(book.authors or []), ' '.join(book.categories or [])]
+                for book in GoogleBook.objects.only('pk', 'title', 'authors', 'categories').iterator()
+            ],
+        )
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS books_googlebook_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0015_googlebook_fetched_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 08:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0016_googlebook_fts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='books',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -1,6 +1,10 @@
-from django.db import models
+import random
+from django.conf import settings
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
-from .manager import UserManager
+from django.utils import timezone
+from django.utils.text import slugify
+from .manager import UserManager, BooksQuerySet, GoogleBookQuerySet
 
 class User(AbstractUser):
     username = models.CharField(max_length=150, unique=True)
@@ -16,24 +20,168 @@ class User(AbstractUser):
     def __str__(self):
         return self.email
 
+class Genre(models.Model):
+    name = models.CharField(max_length=100)
+    slug = models.SlugField(max_length=100, unique=True, allow_unicode=True)
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+    @staticmethod
+    def make_slug(name):
+        return slugify(name.strip(), allow_unicode=True)[:100]
+
+    @staticmethod
+    def split(text):
+        """
+        Split a comma-separated genre string into unique, non-empty names
+        """
+        names = {}
+        for name in (text or '').split(','):
+            name = name.strip()
+            slug = Genre.make_slug(name)
+            if slug and slug not in names:
+                names[slug] = name[:100]
+        return list(names.values())
+
+    @classmethod
+    def from_names(cls, names):
+        """
+        Return Genre rows for the given names, creating the missing ones
+        """
+        wanted = {}
+        for name in names:
+            slug = cls.make_slug(name)
+            if slug:
+                wanted.setdefault(slug, name.strip()[:100])
+        existing = {genre.slug: genre for genre in cls.objects.filter(slug__in=wanted)}
+        missing = [cls(name=name, slug=slug) for slug, name in wanted.items() if slug not in existing]
+        if missing:
+            cls.objects.bulk_create(missing, ignore_conflicts=True)
+            existing = {genre.slug: genre for genre in cls.objects.filter(slug__in=wanted)}
+        return [existing[slug] for slug in wanted if slug in existing]
+
 class Books(models.Model):
     title = models.CharField(max_length=200)
     author = models.CharField(max_length=200)
     description = models.CharField(max_length=9999)
     price = models.IntegerField()
     image = models.ImageField(upload_to='book_images/', blank=True, null=True)
+    # Resized copies of image by variant name, see books/images.py
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     published_date = models.DateField(blank=True, null=True)
-    genres = models.TextField(blank=True, null=True, help_text='Comma-separated list of genres')
+    genres = models.ManyToManyField(Genre, blank=True, related_name='books')
     created_by = models.ForeignKey('User', on_delete=models.CASCADE, null=True, blank=True, related_name='books')
+    rating_avg = models.FloatField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_histogram = models.JSONField(default=dict, blank=True, help_text='Number of reviews per star rating')
+    # Bumped by every write that changes what the book's pages show (see books/conditional.py)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = BooksQuerySet.as_manager()
+
+    class Meta:
+        # Keyset pagination sort keys (books/pagination.py)
+        indexes = [
+            models.Index(fields=['title', 'id'], name='books_title_id_idx'),
+            models.Index(fields=['author', 'id'], name='books_author_id_idx'),
+            models.Index(fields=['price', 'id'], name='books_price_id_idx'),
+        ]
 
     def get_genre_list(self):
-        return [g.strip() for g in self.genres.split(',')] if self.genres else []
+        # Served from prefetch_related('genres') when the queryset provides it
+        return [genre.name for genre in self.genres.all()]
+
+    def set_genre_names(self, names):
+        self.genres.set(Genre.from_names(names))
 
     def get_genre_display(self):
         return ', '.join(self.get_genre_list())
 
     def average_rating(self):
-        return self.reviews.aggregate(models.Avg('rating'))['rating__avg'] or 0
+        return self.rating_avg
+
+    def cover(self, size):
+        """
+        URLs and dimensions of the size ('card' or 'detail') cover variant at
+        1x and 2x, or None when no variants were generated
+        """
+        variants = self.image_variants or {}
+        if size not in variants:
+            return None
+        return {'1x': variants[size], '2x': variants.get(f'{size}_2x', variants[size])}
+
+    def set_rating_histogram(self, histogram):
+        """
+        Store a {rating: count} histogram and derive count and average from it
+        """
+        histogram = {str(star): n for star, n in histogram.items() if n > 0}
+        total = sum(histogram.values())
+        self.rating_histogram = histogram
+        self.rating_count = total
+        self.rating_avg = sum(int(star) * n for star, n in histogram.items()) / total if total else 0
+
+    def recalculate_rating_stats(self):
+        rows = self.reviews.values('rating').annotate(n=models.Count('id'))
+        self.set_rating_histogram({row['rating']: row['n'] for row in rows})
+
+    @classmethod
+    def adjust_rating_stats(cls, book_id, added=None, removed=None):
+        """
+        Apply one review rating being added and/or removed to the stored aggregates
+        """
+        with transaction.atomic():
+            book = cls.objects.select_for_update().filter(pk=book_id).only(
+                'rating_avg', 'rating_count', 'rating_histogram'
+            ).first()
+            if book is None:
+                return
+            histogram = dict(book.rating_histogram or {})
+            if removed is not None:
+                histogram[str(removed)] = histogram.get(str(removed), 0) - 1
+            if added is not None:
+                histogram[str(added)] = histogram.get(str(added), 0) + 1
+            book.set_rating_histogram(histogram)
+            book.save(update_fields=['rating_avg', 'rating_count', 'rating_histogram', 'updated_at'])
+
+    @classmethod
+    def add_ratings(cls, ratings_by_book):
+        """
+        Apply many new review ratings ({book_id: [rating, ...]}) to the stored aggregates in one pass,
+        for reviews inserted with bulk_create (which skips the signals)
+        """
+        with transaction.atomic():
+            books = list(cls.objects.select_for_update().filter(pk__in=ratings_by_book).only(
+                'rating_avg', 'rating_count', 'rating_histogram'
+            ))
+            now = timezone.now()
+            for book in books:
+                histogram = dict(book.rating_histogram or {})
+                for rating in ratings_by_book[book.pk]:
+                    histogram[str(rating)] = histogram.get(str(rating), 0) + 1
+                book.set_rating_histogram(histogram)
+                book.updated_at = now
+            cls.objects.bulk_update(books, ['rating_avg', 'rating_count', 'rating_histogram', 'updated_at'])
+
+    @classmethod
+    def link_genre_names(cls, books, genre_names, batch_size=None):
+        """
+        Bulk-insert the genre links of freshly bulk-created books, genre_names[i] belonging to books[i]
+        """
+        genres = {genre.slug: genre for genre in Genre.from_names({name for names in genre_names for name in names})}
+        Through = cls.genres.through
+        links = {
+            (book.pk, genres[slug].pk)
+            for book, names in zip(books, genre_names) if book.pk
+            for slug in map(Genre.make_slug, names) if slug in genres
+        }
+        Through.objects.bulk_create(
+            [Through(books_id=book_id, genre_id=genre_id) for book_id, genre_id in links],
+            batch_size=batch_size, ignore_conflicts=True,
+        )
 
     def __str__(self):
         return self.title
@@ -47,6 +195,15 @@ class Review(models.Model):
 
     class Meta:
         unique_together = ('book', 'user')
+        indexes = [
+            # A book's reviews, newest first, for keyset pagination
+            models.Index(fields=['book', '-updated_at', '-id'], name='books_review_book_recent_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Keep the book's rating aggregates (updated from signals) in the same transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
 class GoogleBook(models.Model):
     google_id = models.CharField(max_length=100, unique=True)
@@ -64,19 +221,64 @@ class GoogleBook(models.Model):
     is_ebook = models.BooleanField(default=False)
     price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
     currency = models.CharField(max_length=3, default='USD')
+    content_hash = models.CharField(max_length=64, blank=True, default='', help_text='Hash of the last API payload stored in this row')
+    # Last time the API returned this volume, even if unchanged (updated_at only moves on changes)
+    fetched_at = models.DateTimeField(blank=True, null=True)
+    # Detail/reader page views, used by warm_google_books to pick the hot set
+    view_count = models.PositiveIntegerField(default=0, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = GoogleBookQuerySet.as_manager()
+
     def __str__(self):
         return self.title
 
     def get_authors_display(self):
         return ', '.join(self.authors) if self.authors else 'Unknown Author'
 
+    @property
+    def cover_url(self):
+        """
+        Local proxy URL of image_url (books/covers.py), what pages should link to
+        """
+        from .covers import cover_url
+        return cover_url(self.google_id, self.image_url) if self.image_url else None
+
+    def is_fresh(self, max_age, now=None):
+        if self.fetched_at is None:
+            return False
+        return ((now or timezone.now()) - self.fetched_at).total_seconds() < max_age
+
+    @classmethod
+    def record_view(cls, google_id):
+        """
+        Count a detail/reader page view. Sampled: one view in GOOGLE_BOOK_VIEW_SAMPLE_RATE
+        adds the rate, so counts stay unbiased for ranking without a write on every page view.
+        """
+        rate = getattr(settings, 'GOOGLE_BOOK_VIEW_SAMPLE_RATE', 10)
+        if rate > 1 and random.randrange(rate):
+            return
+        # Single UPDATE, no read-modify-write race between workers
+        cls.objects.filter(google_id=google_id).update(view_count=models.F('view_count') + rate)
+
     def get_categories_display(self):
         return ', '.join(self.categories) if self.categories else 'Uncategorized'
 
     def get_rating_display(self):
         if self.average_rating:
             return f"{self.average_rating:.1f}/5.0 ({self.ratings_count} ratings)"
-        return "No ratings yet"
\ No newline at end of file
+        return "No ratings yet"
+
+
+class CacheVersion(models.Model):
+    """
+    Version counter of a group of cached responses (books/cache.py). Bumped with a
+    single UPDATE ... SET value = value + 1, so concurrent bumps are never lost.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    value = models.BigIntegerField(default=0)
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f'{self.name}={self.value}'
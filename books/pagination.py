@@ -0,0 +1,263 @@
+"""
+Keyset (cursor) pagination for book listings.
+
+Pages are fetched with "WHERE (title, id) > (last title, last id) ORDER BY
+title, id LIMIT n + 1" instead of COUNT(*) + OFFSET, so every page costs the
+same index range scan no matter how deep it is. Cursors are opaque,
+URL-safe tokens holding the sort key of the row the page starts after (or
+before, for previous pages).
+"""
+import base64
+import binascii
+import datetime
+import json
+from decimal import Decimal
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from .cache import make_key
+
+# Every ordering ends in the primary key so the sort key is unique
+ORDERINGS = {
+    'title': ('title', 'id'),
+    '-title': ('-title', '-id'),
+    'author': ('author', 'id'),
+    '-author': ('-author', '-id'),
+    'price': ('price', 'id'),
+    '-price': ('-price', '-id'),
+    'newest': ('-id',),
+    # Only for full-text search results, see BooksQuerySet.search()
+    'relevance': ('search_rank', 'id'),
+    # Reviews of one book, newest first (index books_review_book_recent_idx)
+    'recent': ('-updated_at', '-id'),
+    # Stored Google Books, most viewed first
+    'popular': ('-view_count', '-id'),
+}
+DEFAULT_ORDERING = 'title'
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f'Cannot encode {type(value).__name__} in a cursor')
+
+
+def encode_cursor(values, previous=False):
+    payload = json.dumps({'k': list(values), 'p': int(previous)}, separators=(',', ':'), default=_json_default)
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return list(payload['k']), bool(payload.get('p'))
+    except (binascii.Error, ValueError, TypeError, KeyError, UnicodeError):
+        raise InvalidCursor(cursor)
+
+
+def resolve_ordering(queryset, requested=None):
+    """
+    Pick a known ordering; searches default to relevance, everything else to title
+    """
+    searched = 'search_rank' in queryset.query.annotations
+    if requested in ORDERINGS and (requested != 'relevance' or searched):
+        return requested
+    return 'relevance' if searched else DEFAULT_ORDERING
+
+
+def approximate_count(queryset, timeout=300):
+    """
+    Cheap row count for "about N results": PostgreSQL's planner estimate for
+    the whole table, otherwise a COUNT(*) cached for a few minutes per query
+    """
+    if connection.vendor == 'postgresql' and not queryset.query.where:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        if row and row[0] >= 0:
+            return row[0]
+    key = make_key('approximate_count', str(queryset.query))
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+    return count
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+
+class KeysetPaginator:
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.ordering = ORDERINGS[ordering]
+        self.per_page = per_page
+
+    def _key(self, obj):
+        return [getattr(obj, field.lstrip('-')) for field in self.ordering]
+
+    def _field(self, name):
+        annotation = self.queryset.query.annotations.get(name)
+        return annotation.output_field if annotation is not None else self.queryset.model._meta.get_field(name)
+
+    def _parse(self, cursor, values):
+        """
+        The cursor's sort key converted to the ordering fields' types, so a tampered
+        value is an InvalidCursor rather than an error from the query
+        """
+        if len(values) != len(self.ordering):
+            raise InvalidCursor(cursor)
+        try:
+            parsed = [self._field(field.lstrip('-')).to_python(value) for field, value in zip(self.ordering, values)]
+        except (ValidationError, ValueError, TypeError):
+            raise InvalidCursor(cursor)
+        if any(value is None for value in parsed):
+            raise InvalidCursor(cursor)
+        return parsed
+
+    def _seek(self, values, forward):
+        """
+        Rows strictly after (forward) or before the given sort key
+        """
+        condition = Q()
+        for i, field in enumerate(self.ordering):
+            name = field.lstrip('-')
+            ascending = not field.startswith('-')
+            lookup = 'gt' if ascending == forward else 'lt'
+            branch = Q(**{f'{name}__{lookup}': values[i]})
+            for j in range(i):
+                branch &= Q(**{self.ordering[j].lstrip('-'): values[j]})
+            condition |= branch
+        if len(self.ordering) > 1:
+            # Redundant bound on the leading column so the database can range-scan the index
+            first = self.ordering[0]
+            lookup = 'gte' if (not first.startswith('-')) == forward else 'lte'
+            condition &= Q(**{f'{first.lstrip("-")}__{lookup}': values[0]})
+        return self.queryset.filter(condition)
+
+    def page(self, cursor=None):
+        if cursor:
+            values, previous = decode_cursor(cursor)
+            values = self._parse(cursor, values)
+        else:
+            values, previous = None, False
+
+        if previous:
+            reversed_ordering = [f[1:] if f.startswith('-') else f'-{f}' for f in self.ordering]
+            rows = list(self._seek(values, forward=False).order_by(*reversed_ordering)[:self.per_page + 1])
+            has_more = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            has_previous, has_next = has_more, True
+        else:
+            queryset = self._seek(values, forward=True) if values else self.queryset
+            rows = list(queryset.order_by(*self.ordering)[:self.per_page + 1])
+            has_next = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            has_previous = values is not None
+
+        next_cursor = encode_cursor(self._key(rows[-1])) if has_next and rows else None
+        previous_cursor = encode_cursor(self._key(rows[0]), previous=True) if has_previous and rows else None
+        return KeysetPage(rows, next_cursor, previous_cursor)
+
+
+class BookCursorPagination(BasePagination):
+    """
+    DRF pagination over KeysetPaginator: ?ordering=, ?cursor=, ?page_size=
+    and ?with_total=1 for an approximate total count
+    """
+    page_size = 20
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    page_size_query_param = 'page_size'
+    total_query_param = 'with_total'
+    # Names from ORDERINGS accepted in ?ordering=, None for all of them
+    orderings = None
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        requested = request.query_params.get(self.ordering_query_param)
+        if self.orderings is not None and requested not in self.orderings:
+            requested = None
+        ordering = resolve_ordering(queryset, requested)
+        paginator = KeysetPaginator(queryset, ordering, self.get_page_size(request))
+        try:
+            self.page = paginator.page(request.query_params.get(self.cursor_query_param))
+        except InvalidCursor:
+            raise NotFound('Invalid cursor')
+        self.total = None
+        if request.query_params.get(self.total_query_param) in ('1', 'true'):
+            self.total = approximate_count(queryset)
+        return list(self.page)
+
+    def _link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        body = {
+            'next': self._link(self.page.next_cursor),
+            'previous': self._link(self.page.previous_cursor),
+            'results': data,
+        }
+        if self.total is not None:
+            body['approximate_total'] = self.total
+        return Response(body)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'approximate_total': {'type': 'integer'},
+                'results': schema,
+            },
+        }
+
+
+class GoogleBookCursorPagination(BookCursorPagination):
+    orderings = ('title', '-title', 'newest', 'relevance')
@@ -0,0 +1,204 @@
+"""
+Synthetic data and helpers for performance measurements.
+
+generate_catalog() writes a deterministic catalog (the same seed and size
+always give the same books, genres, users and reviews) owned by perf_user_*
+accounts, so it can be replaced without touching real data. Review counts
+follow a long-tail distribution (most books have none or a few, some have
+hundreds) and genres are Zipf-distributed, like a real catalog.
+
+GoogleBooksStub is a local HTTP server that answers /volumes searches and
+/volumes/<id> lookups with generated payloads after a configurable delay,
+standing in for the Google Books API during benchmarks.
+
+Used by the seed_perf_data, benchmark and benchmark_search commands.
+"""
+import datetime
+import hashlib
+import json
+import random
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from .models import Books, Review, User
+
+WORDS = (
+    'shadow night river king queen dragon garden winter summer secret house city war peace love '
+    'storm fire ice stone glass silver golden empire ocean forest mountain journey letter promise '
+    'memory dream ghost machine star moon sun island road bridge tower crown blood song silence'
+).split()
+FIRST_NAMES = 'Anna Ben Clara David Elena Frank Grace Henry Iris Jack Kate Leo Maya Noah Olivia Paul'.split()
+LAST_NAMES = 'Adams Brown Clarke Diaz Evans Foster Garcia Hughes Iyer Jones Khan Lopez Moore Novak'.split()
+GENRES = 'Fiction Non-Fiction Fantasy Science-Fiction Romance Mystery Thriller History Biography Poetry'.split()
+
+SIZES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+USER_PREFIX = 'perf_user_'
+USER_PASSWORD = 'perf'
+# Rating weights (1-5 stars) for well and poorly received books
+WELL_RECEIVED = (1, 1, 3, 8, 10)
+POORLY_RECEIVED = (6, 5, 4, 2, 1)
+
+
+def perf_users():
+    return User.objects.filter(username__startswith=USER_PREFIX)
+
+
+def delete_catalog():
+    """
+    Remove every perf_user_* account with its books and reviews.
+    Raw deletes: a million per-row delete signals would take hours; rebuild the search index afterwards.
+    """
+    users = list(perf_users().values_list('pk', flat=True))
+    if not users:
+        return 0
+    placeholders = ', '.join(['%s'] * len(users))
+    Through = Books.genres.through
+    books = f'SELECT id FROM {Books._meta.db_table} WHERE created_by_id IN ({placeholders})'
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {Review._meta.db_table} WHERE user_id IN ({placeholders}) '
+                       f'OR book_id IN ({books})', users + users)
+        cursor.execute(f'DELETE FROM {Through._meta.db_table} WHERE books_id IN ({books})', users)
+        cursor.execute(f'DELETE FROM {Books._meta.db_table} WHERE created_by_id IN ({placeholders})', users)
+        deleted = cursor.rowcount
+        cursor.execute(f'DELETE FROM {User._meta.db_table} WHERE id IN ({placeholders})', users)
+    return deleted
+
+
+def _title(rng):
+    return ' '.join(rng.choice(WORDS).capitalize() for _ in range(rng.randint(2, 5)))
+
+
+def _review_count(rng, max_reviews):
+    # Pareto tail: about half the books get no review, a few get hundreds
+    return min(max_reviews, int(rng.paretovariate(1.1)) - 1)
+
+
+def generate_catalog(books, users=1000, seed=42, chunk_size=10_000, max_reviews=500, progress=None):
+    """
+    Create users perf_user_00000.. and `books` books with genres and reviews;
+    returns (books, reviews) created. Call delete_catalog() first to replace a previous run.
+    """
+    rng = random.Random(seed)
+    password = make_password(USER_PASSWORD)
+    User.objects.bulk_create([
+        User(username=f'{USER_PREFIX}{i:05d}', email=f'{USER_PREFIX}{i:05d}@example.com', password=password)
+        for i in range(users)
+    ], batch_size=1000)
+    user_ids = list(perf_users().order_by('username').values_list('pk', flat=True))
+    genre_weights = [1 / rank for rank in range(1, len(GENRES) + 1)]
+    max_reviews = min(max_reviews, len(user_ids))
+    first_day = datetime.date(1950, 1, 1)
+
+    created_books = created_reviews = 0
+    for start in range(0, books, chunk_size):
+        chunk, genre_names, ratings = [], [], []
+        for _ in range(min(chunk_size, books - start)):
+            weights = WELL_RECEIVED if rng.random() < 0.7 else POORLY_RECEIVED
+            stars = rng.choices(range(1, 6), weights, k=_review_count(rng, max_reviews))
+            book = Books(
+                title=_title(rng),
+                author=f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                description=' '.join(rng.choices(WORDS, k=rng.randint(10, 40))).capitalize() + '.',
+                price=rng.randint(5, 60),
+                published_date=first_day + datetime.timedelta(days=rng.randrange(27000)),
+                created_by_id=rng.choice(user_ids),
+            )
+            book.set_rating_histogram({star: stars.count(star) for star in set(stars)})
+            chunk.append(book)
+            genre_names.append(set(rng.choices(GENRES, genre_weights, k=rng.randint(1, 3))))
+            ratings.append(stars)
+
+        with transaction.atomic():
+            Books.objects.bulk_create(chunk, batch_size=1000)
+            Books.link_genre_names(chunk, genre_names, batch_size=5000)
+            reviews = [
+                Review(book_id=book.pk, user_id=user_id, rating=star, comment=_title(rng))
+                for book, stars in zip(chunk, ratings)
+                for user_id, star in zip(rng.sample(user_ids, len(stars)), stars)
+            ]
+            Review.objects.bulk_create(reviews, batch_size=5000)
+        created_books += len(chunk)
+        created_reviews += len(reviews)
+        if progress:
+            progress(created_books, created_reviews)
+    return created_books, created_reviews
+
+
+def percentiles(timings):
+    """
+    p50, p95 and p99 of a list of timings (at least two)
+    """
+    cuts = statistics.quantiles(timings, n=100, method='inclusive')
+    return cuts[49], cuts[94], cuts[98]
+
+
+def stub_volume(volume_id, title=None):
+    digest = int(hashlib.sha256(volume_id.encode('utf-8')).hexdigest()[:8], 16)
+    rng = random.Random(digest)
+    return {
+        'id': volume_id,
+        'volumeInfo': {
+            'title': title or _title(rng),
+            'authors': [f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'],
+            'description': ' '.join(rng.choices(WORDS, k=30)),
+            'publishedDate': str(1950 + digest % 70),
+            'pageCount': 100 + digest % 500,
+            'categories': [rng.choice(GENRES)],
+            'averageRating': 1 + digest % 5,
+            'ratingsCount': digest % 1000,
+        },
+        'saleInfo': {'saleability': 'NOT_FOR_SALE'},
+        'accessInfo': {'webReaderLink': f'https://example.com/reader/{volume_id}'},
+    }
+
+
+class GoogleBooksStub:
+    """
+    Local stand-in for the Google Books API; use as a context manager and point
+    GOOGLE_BOOKS_API_BASE_URL at .url
+    """
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                time.sleep(stub.latency)
+                url = urlsplit(self.path)
+                parts = [part for part in url.path.split('/') if part]
+                if parts[-1] == 'volumes':
+                    params = parse_qs(url.query)
+                    query = params.get('q', [''])[0]
+                    start = int(params.get('startIndex', ['0'])[0])
+                    count = int(params.get('maxResults', ['20'])[0])
+                    ids = [f'stub-{hashlib.sha1(f"{query}:{i}".encode()).hexdigest()[:12]}' for i in range(start, start + count)]
+                    body = {'totalItems': 1000, 'items': [stub_volume(volume_id) for volume_id in ids]}
+                else:
+                    body = stub_volume(parts[-1])
+                payload = json.dumps(body).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_port}/books/v1'
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
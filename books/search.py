@@ -0,0 +1,410 @@
+"""
+Full-text search over the local Books catalog and the GoogleBook mirror.
+
+Two interchangeable backends rank hits with BM25 over weighted fields (title,
+author and genre names for Books; title, authors and categories for
+GoogleBook) and understand the same query syntax:
+
+    harry potter        every word must match, each as a prefix ("harr" finds "Harry")
+    "order of the"      quoted phrase, words must appear next to each other
+    "order of the"*     phrase whose last word is a prefix
+
+On SQLite each corpus is an FTS5 virtual table (created by migrations 0009
+and 0016); on any other database an in-process inverted index is built lazily
+and rebuilt every BOOK_SEARCH_INDEX_TTL seconds so writes from other workers
+show up. Books are kept in sync through the signals in books/signals.py,
+GoogleBook rows by GoogleBooksService._store_books (they are bulk upserted).
+"""
+import bisect
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+from django.conf import settings
+from django.db import connection
+
+FTS_TABLE = 'books_books_fts'
+FIELDS = ('title', 'author', 'genres')
+FIELD_WEIGHTS = {'title': 10.0, 'author': 5.0, 'genres': 2.0}
+
+GOOGLE_FTS_TABLE = 'books_googlebook_fts'
+GOOGLE_FIELD_WEIGHTS = {'title': 10.0, 'authors': 5.0, 'categories': 2.0}
+
+_TOKEN_RE = re.compile(r'\w+')
+_QUERY_RE = re.compile(r'"([^"]*)"(\*?)|(\S+)')
+
+
+def tokenize(text):
+    """
+    Lowercase, strip diacritics and split into word tokens (matches FTS5's unicode61 tokenizer)
+    """
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return _TOKEN_RE.findall(text.lower())
+
+
+def parse_query(query):
+    """
+    Split a user query into terms of (tokens, is_prefix). Bare words are prefix
+    matches; quoted phrases are exact unless followed by '*'.
+    """
+    terms = []
+    for phrase, star, word in _QUERY_RE.findall(query or ''):
+        if word:
+            tokens = tokenize(word)
+            prefix = True
+        else:
+            tokens = tokenize(phrase)
+            prefix = bool(star)
+        if tokens:
+            terms.append((tokens, prefix))
+    return terms
+
+
+def book_document(book, genre_names=None):
+    if genre_names is None:
+        genre_names = book.get_genre_list()
+    return {
+        'title': book.title or '',
+        'author': book.author or '',
+        'genres': ' '.join(genre_names),
+    }
+
+
+def _genre_names_by_book(book_ids=None):
+    from .models import Books
+    through = Books.genres.through.objects.all()
+    if book_ids is not None:
+        through = through.filter(books_id__in=book_ids)
+    names = defaultdict(list)
+    for book_id, name in through.values_list('books_id', 'genre__name'):
+        names[book_id].append(name)
+    return names
+
+
+def _iter_documents(chunk_size=2000):
+    from .models import Books
+    books = Books.objects.only('pk', 'title', 'author').order_by('pk')
+    last_pk = 0
+    while True:
+        chunk = list(books.filter(pk__gt=last_pk)[:chunk_size])
+        if not chunk:
+            return
+        genres = _genre_names_by_book([book.pk for book in chunk])
+        for book in chunk:
+            yield book.pk, book_document(book, genres.get(book.pk, []))
+        last_pk = chunk[-1].pk
+
+
+def google_book_document(book):
+    return {
+        'title': book.title or '',
+        'authors': ' '.join(book.authors or []),
+        'categories': ' '.join(book.categories or []),
+    }
+
+
+def _iter_google_documents(chunk_size=2000):
+    from .models import GoogleBook
+    books = GoogleBook.objects.only('pk', 'title', 'authors', 'categories').order_by('pk')
+    last_pk = 0
+    while True:
+        chunk = list(books.filter(pk__gt=last_pk)[:chunk_size])
+        if not chunk:
+            return
+        for book in chunk:
+            yield book.pk, google_book_document(book)
+        last_pk = chunk[-1].pk
+
+
+class Corpus:
+    """
+    What an index covers: its FTS5 table, weighted fields and where documents come from
+    """
+    def __init__(self, name, table, weights, documents):
+        self.name = name
+        self.table = table
+        self.weights = weights
+        self.fields = tuple(weights)
+        self.documents = documents
+
+
+BOOKS = Corpus('books', FTS_TABLE, FIELD_WEIGHTS, _iter_documents)
+GOOGLE_BOOKS = Corpus('google_books', GOOGLE_FTS_TABLE, GOOGLE_FIELD_WEIGHTS, _iter_google_documents)
+
+
+class SQLiteFTSBackend:
+    name = 'fts5'
+
+    def __init__(self, corpus=BOOKS):
+        self.corpus = corpus
+        columns = ', '.join(corpus.fields)
+        placeholders = ', '.join(['%s'] * (len(corpus.fields) + 1))
+        self._insert_sql = f'INSERT INTO {corpus.table} (rowid, {columns}) VALUES ({placeholders})'
+
+    def to_match_expression(self, terms):
+        parts = []
+        for tokens, prefix in terms:
+            parts.append('"%s"%s' % (' '.join(tokens), '*' if prefix else ''))
+        return ' '.join(parts)
+
+    def search(self, query, limit=None):
+        terms = parse_query(query)
+        if not terms:
+            return []
+        table = self.corpus.table
+        weights = ', '.join(str(self.corpus.weights[field]) for field in self.corpus.fields)
+        sql = (
+            f'SELECT rowid, bm25({table}, {weights}) AS rank FROM {table} '
+            f'WHERE {table} MATCH %s ORDER BY rank'
+        )
+        params = [self.to_match_expression(terms)]
+        if limit:
+            sql += ' LIMIT %s'
+            params.append(limit)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            # FTS5 bm25() is negative, lower is better
+            return [(pk, -rank) for pk, rank in cursor.fetchall()]
+
+    def _row(self, pk, document):
+        return [pk] + [document[field] for field in self.corpus.fields]
+
+    def index(self, pk, document):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.corpus.table} WHERE rowid = %s', [pk])
+            cursor.execute(self._insert_sql, self._row(pk, document))
+
+    def remove(self, pk):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.corpus.table} WHERE rowid = %s', [pk])
+
+    def rebuild(self):
+        count = 0
+        table = self.corpus.table
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {table}')
+            batch = []
+            for pk, document in self.corpus.documents():
+                batch.append(self._row(pk, document))
+                if len(batch) >= 2000:
+                    cursor.executemany(self._insert_sql, batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                cursor.executemany(self._insert_sql, batch)
+                count += len(batch)
+            cursor.execute(f"INSERT INTO {table} ({table}) VALUES ('optimize')")
+        return count
+
+
+class InvertedIndexBackend:
+    """
+    In-process positional inverted index with BM25 scoring, for databases without FTS5
+    """
+    name = 'memory'
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self, ttl=None, corpus=BOOKS):
+        self.ttl = ttl
+        self.corpus = corpus
+        self._lock = threading.RLock()
+        self._built_at = None
+        self._reset()
+
+    def _reset(self):
+        # token -> {pk: {field: [positions]}}
+        self.postings = defaultdict(dict)
+        self.documents = {}
+        self.lengths = {field: {} for field in self.corpus.fields}
+        self.total_lengths = {field: 0 for field in self.corpus.fields}
+        self.vocabulary = []
+
+    def _ensure_built(self):
+        expired = self.ttl is not None and self._built_at is not None and time.monotonic() - self._built_at > self.ttl
+        if self._built_at is None or expired:
+            self.rebuild()
+
+    def _add(self, pk, document, keep_sorted=True):
+        tokens_by_field = {field: tokenize(document[field]) for field in self.corpus.fields}
+        self.documents[pk] = tokens_by_field
+        for field, tokens in tokens_by_field.items():
+            self.lengths[field][pk] = len(tokens)
+            self.total_lengths[field] += len(tokens)
+            for position, token in enumerate(tokens):
+                entry = self.postings[token].get(pk)
+                if entry is None:
+                    entry = self.postings[token][pk] = {}
+                    if keep_sorted and len(self.postings[token]) == 1:
+                        bisect.insort(self.vocabulary, token)
+                entry.setdefault(field, []).append(position)
+
+    def _discard(self, pk):
+        tokens_by_field = self.documents.pop(pk, None)
+        if tokens_by_field is None:
+            return
+        for field, tokens in tokens_by_field.items():
+            self.total_lengths[field] -= self.lengths[field].pop(pk, 0)
+            for token in set(tokens):
+                docs = self.postings.get(token)
+                if docs is None:
+                    continue
+                docs.pop(pk, None)
+                if not docs:
+                    del self.postings[token]
+                    index = bisect.bisect_left(self.vocabulary, token)
+                    if index < len(self.vocabulary) and self.vocabulary[index] == token:
+                        del self.vocabulary[index]
+
+    def index(self, pk, document):
+        with self._lock:
+            if self._built_at is None:
+                return
+            self._discard(pk)
+            self._add(pk, document)
+
+    def remove(self, pk):
+        with self._lock:
+            if self._built_at is not None:
+                self._discard(pk)
+
+    def rebuild(self):
+        with self._lock:
+            self._reset()
+            for pk, document in self.corpus.documents():
+                self._add(pk, document, keep_sorted=False)
+            self.vocabulary = sorted(self.postings)
+            self._built_at = time.monotonic()
+            return len(self.documents)
+
+    def _expand(self, token, prefix):
+        if not prefix:
+            return [token] if token in self.postings else []
+        start = bisect.bisect_left(self.vocabulary, token)
+        end = bisect.bisect_left(self.vocabulary, token + '\uffff')
+        return self.vocabulary[start:end]
+
+    def _term_matches(self, tokens, prefix):
+        """
+        Return {pk: {field: term frequency}} for one (possibly phrase) term
+        """
+        variants = [[token] for token in tokens[:-1]] + [self._expand(tokens[-1], prefix)]
+        if not variants[-1] or any(not self.postings.get(v[0]) for v in variants[:-1]):
+            return {}
+        last = {}
+        for token in variants[-1]:
+            for pk, fields in self.postings[token].items():
+                merged = last.setdefault(pk, {})
+                for field, positions in fields.items():
+                    merged.setdefault(field, set()).update(positions)
+        if len(tokens) == 1:
+            return {pk: {field: len(positions) for field, positions in fields.items()} for pk, fields in last.items()}
+
+        matches = {}
+        first = self.postings[tokens[0]]
+        for pk, fields in first.items():
+            for field, starts in fields.items():
+                count = 0
+                for start in starts:
+                    if all(
+                        start + offset in self.postings[token].get(pk, {}).get(field, ())
+                        for offset, token in enumerate(tokens[1:-1], 1)
+                    ) and start + len(tokens) - 1 in last.get(pk, {}).get(field, ()):
+                        count += 1
+                if count:
+                    matches.setdefault(pk, {})[field] = count
+        return matches
+
+    def search(self, query, limit=None):
+        terms = parse_query(query)
+        if not terms:
+            return []
+        with self._lock:
+            self._ensure_built()
+            total_docs = len(self.documents)
+            scores = None
+            for tokens, prefix in terms:
+                matches = self._term_matches(tokens, prefix)
+                if not matches:
+                    return []
+                idf = math.log((total_docs - len(matches) + 0.5) / (len(matches) + 0.5) + 1)
+                term_scores = {}
+                for pk, fields in matches.items():
+                    score = 0.0
+                    for field, tf in fields.items():
+                        average = self.total_lengths[field] / total_docs or 1
+                        norm = 1 - self.b + self.b * self.lengths[field].get(pk, 0) / average
+                        score += self.corpus.weights[field] * idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+                    term_scores[pk] = score
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {pk: score + term_scores[pk] for pk, score in scores.items() if pk in term_scores}
+                if not scores:
+                    return []
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:limit] if limit else ranked
+
+
+_backends = {}
+_backend_lock = threading.Lock()
+
+
+def get_search_backend(corpus=BOOKS):
+    backend = _backends.get(corpus.name)
+    if backend is None:
+        with _backend_lock:
+            backend = _backends.get(corpus.name)
+            if backend is None:
+                choice = getattr(settings, 'BOOK_SEARCH_BACKEND', 'auto')
+                if choice == 'auto':
+                    choice = 'fts5' if connection.vendor == 'sqlite' else 'memory'
+                if choice == 'fts5':
+                    backend = SQLiteFTSBackend(corpus)
+                else:
+                    backend = InvertedIndexBackend(ttl=getattr(settings, 'BOOK_SEARCH_INDEX_TTL', 300), corpus=corpus)
+                _backends[corpus.name] = backend
+    return backend
+
+
+def search_book_ids(query, limit=None):
+    """
+    Ranked list of matching Books primary keys, best match first
+    """
+    if limit is None:
+        limit = getattr(settings, 'BOOK_SEARCH_MAX_RESULTS', 1000)
+    return [pk for pk, _ in get_search_backend().search(query, limit=limit)]
+
+
+def index_book(book, genre_names=None):
+    get_search_backend().index(book.pk, book_document(book, genre_names))
+
+
+def remove_book(pk):
+    get_search_backend().remove(pk)
+
+
+def rebuild_index():
+    return get_search_backend().rebuild()
+
+
+def search_google_book_ids(query, limit=None):
+    """
+    Ranked list of matching GoogleBook primary keys, best match first
+    """
+    if limit is None:
+        limit = getattr(settings, 'BOOK_SEARCH_MAX_RESULTS', 1000)
+    return [pk for pk, _ in get_search_backend(GOOGLE_BOOKS).search(query, limit=limit)]
+
+
+def index_google_books(books):
+    backend = get_search_backend(GOOGLE_BOOKS)
+    for book in books:
+        backend.index(book.pk, google_book_document(book))
+
+
+def rebuild_google_index():
+    return get_search_backend(GOOGLE_BOOKS).rebuild()
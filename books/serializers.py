@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import User, Books, Review
+from .models import User, Books, Review, Genre, GoogleBook
 
 class UserSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
@@ -20,15 +20,97 @@ class LoginSerializer(serializers.Serializer):
     email = serializers.EmailField()
     password = serializers.CharField(write_only=True)
 
+class GenreListField(serializers.Field):
+    """
+    Genres as a list of names; also accepts a comma-separated string on input
+    """
+    def to_representation(self, value):
+        return [genre.name for genre in value.all()]
+
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            return Genre.split(data)
+        if isinstance(data, (list, tuple)) and all(isinstance(name, str) for name in data):
+            return Genre.split(','.join(data))
+        raise serializers.ValidationError('Expected a list of genre names or a comma-separated string.')
+
+class BatchListSerializer(serializers.ListSerializer):
+    """
+    List serializer for batch writes: validate_items() checks every item on its own
+    and reports per-item errors instead of rejecting the whole list
+    """
+    max_items = 1000
+
+    def validate_items(self):
+        """
+        Return ([(index, validated_data), ...], {index: errors})
+        """
+        data = self.initial_data
+        if not isinstance(data, list):
+            raise serializers.ValidationError({'non_field_errors': ['Expected a list of items.']})
+        if not data:
+            raise serializers.ValidationError({'non_field_errors': ['Expected at least one item.']})
+        if len(data) > self.max_items:
+            raise serializers.ValidationError({'non_field_errors': [f'At most {self.max_items} items per request.']})
+        valid, errors = [], {}
+        for index, item in enumerate(data):
+            try:
+                valid.append((index, self.child.run_validation(item)))
+            except serializers.ValidationError as e:
+                errors[index] = e.detail
+        return valid, errors
+
 class BookSerializer(serializers.ModelSerializer):
-    average_rating = serializers.FloatField(source='average_rating', read_only=True)
+    genres = GenreListField(required=False)
+    average_rating = serializers.FloatField(source='rating_avg', read_only=True)
+    reviews_count = serializers.IntegerField(source='rating_count', read_only=True)
+    created_by_username = serializers.CharField(source='created_by.username', read_only=True, default=None)
+
     class Meta:
         model = Books
         fields = '__all__'
-        read_only_fields = ('created_by',)
+        read_only_fields = ('created_by', 'rating_avg', 'rating_count', 'rating_histogram', 'image_variants')
+        list_serializer_class = BatchListSerializer
+
+    def create(self, validated_data):
+        genres = validated_data.pop('genres', None)
+        book = super().create(validated_data)
+        if genres is not None:
+            book.set_genre_names(genres)
+        return book
+
+    def update(self, instance, validated_data):
+        genres = validated_data.pop('genres', None)
+        book = super().update(instance, validated_data)
+        if genres is not None:
+            book.set_genre_names(genres)
+        return book
 
 class ReviewSerializer(serializers.ModelSerializer):
     class Meta:
         model = Review
         fields = '__all__'
-        read_only_fields = ('user',)
\ No newline at end of file
+        read_only_fields = ('user',)
+
+class ReviewBatchItemSerializer(serializers.ModelSerializer):
+    """
+    One review of a batch. The book is a plain id so a batch costs one lookup, not one per item.
+    """
+    book = serializers.IntegerField()
+    rating = serializers.IntegerField(min_value=1, max_value=5)
+
+    class Meta:
+        model = Review
+        fields = ['book', 'rating', 'comment']
+        list_serializer_class = BatchListSerializer
+
+class GoogleBookSerializer(serializers.ModelSerializer):
+    cover_url = serializers.CharField(read_only=True)
+
+    class Meta:
+        model = GoogleBook
+        fields = [
+            'id', 'google_id', 'title', 'authors', 'categories', 'description', 'published_date', 'page_count',
+            'average_rating', 'ratings_count', 'image_url', 'cover_url', 'preview_url', 'web_reader_url', 'is_ebook',
+            'price', 'currency', 'updated_at',
+        ]
@@ -1,68 +1,62 @@
 import requests
 import json
+import hashlib
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, wait
 from django.conf import settings
-from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
 from .models import GoogleBook
+from .google_client import get_client
+from .search import index_google_books
+from . import metrics
+from .cache import get_or_refresh, refresh_ahead, refresh_in_background, make_key, CachedFailure
+from google_books_config import DEFAULT_API_CONFIG
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Shared by all requests in the process so the number of concurrent upstream
+# calls stays bounded; queries that miss a deadline keep running and fill the cache.
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'GOOGLE_BOOKS_MAX_WORKERS', 6),
+    thread_name_prefix='google-books',
+)
+
+def normalize_query(query):
+    """
+    Canonical form of a search query: Unicode NFKC, case-folded, single spaces
+    """
+    return ' '.join(unicodedata.normalize('NFKC', query or '').casefold().split())
+
+
+def search_cache_key(query, start_index=0, max_results=20):
+    return make_key('google_books_search', normalize_query(query), start_index, max_results)
+
+
 class GoogleBooksService:
+    # Seconds before a cached search / detail is refreshed (stale copies are served meanwhile)
+    SEARCH_TIMEOUT = 3600
+    DETAIL_TIMEOUT = 7200
+
     def __init__(self):
-        self.api_key = settings.GOOGLE_BOOKS_API_KEY
-        self.base_url = settings.GOOGLE_BOOKS_API_BASE_URL
+        self.client = get_client()
 
     def search_books(self, query, max_results=20, start_index=0):
         """
         Search for books using Google Books API
         """
-        cache_key = f"google_books_search_{query}_{start_index}_{max_results}"
-        cached_result = cache.get(cache_key)
-        
-        if cached_result:
-            return cached_result
+        query = normalize_query(query)
+        cache_key = search_cache_key(query, start_index, max_results)
 
         try:
-            params = {
-                'q': query,
-                'maxResults': max_results,
-                'startIndex': start_index,
-                'key': self.api_key
-            }
-            
-            response = requests.get(f"{self.base_url}/volumes", params=params, timeout=10)
-            response.raise_for_status()
-            
-            data = response.json()
-            books = []
-            
-            if 'items' in data:
-                for item in data['items']:
-                    book_data = self._parse_book_data(item)
-                    book, created = GoogleBook.objects.get_or_create(
-                        google_id=book_data['google_id'],
-                        defaults=book_data
-                    )
-                    if not created:
-                        # Update existing book with latest data
-                        for key, value in book_data.items():
-                            if key != 'google_id':
-                                setattr(book, key, value)
-                        book.save()
-                    
-                    books.append(book)
-            
-            result = {
-                'books': books,
-                'total_items': data.get('totalItems', 0),
-                'start_index': start_index,
-                'max_results': max_results
-            }
-            
-            # Cache for 1 hour
-            cache.set(cache_key, result, 3600)
-            return result
-            
+            # Cache for 1 hour, then serve stale while one worker refreshes
+            return get_or_refresh(
+                cache_key, lambda: self._fetch_search(query, max_results, start_index, self.interactive_deadline()),
+                self.SEARCH_TIMEOUT,
+            )
+        except CachedFailure as e:
+            return {'books': [], 'total_items': 0, 'error': str(e)}
         except requests.RequestException as e:
             logger.error(f"Google Books API request failed: {e}")
             return {'books': [], 'total_items': 0, 'error': str(e)}
@@ -70,38 +64,55 @@ class GoogleBooksService:
             logger.error(f"Error processing Google Books API response: {e}")
             return {'books': [], 'total_items': 0, 'error': str(e)}
 
+    def _fetch_search(self, query, max_results, start_index, deadline=None):
+        params = {
+            'q': query,
+            'maxResults': max_results,
+            'startIndex': start_index,
+        }
+        data = self.client.get('/volumes', params=params, deadline=deadline).json()
+        books = []
+
+        if 'items' in data:
+            books = self._store_books([self._parse_book_data(item) for item in data['items']])
+
+        return {
+            'books': books,
+            'total_items': data.get('totalItems', 0),
+            'start_index': start_index,
+            'max_results': max_results
+        }
+
     def get_book_details(self, google_id):
         """
         Get detailed information about a specific book
+
+        A stored row the API confirmed within GOOGLE_BOOKS_DETAIL_MAX_AGE is
+        served as is. An older row is served too while one worker refreshes it
+        in the background, so an API outage degrades to the last known data.
+        Only books never seen before wait for the API.
         """
-        cache_key = f"google_book_detail_{google_id}"
-        cached_result = cache.get(cache_key)
-        
-        if cached_result:
-            return cached_result
+        book = GoogleBook.objects.filter(google_id=google_id).first()
+        if book is not None:
+            # Counted with the google_book_detail cache lookups: the stored rows are that cache now
+            if book.is_fresh(self.detail_max_age()):
+                metrics.inc('cache_lookups_total', prefix='google_book_detail', result='hit')
+            else:
+                metrics.inc('cache_lookups_total', prefix='google_book_detail', result='stale')
+                refresh_in_background(
+                    make_key('google_book_detail', google_id),
+                    lambda: self._fetch_details(google_id, self.interactive_deadline()),
+                )
+            return book
 
+        cache_key = make_key('google_book_detail', google_id)
         try:
-            params = {'key': self.api_key}
-            response = requests.get(f"{self.base_url}/volumes/{google_id}", params=params, timeout=10)
-            response.raise_for_status()
-            
-            book_data = self._parse_book_data(response.json())
-            book, created = GoogleBook.objects.get_or_create(
-                google_id=book_data['google_id'],
-                defaults=book_data
+            # Coalesces concurrent first requests and remembers failures briefly
+            return get_or_refresh(
+                cache_key, lambda: self._fetch_details(google_id, self.interactive_deadline()), self.DETAIL_TIMEOUT,
             )
-            
-            if not created:
-                # Update existing book with latest data
-                for key, value in book_data.items():
-                    if key != 'google_id':
-                        setattr(book, key, value)
-                book.save()
-            
-            # Cache for 2 hours
-            cache.set(cache_key, book, 7200)
-            return book
-            
+        except CachedFailure:
+            return None
         except requests.RequestException as e:
             logger.error(f"Google Books API request failed for book {google_id}: {e}")
             return None
@@ -109,6 +120,86 @@ class GoogleBooksService:
             logger.error(f"Error processing Google Books API response for book {google_id}: {e}")
             return None
 
+    @staticmethod
+    def interactive_deadline():
+        # Lookups made for a page stop retrying after this long; the warmers keep the full retry policy
+        return getattr(settings, 'GOOGLE_BOOKS_HTTP_INTERACTIVE_DEADLINE', 4)
+
+    @staticmethod
+    def detail_max_age():
+        return getattr(settings, 'GOOGLE_BOOKS_DETAIL_MAX_AGE', GoogleBooksService.DETAIL_TIMEOUT)
+
+    def refresh_search(self, query, max_results=20, start_index=0, ahead=0):
+        """
+        Re-fetch a search into the cache unless it stays fresh for more than `ahead` seconds (for warm_google_books)
+        """
+        query = normalize_query(query)
+        return refresh_ahead(
+            search_cache_key(query, start_index, max_results),
+            lambda: self._fetch_search(query, max_results, start_index), self.SEARCH_TIMEOUT, ahead,
+        )
+
+    def refresh_book_details(self, google_id, ahead=0):
+        """
+        Re-fetch a stored book unless it stays fresh for more than `ahead` seconds
+        """
+        book = GoogleBook.objects.filter(google_id=google_id).only('fetched_at').first()
+        if book is not None and book.is_fresh(self.detail_max_age() - ahead):
+            return False
+        self._fetch_details(google_id)
+        return True
+
+    def _fetch_details(self, google_id, deadline=None):
+        response = self.client.get(f'/volumes/{google_id}', deadline=deadline)
+        return self._store_books([self._parse_book_data(response.json())])[0]
+
+    def _store_books(self, books_data):
+        """
+        Upsert parsed books in one transaction and return the rows in the given order.
+        Rows whose payload hash is unchanged are not written at all.
+        """
+        by_id = {}
+        for book_data in books_data:
+            if book_data.get('google_id'):
+                by_id[book_data['google_id']] = book_data
+        if not by_id:
+            return []
+
+        hashes = {google_id: self._content_hash(book_data) for google_id, book_data in by_id.items()}
+        stored = dict(GoogleBook.objects.filter(google_id__in=by_id).values_list('google_id', 'content_hash'))
+        now = timezone.now()
+        changed = [
+            GoogleBook(content_hash=hashes[google_id], fetched_at=now, **book_data)
+            for google_id, book_data in by_id.items()
+            if stored.get(google_id) != hashes[google_id]
+        ]
+        unchanged = [google_id for google_id in by_id if stored.get(google_id) == hashes[google_id]]
+        with transaction.atomic():
+            if changed:
+                update_fields = [
+                    field.name for field in GoogleBook._meta.concrete_fields
+                    if field.name not in ('id', 'google_id', 'created_at', 'view_count')
+                ]
+                GoogleBook.objects.bulk_create(
+                    changed,
+                    update_conflicts=True,
+                    unique_fields=['google_id'],
+                    update_fields=update_fields,
+                )
+            if unchanged:
+                # Still record that the API confirmed them; updated_at keeps meaning "content changed"
+                GoogleBook.objects.filter(google_id__in=unchanged).update(fetched_at=now)
+
+            rows = GoogleBook.objects.in_bulk(list(by_id), field_name='google_id')
+            # bulk upserts skip signals, so keep the local search index in step here
+            index_google_books([rows[book.google_id] for book in changed if book.google_id in rows])
+        return [rows[google_id] for google_id in by_id if google_id in rows]
+
+    @staticmethod
+    def _content_hash(book_data):
+        payload = json.dumps(book_data, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
     def _parse_book_data(self, item):
         """
         Parse Google Books API response into our model format
@@ -154,25 +245,39 @@ class GoogleBooksService:
             'currency': currency,
         }
 
-    def get_featured_books(self, max_results=12):
+    FEATURED_QUERIES = DEFAULT_API_CONFIG['featured_categories']
+    # Results taken from each featured query
+    FEATURED_PER_QUERY = 2
+
+    def get_featured_books(self, max_results=12, deadline=None):
         """
         Get featured books (popular books in various categories)
+
+        The category searches run concurrently; whatever has finished when the
+        deadline passes is returned, so a slow query only costs its own results.
         """
-        featured_queries = [
-            'bestseller fiction',
-            'popular science books',
-            'classic literature',
-            'modern romance novels',
-            'business books',
-            'self-help books'
+        if deadline is None:
+            deadline = getattr(settings, 'GOOGLE_BOOKS_FEATURED_DEADLINE', 5)
+
+        futures = [
+            _executor.submit(self._search_in_worker, query, self.FEATURED_PER_QUERY) for query in self.FEATURED_QUERIES
         ]
-        
+        done, pending = wait(futures, timeout=deadline)
+        if pending:
+            logger.warning(f"Featured books: {len(pending)} of {len(futures)} queries missed the {deadline}s deadline")
+
         all_books = []
-        for query in featured_queries:
-            result = self.search_books(query, max_results=2)
-            if result['books']:
-                all_books.extend(result['books'])
-        
+        for future in futures:
+            if future in done and not future.exception():
+                all_books.extend(future.result().get('books', []))
+
         # Remove duplicates and limit results
         unique_books = list({book.google_id: book for book in all_books}.values())
         return unique_books[:max_results]
+
+    def _search_in_worker(self, query, max_results):
+        try:
+            return self.search_books(query, max_results=max_results)
+        finally:
+            # Worker threads get their own DB connection; don't leak it
+            connection.close()
@@ -0,0 +1,159 @@
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import Books, Review, Genre
+from . import images, search
+from .cache import CATALOG_VERSION, book_version_name, bump_versions_on_commit
+
+SEARCH_FIELDS = {'title', 'author'}
+
+
+@receiver(pre_save, sender=Review)
+def remember_previous_rating(sender, instance, raw=False, **kwargs):
+    instance._previous_rating = None
+    if raw or instance.pk is None:
+        return
+    previous = Review.objects.filter(pk=instance.pk).values('book_id', 'rating').first()
+    if previous:
+        instance._previous_rating = (previous['book_id'], previous['rating'])
+
+
+@receiver(post_save, sender=Review)
+def update_rating_stats_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_rating', None)
+    if previous is None:
+        Books.adjust_rating_stats(instance.book_id, added=instance.rating)
+    elif previous == (instance.book_id, instance.rating):
+        return
+    elif previous[0] == instance.book_id:
+        Books.adjust_rating_stats(instance.book_id, added=instance.rating, removed=previous[1])
+    else:
+        Books.adjust_rating_stats(previous[0], removed=previous[1])
+        Books.adjust_rating_stats(instance.book_id, added=instance.rating)
+
+
+@receiver(post_delete, sender=Review)
+def update_rating_stats_on_delete(sender, instance, origin=None, **kwargs):
+    # Reviews cascading from a deleted book have no aggregates left to maintain
+    if isinstance(origin, Books) or getattr(origin, 'model', None) is Books:
+        return
+    Books.adjust_rating_stats(instance.book_id, removed=instance.rating)
+
+
+@receiver(post_save, sender=Books)
+def index_book_on_save(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and not SEARCH_FIELDS.intersection(update_fields)):
+        return
+    search.index_book(instance)
+
+
+@receiver(post_save, sender=Books)
+def render_cover_variants(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and 'image' not in update_fields) or not images.is_stale(instance):
+        return
+
+    def render():
+        # Eight encodes and uploads: after the commit, not while the transaction holds its locks,
+        # and from the committed row in case the instance was saved again meanwhile
+        book = Books.objects.filter(pk=instance.pk).only('image', 'image_variants').first()
+        if not book or not images.refresh_variants(book):
+            return
+        # Pages cached meanwhile link to the old variants, whose files are gone now
+        invalidate_cached_pages(book.pk)
+        if book.image.name == instance.image.name:
+            # Keep a later save() of the instance from writing the old variants back
+            instance.image_variants = book.image_variants
+
+    transaction.on_commit(render, robust=True)
+
+
+@receiver(post_delete, sender=Books)
+def remove_book_from_index(sender, instance, **kwargs):
+    search.remove_book(instance.pk)
+
+
+@receiver(m2m_changed, sender=Books.genres.through)
+def index_book_on_genres_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # pk_set is not provided on clear, remember which books lose the genre
+        instance._cleared_book_ids = set(instance.books.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse and action == 'post_clear':
+        pk_set = getattr(instance, '_cleared_book_ids', None)
+    if not reverse:
+        search.index_book(instance)
+    elif pk_set:
+        for book in Books.objects.filter(pk__in=pk_set).prefetch_related('genres'):
+            search.index_book(book)
+
+
+@receiver(post_save, sender=Genre)
+def index_books_on_genre_renamed(sender, instance, created, raw=False, **kwargs):
+    if raw or created:
+        return
+    for book in instance.books.prefetch_related('genres'):
+        search.index_book(book)
+
+
+def invalidate_cached_pages(*book_ids):
+    """
+    Retire cached catalog pages and the detail pages of the given books once the write commits
+    """
+    bump_versions_on_commit(CATALOG_VERSION, *(book_version_name(pk) for pk in book_ids if pk))
+
+
+@receiver(post_save, sender=Books)
+@receiver(post_delete, sender=Books)
+def invalidate_pages_on_book_change(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    invalidate_cached_pages(instance.pk)
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_pages_on_review_change(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_rating', None)
+    invalidate_cached_pages(instance.book_id, previous[0] if previous else None)
+
+
+def touch_books(book_ids):
+    """
+    Bump updated_at (the books' Last-Modified / ETag input) for changes that don't save the book itself
+    """
+    book_ids = [pk for pk in book_ids if pk]
+    if book_ids:
+        Books.objects.filter(pk__in=book_ids).update(updated_at=timezone.now())
+    invalidate_cached_pages(*book_ids)
+
+
+@receiver(m2m_changed, sender=Books.genres.through)
+def touch_books_on_genres_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        touch_books([instance.pk])
+    else:
+        if action == 'post_clear':
+            pk_set = getattr(instance, '_cleared_book_ids', None)
+        touch_books(pk_set or ())
+
+
+@receiver(post_save, sender=Genre)
+def touch_books_on_genre_renamed(sender, instance, created, raw=False, **kwargs):
+    if raw or created:
+        return
+    touch_books(list(instance.books.values_list('pk', flat=True)))
+
+
+@receiver(pre_delete, sender=Genre)
+def touch_books_on_genre_deleted(sender, instance, **kwargs):
+    # The m2m rows go away without m2m_changed, so collect the books first
+    touch_books(list(instance.books.values_list('pk', flat=True)))
@@ -0,0 +1,36 @@
+from django import template
+
+register = template.Library()
+
+
+def _srcset(variants, fmt):
+    candidates = {}
+    for variant in variants:
+        candidates.setdefault(variant[fmt], variant['width'])
+    return ', '.join(f'{url} {width}w' for url, width in candidates.items())
+
+
+@register.inclusion_tag('books/cover.html')
+def book_cover(book, size, sizes=None, css_class='', style='', loading='lazy'):
+    """
+    <picture> for a book cover: WebP with a JPEG fallback, 1x and 2x variants
+    in srcset, or the original image while no variants exist
+
+    Usage: {% book_cover book 'card' sizes='240px' style='...' %}
+    """
+    context = {
+        'book': book, 'css_class': css_class, 'style': style, 'loading': loading,
+        'src': book.image.url if book.image else None,
+    }
+    cover = book.cover(size)
+    if cover:
+        variants = [cover['1x'], cover['2x']]
+        context.update({
+            'src': cover['1x']['jpeg'],
+            'width': cover['1x']['width'],
+            'height': cover['1x']['height'],
+            'webp_srcset': _srcset(variants, 'webp'),
+            'jpeg_srcset': _srcset(variants, 'jpeg'),
+            'sizes': sizes or f"{cover['1x']['width']}px",
+        })
+    return context
@@ -1,3 +1,1208 @@
-from django.test import TestCase
+import csv
+import datetime
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
+import requests
+from PIL import Image
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from . import covers, images, metrics
+from .cache import (
+    CacheEntry, CachedFailure, acquire_lock, bump_version, get_or_refresh, get_versions, make_key, release_lock,
+)
+from .google_client import GoogleBooksClient, get_client
+from .api_views import ReviewBatchCreateAPIView
+from .middleware import QueryBudgetExceeded, QueryRecorder, query_shape
+from .forms import BookForm
+from .models import User, Books, Review, GoogleBook, Genre, CacheVersion
+from .pagination import encode_cursor
+from .services import GoogleBooksService, search_cache_key
+from .search import SQLiteFTSBackend, InvertedIndexBackend, GOOGLE_BOOKS, search_book_ids
+from .serializers import BookSerializer
 
-# Create your tests here.
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'books.cache.TieredCache'},
+    'local': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-local'},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-shared'},
+}, SQL_INSTRUMENTATION=True, SQL_INSTRUMENTATION_STRICT=True, METRICS_DIR=None)
+class CacheIsolatedTestCase(TestCase):
+    """
+    Keeps cached pages and counters out of the real cache and between tests,
+    and fails any request that goes over its query budget (books/middleware.py)
+    """
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+
+class BookListQueryCountTests(CacheIsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email='reader@example.com', username='reader', password='secret')
+
+    def add_books(self, count):
+        for i in range(count):
+            book = Books.objects.create(
+                title=f'Book {i}', author='Author', description='...', price=10, created_by=self.user
+            )
+            Review.objects.create(book=book, user=self.user, rating=4, comment='Good')
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx), response
+
+    def test_book_list_api_query_count_is_constant(self):
+        self.add_books(2)
+        small, _ = self.count_queries(reverse('api-book-list-create'))
+        self.add_books(10)
+        large, response = self.count_queries(reverse('api-book-list-create'))
+        self.assertEqual(small, large)
+        self.assertEqual(response.json()['results'][0]['average_rating'], 4.0)
+        self.assertEqual(response.json()['results'][0]['reviews_count'], 1)
+
+    def test_home_query_count_is_bounded(self):
+        self.add_books(6)
+        Books.objects.update(image='book_images/cover.png')
+        # The Google shelf runs in worker threads on their own connections
+        with mock.patch.object(GoogleBooksService, 'get_featured_books', return_value=[]):
+            count, response = self.count_queries(reverse('home'))
+        self.assertEqual(len(response.context['featured_books']), 4)
+        # random_sample takes the id range, up to three sampling attempts and a fallback scan;
+        # a field missing from .only() would add one query per card on top
+        self.assertLessEqual(count, 5)
+
+    def test_book_search_api_query_count_is_constant(self):
+        self.add_books(2)
+        small, _ = self.count_queries(reverse('api-book-search') + '?q=Book')
+        self.add_books(10)
+        large, _ = self.count_queries(reverse('api-book-search') + '?q=Book')
+        self.assertEqual(small, large)
+
+
+class RatingStatsTests(CacheIsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.book = Books.objects.create(title='Dune', author='Frank Herbert', description='...', price=10)
+        self.other = Books.objects.create(title='Emma', author='Jane Austen', description='...', price=8)
+        self.users = [
+            User.objects.create_user(email=f'reader{i}@example.com', username=f'reader{i}', password='secret')
+            for i in range(3)
+        ]
+
+    def assertStats(self, book, count, avg, histogram):
+        book.refresh_from_db()
+        self.assertEqual((book.rating_count, book.rating_avg, book.rating_histogram), (count, avg, histogram))
+        # The incremental aggregates agree with a recount from the reviews
+        recounted = Books.objects.get(pk=book.pk)
+        recounted.recalculate_rating_stats()
+        self.assertEqual(
+            (recounted.rating_count, recounted.rating_avg, recounted.rating_histogram), (count, avg, histogram)
+        )
+
+    def test_review_writes_keep_aggregates_current(self):
+        first = Review.objects.create(book=self.book, user=self.users[0], rating=5, comment='Great')
+        second = Review.objects.create(book=self.book, user=self.users[1], rating=2, comment='Slow')
+        self.assertStats(self.book, 2, 3.5, {'5': 1, '2': 1})
+
+        second.rating = 4
+        second.save()
+        self.assertStats(self.book, 2, 4.5, {'5': 1, '4': 1})
+
+        # A comment edit leaves the rating alone
+        first.comment = 'Still great'
+        first.save()
+        self.assertStats(self.book, 2, 4.5, {'5': 1, '4': 1})
+
+        second.book = self.other
+        second.save()
+        self.assertStats(self.book, 1, 5.0, {'5': 1})
+        self.assertStats(self.other, 1, 4.0, {'4': 1})
+
+        first.delete()
+        self.assertStats(self.book, 0, 0, {})
+
+    def test_api_review_writes_keep_aggregates_current(self):
+        self.client.force_login(self.users[2])
+        response = self.client.post(reverse('api-review-create', args=[self.book.pk]), {'rating': 3, 'comment': 'Fine'})
+        self.assertEqual(response.status_code, 201)
+        self.assertStats(self.book, 1, 3.0, {'3': 1})
+        url = reverse('api-review-update-delete', args=[response.json()['id']])
+        response = self.client.patch(url, {'rating': 1}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertStats(self.book, 1, 1.0, {'1': 1})
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertStats(self.book, 0, 0, {})
+
+
+class QueryInstrumentationTests(CacheIsolatedTestCase):
+    def test_shapes_group_repeated_lookups(self):
+        books = [Books.objects.create(title=f'Book {i}', author='Author', description='', price=i) for i in range(6)]
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            for book in books:
+                Books.objects.get(pk=book.pk)
+            list(Books.objects.filter(pk__in=[1, 2, 3]))
+            list(Books.objects.filter(pk__in=[4, 5]))
+        self.assertEqual(recorder.count, 8)
+        (shape, count), (_, in_count) = recorder.repeated()
+        self.assertEqual(count, 6)
+        self.assertIn('"id" = ?', shape)
+        self.assertEqual(in_count, 2)
+        self.assertEqual(query_shape("SELECT 1 WHERE a IN (%s, %s, %s) AND b = 'x'"), 'SELECT ? WHERE a IN (?, ...) AND b = ?')
+
+    def test_server_timing_and_strict_budget(self):
+        response = self.client.get(reverse('book_list'))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", app;dur=[\d.]+$')
+        with override_settings(SQL_QUERY_BUDGET=0):
+            with self.assertRaisesMessage(QueryBudgetExceeded, 'over its budget of 0'):
+                self.client.get(reverse('book_list'), {'search': 'uncached'})
+
+
+class FullTextSearchTests(CacheIsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        for title, author, genres in [
+            ('Harry Potter and the Order of the Phoenix', 'J. K. Rowling', ['Fantasy', 'Fiction']),
+            ('The Order of Time', 'Carlo Rovelli', ['Non-Fiction', 'Science']),
+            ('Potter Wasps of Europe', 'Harriet Smith', ['Non-Fiction']),
+        ]:
+            book = Books.objects.create(title=title, author=author, description='...', price=10)
+            book.set_genre_names(genres)
+
+    def titles(self, backend, query):
+        return [Books.objects.get(pk=pk).title for pk, _ in backend.search(query)]
+
+    def check_backend(self, backend):
+        self.assertEqual(self.titles(backend, 'harr pott')[0], 'Harry Potter and the Order of the Phoenix')
+        self.assertEqual(self.titles(backend, '"order of time"'), ['The Order of Time'])
+        self.assertEqual(self.titles(backend, '"order of the"*'), ['Harry Potter and the Order of the Phoenix'])
+        self.assertEqual(self.titles(backend, 'fantasy'), ['Harry Potter and the Order of the Phoenix'])
+        self.assertEqual(self.titles(backend, 'rovelli science'), ['The Order of Time'])
+        self.assertEqual(self.titles(backend, '!!!'), [])
+
+    def test_fts5_backend(self):
+        self.check_backend(SQLiteFTSBackend())
+
+    def test_inverted_index_backend(self):
+        self.check_backend(InvertedIndexBackend())
+
+    def test_index_follows_updates_and_deletes(self):
+        backend = SQLiteFTSBackend()
+        book = Books.objects.get(title='The Order of Time')
+        book.title = 'Seven Brief Lessons on Physics'
+        book.save()
+        self.assertEqual(self.titles(backend, 'physics'), ['Seven Brief Lessons on Physics'])
+        book.delete()
+        self.assertEqual(backend.search('physics'), [])
+
+    def test_book_list_and_api_use_search(self):
+        response = self.client.get(reverse('book_list') + '?search=potter')
+        self.assertEqual(len(response.context['books']), 2)
+        response = self.client.get(reverse('api-book-search') + '?q="order of time"')
+        self.assertEqual([book['title'] for book in response.json()['results']], ['The Order of Time'])
+
+
+class GenreTests(CacheIsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email='reader@example.com', username='reader', password='secret')
+        self.dune = Books.objects.create(title='Dune', author='Frank Herbert', description='...', price=10)
+        self.dune.set_genre_names(['Fiction', 'Science Fiction'])
+        self.sapiens = Books.objects.create(title='Sapiens', author='Yuval Noah Harari', description='...', price=12)
+        self.sapiens.set_genre_names(['Non-Fiction'])
+
+    def test_filter_matches_whole_genres(self):
+        for genre, expected in [('Fiction', ['Dune']), (' fiction ', ['Dune']), ('Non-Fiction', ['Sapiens'])]:
+            response = self.client.get(reverse('book_list'), {'genre': genre})
+            self.assertEqual([book.title for book in response.context['books']], expected)
+            response = self.client.get(reverse('api-book-list-create'), {'genre': genre})
+            self.assertEqual([book['title'] for book in response.json()['results']], expected)
+
+    def test_form_round_trip(self):
+        form = BookForm(data={
+            'title': 'Emma', 'author': 'Jane Austen', 'description': '...', 'price': 8,
+            'genres': 'Romance, romance , Classics,',
+        })
+        self.assertTrue(form.is_valid(), form.errors)
+        book = form.save()
+        self.assertEqual(book.get_genre_list(), ['Classics', 'Romance'])
+        self.assertEqual(BookForm(instance=book).initial['genres'], 'Classics, Romance')
+
+    def test_serializer_round_trip(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('api-book-list-create'), {
+            'title': 'Emma', 'author': 'Jane Austen', 'description': '...', 'price': 8,
+            'genres': ['Romance', 'Classics', 'romance'],
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['genres'], ['Classics', 'Romance'])
+        book = Books.objects.get(pk=response.json()['id'])
+
+        serializer = BookSerializer(book, data={'genres': 'Fiction, Satire'}, partial=True)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        serializer.save()
+        self.assertEqual(BookSerializer(Books.objects.get(pk=book.pk)).data['genres'], ['Fiction', 'Satire'])
+        # Existing genres are reused, not duplicated
+        self.assertEqual(Genre.objects.filter(slug='fiction').count(), 1)
+        self.assertFalse(BookSerializer(book, data={'genres': [1, 2]}, partial=True).is_valid())
+
+
+class KeysetPaginationTests(CacheIsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        # Duplicate titles and prices so the id tie-breaker matters
+        for i in range(25):
+            Books.objects.create(title=f'Book {i % 7}', author='Author', description='...', price=i % 5)
+
+    def walk(self, url):
+        titles, pages = [], []
+        while url:
+            body = self.client.get(url).json()
+            pages.append(body)
+            titles.extend((book['price'], book['title'], book['id']) for book in body['results'])
+            url = body['next']
+        return titles, pages
+
+    def test_api_pages_cover_every_book_once_in_order(self):
+        url = reverse('api-book-list-create') + '?ordering=-price&page_size=4'
+        rows, pages = self.walk(url)
+        expected = sorted(Books.objects.values_list('price', 'title', 'id'), key=lambda r: (-r[0], -r[2]))
+        self.assertEqual(rows, expected)
+        self.assertIsNone(pages[0]['previous'])
+
+        # Walking back from the last page returns the same pages
+        previous = self.client.get(pages[-1]['previous']).json()
+        self.assertEqual(previous['results'], pages[-2]['results'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('api-book-list-create') + '?cursor=nonsense')
+        self.assertEqual(response.status_code, 404)
+        # Well-formed cursors whose values don't fit the ordering's columns
+        for ordering, values in [('price', ['cheap', 1]), ('price', [None, 1]), ('title', ['Book 1', {'id': 1}])]:
+            url = reverse('api-book-list-create') + f'?ordering={ordering}&cursor={encode_cursor(values)}'
+            self.assertEqual(self.client.get(url).status_code, 404)
+        response = self.client.get(reverse('book_list'), {'ordering': 'price', 'cursor': encode_cursor(['cheap', 1])})
+        self.assertEqual(response.status_code, 200)
+
+    def test_approximate_total(self):
+        response = self.client.get(reverse('api-book-list-create') + '?with_total=1')
+        self.assertEqual(response.json()['approximate_total'], 25)
+
+
+class ReviewPaginationTests(CacheIsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.book = Books.objects.create(title='Dune', author='Frank Herbert', description='...', price=10)
+        users = User.objects.bulk_create([
+            User(email=f'reader{i}@example.com', username=f'reader{i}') for i in range(23)
+        ])
+        for i, user in enumerate(users):
+            Review.objects.create(book=self.book, user=user, rating=1 + i % 5, comment=f'Review {i}')
+        self.expected = list(self.book.reviews.order_by('-updated_at', '-id').values_list('pk', flat=True))
+
+    def ids(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [review.pk for review in response.context['reviews']]
+
+    def test_load_more_walks_every_review_once(self):
+        response = self.client.get(reverse('review_detail', args=[self.book.pk]))
+        seen = self.ids(response)
+        self.assertEqual(len(seen), 10)
+        url = response.context['more_reviews_url']
+        self.assertContains(response, f'data-load-more="{url}"')
+        while url:
+            response = self.client.get(url)
+            self.assertNotContains(response, '<html')
+            seen += self.ids(response)
+            url = response.context['more_reviews_url']
+        self.assertEqual(seen, self.expected)
+        self.assertNotContains(response, 'data-load-more')
+        self.assertNotContains(response, 'No reviews yet')
+
+    def test_invalid_cursor_falls_back_to_the_first_page(self):
+        fragment = reverse('review_list_fragment', args=[self.book.pk])
+        for cursor in ('nonsense', encode_cursor(['yesterday', 1]), encode_cursor([1, 2, 3])):
+            self.assertEqual(self.ids(self.client.get(fragment, {'cursor': cursor})), self.expected[:10])
+
+    def test_fragment_is_invalidated_by_a_new_review(self):
+        fragment = reverse('review_list_fragment', args=[self.book.pk])
+        self.assertEqual(self.ids(self.client.get(fragment)), self.expected[:10])
+        user = User.objects.create(email='late@example.com', username='late')
+        with self.captureOnCommitCallbacks(execute=True):
+            review = Review.objects.create(book=self.book, user=user, rating=5, comment='Late')
+        self.assertEqual(self.ids(self.client.get(fragment)), [review.pk] + self.expected[:9])
+
+    def test_fragment_of_a_missing_book(self):
+        response = self.client.get(reverse('review_list_fragment', args=[self.book.pk + 100]))
+        self.assertEqual(response.status_code, 404)
+
+
+class ResponseCacheTests(CacheIsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email='reader@example.com', username='reader', password='secret')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book = Books.objects.create(title='Dune', author='Frank Herbert', description='...', price=10)
+
+    def get(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_pages_are_cached_until_a_write_commits(self):
+        detail = reverse('review_detail', args=[self.book.pk])
+        api_detail = reverse('api-book-detail', args=[self.book.pk])
+        listing = reverse('book_list')
+        for url in (detail, api_detail, listing):
+            self.assertEqual(self.get(url)['X-Cache'], 'MISS')
+            self.assertEqual(self.get(url)['X-Cache'], 'HIT')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(book=self.book, user=self.user, rating=5, comment='Spice')
+        self.assertContains(self.get(detail), 'Spice')
+        self.assertEqual(self.get(api_detail).json()['reviews_count'], 1)
+        self.assertEqual(self.get(listing)['X-Cache'], 'MISS')
+
+    def test_rebuilding_rating_stats_invalidates_cached_pages(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(book=self.book, user=self.user, rating=5, comment='Spice')
+        # Aggregates drifted from the reviews, e.g. after a raw SQL fix
+        Books.objects.update(rating_avg=0, rating_count=0, rating_histogram={})
+        api_detail = reverse('api-book-detail', args=[self.book.pk])
+        listing = reverse('book_list')
+        for url in (api_detail, listing):
+            self.get(url)
+            self.assertEqual(self.get(url)['X-Cache'], 'HIT')
+        self.assertEqual(self.get(api_detail).json()['reviews_count'], 0)
+
+        updated_at = Books.objects.get().updated_at
+        call_command('rebuild_rating_stats', stdout=io.StringIO())
+        self.assertGreater(Books.objects.get().updated_at, updated_at)
+        self.assertEqual(self.get(api_detail).json()['reviews_count'], 1)
+        self.assertEqual(self.get(listing)['X-Cache'], 'MISS')
+
+    def test_versions_are_counted_in_the_database(self):
+        self.assertEqual(get_versions('never_bumped'), [0])
+        bump_version('counter')
+        start, = get_versions('counter')
+        self.assertGreater(start, 0)
+        # The cache holds no counter that a worker could overwrite with an older value
+        cache.clear()
+        bump_version('counter', 'other')
+        self.assertEqual(get_versions('counter'), [start + 1])
+
+    def test_key_ignores_parameter_order_and_whitespace(self):
+        url = reverse('book_list')
+        self.get(url, search='dune', ordering='title')
+        response = self.client.get(f'{url}?ordering=title&search=%20dune%20')
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+    def test_authenticated_html_is_not_cached(self):
+        self.client.force_login(self.user)
+        response = self.get(reverse('book_list'))
+        self.assertFalse(response.has_header('X-Cache'))
+
+
+class CacheHelperTests(CacheIsolatedTestCase):
+    @staticmethod
+    def file_based(directory):
+        return override_settings(CACHES={
+            'default': {'BACKEND': 'books.cache.TieredCache'},
+            'local': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'lock-test'},
+            'shared': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory},
+        })
+
+    def test_lock_is_exclusive_on_every_shared_backend(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for backend in (override_settings(), self.file_based(directory)):
+                with backend:
+                    self.assertTrue(acquire_lock('refresh:a', 60))
+                    self.assertFalse(acquire_lock('refresh:a', 60))
+                    self.assertTrue(acquire_lock('refresh:b', 60))
+                    release_lock('refresh:a')
+                    self.assertTrue(acquire_lock('refresh:a', 60))
+                    release_lock('refresh:a')
+                    release_lock('refresh:b')
+            self.assertEqual(os.listdir(os.path.join(directory, 'locks')), [])
+
+    def test_file_lock_of_a_dead_worker_expires(self):
+        with tempfile.TemporaryDirectory() as directory, self.file_based(directory):
+            self.assertTrue(acquire_lock('refresh:a', 60))
+            path = os.path.join(directory, 'locks', os.listdir(os.path.join(directory, 'locks'))[0])
+            os.utime(path, (time.time() - 120, time.time() - 120))
+            self.assertTrue(acquire_lock('refresh:a', 60))
+            self.assertFalse(acquire_lock('refresh:a', 60))
+
+    def test_concurrent_misses_share_one_producer_call(self):
+        calls, started, release = [], threading.Event(), threading.Event()
+
+        def producer():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'value'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(get_or_refresh('flight', producer, 60)))
+                   for _ in range(5)]
+        threads[0].start()
+        self.assertTrue(started.wait(5))
+        for thread in threads[1:]:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(results, ['value'] * 5)
+        self.assertEqual(len(calls), 1)
+
+    def test_miss_waits_for_the_worker_holding_the_fetch_lock(self):
+        # Another worker is fetching: its result shows up in the shared cache
+        self.assertTrue(acquire_lock('flight:fetching', 60))
+        self.addCleanup(release_lock, 'flight:fetching')
+        timer = threading.Timer(0.1, lambda: cache.set('flight', CacheEntry('theirs', time.time() + 60), 120))
+        timer.start()
+        self.addCleanup(timer.join)
+        producer = mock.Mock(return_value='ours')
+        self.assertEqual(get_or_refresh('flight', producer, 60), 'theirs')
+        producer.assert_not_called()
+
+    def test_failures_are_negative_cached(self):
+        producer = mock.Mock(side_effect=RuntimeError('upstream down'))
+        with self.assertRaisesMessage(RuntimeError, 'upstream down'):
+            get_or_refresh('failing', producer, 60, negative_timeout=60)
+        with self.assertRaisesMessage(CachedFailure, 'upstream down'):
+            get_or_refresh('failing', producer, 60, negative_timeout=60)
+        self.assertEqual(producer.call_count, 1)
+
+        # Once the failure expires the producer is called again
+        cache.delete('failing')
+        producer.side_effect, producer.return_value = None, 'recovered'
+        self.assertEqual(get_or_refresh('failing', producer, 60), 'recovered')
+        self.assertEqual(producer.call_count, 2)
+
+        # Without a negative timeout every miss retries
+        producer = mock.Mock(side_effect=RuntimeError('upstream down'))
+        for _ in range(2):
+            with self.assertRaises(RuntimeError):
+                get_or_refresh('uncached', producer, 60, negative_timeout=0)
+        self.assertEqual(producer.call_count, 2)
+
+
+class ConditionalGetTests(CacheIsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email='reader@example.com', username='reader', password='secret')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book = Books.objects.create(title='Dune', author='Frank Herbert', description='...', price=10)
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code
+
+    def test_unchanged_resources_answer_304(self):
+        for url in (
+            reverse('api-book-list-create'),
+            reverse('api-book-detail', args=[self.book.pk]),
+            reverse('review_detail', args=[self.book.pk]),
+        ):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.has_header('Last-Modified'))
+            self.assertEqual(self.revalidate(url, response), 304)
+            since = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(since.status_code, 304)
+
+    def test_writes_change_the_validators(self):
+        list_url = reverse('api-book-list-create')
+        detail_url = reverse('api-book-detail', args=[self.book.pk])
+        listing, detail = self.client.get(list_url), self.client.get(detail_url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(book=self.book, user=self.user, rating=5, comment='Spice')
+        self.assertEqual(self.revalidate(list_url, listing), 200)
+        self.assertEqual(self.revalidate(detail_url, detail), 200)
+
+        detail = self.client.get(detail_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.set_genre_names(['Science Fiction'])
+        self.assertEqual(self.revalidate(detail_url, detail), 200)
+
+    def test_rebuilding_rating_stats_changes_the_validators(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(book=self.book, user=self.user, rating=5, comment='Spice')
+        Books.objects.update(rating_avg=0, rating_count=0, rating_histogram={})
+        CacheVersion.objects.update(changed_at=timezone.now() - datetime.timedelta(hours=1))
+        list_url = reverse('api-book-list-create')
+        detail_url = reverse('api-book-detail', args=[self.book.pk])
+        listing, detail = self.client.get(list_url), self.client.get(detail_url)
+        self.assertEqual(self.revalidate(list_url, listing), 304)
+
+        call_command('rebuild_rating_stats', stdout=io.StringIO())
+        self.assertEqual(self.revalidate(list_url, listing), 200)
+        self.assertEqual(self.client.get(list_url, HTTP_IF_MODIFIED_SINCE=listing['Last-Modified']).status_code, 200)
+        self.assertEqual(self.revalidate(detail_url, detail), 200)
+
+    def test_deleting_a_book_changes_the_list_validators(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            other = Books.objects.create(title='Emma', author='Jane Austen', description='...', price=8)
+        CacheVersion.objects.update(changed_at=timezone.now() - datetime.timedelta(hours=1))
+        # A page that doesn't show the deleted book
+        list_url = reverse('api-book-list-create') + '?ordering=title&page_size=1'
+        listing = self.client.get(list_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        self.assertEqual(self.client.get(list_url, HTTP_IF_MODIFIED_SINCE=listing['Last-Modified']).status_code, 200)
+        self.assertEqual(self.revalidate(list_url, listing), 200)
+
+
+class CatalogExportTests(CacheIsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            email='staff@example.com', username='staff', password='secret', is_staff=True,
+        )
+        self.old = Books.objects.create(title='Dune', author='Frank Herbert', description='...', price=10)
+        self.old.set_genre_names(['Science Fiction'])
+        Books.objects.filter(pk=self.old.pk).update(updated_at=timezone.now() - datetime.timedelta(days=30))
+        self.new = Books.objects.create(title='Emma', author='Jane Austen', description='...', price=8)
+        Review.objects.create(book=self.new, user=self.user, rating=4, comment='Witty, "sharp"')
+
+    def export(self, url):
+        self.client.force_login(self.user)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_ndjson_export_with_updated_since(self):
+        url = reverse('api-catalog-export', args=['books', 'ndjson'])
+        rows = [json.loads(line) for line in self.export(url).splitlines()]
+        self.assertEqual([row['title'] for row in rows], ['Dune', 'Emma'])
+        self.assertEqual(rows[0]['genres'], ['Science Fiction'])
+
+        since = (timezone.now() - datetime.timedelta(days=1)).date().isoformat()
+        rows = [json.loads(line) for line in self.export(f'{url}?updated_since={since}').splitlines()]
+        self.assertEqual([row['title'] for row in rows], ['Emma'])
+
+    def test_csv_export(self):
+        rows = list(csv.reader(io.StringIO(self.export(reverse('api-catalog-export', args=['reviews', 'csv'])))))
+        self.assertEqual(rows[0], ['id', 'book_id', 'user_id', 'rating', 'comment', 'updated_at'])
+        self.assertEqual(rows[1][4], 'Witty, "sharp"')
+
+    def test_staff_only(self):
+        url = reverse('api-catalog-export', args=['reviews', 'csv'])
+        self.assertIn(self.client.get(url).status_code, (401, 403))
+        reader = User.objects.create_user(email='reader@example.com', username='reader', password='secret')
+        self.client.force_login(reader)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_bad_requests(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('api-catalog-export', args=['users', 'csv'])).status_code, 400)
+        url = reverse('api-catalog-export', args=['books', 'csv']) + '?updated_since=yesterday'
+        self.assertEqual(self.client.get(url).status_code, 400)
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('export_catalog', 'books', '--format', 'csv', stdout=out, stderr=io.StringIO())
+        self.assertEqual(len(out.getvalue().splitlines()), 3)
+
+
+class ImportBooksTests(CacheIsolatedTestCase):
+    def write(self, text, suffix='.csv'):
+        handle, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(handle, 'w') as f:
+            f.write(text)
+        self.addCleanup(lambda: [os.remove(p) for p in (path, f'{path}.checkpoint') if os.path.exists(p)])
+        return path
+
+    def run_import(self, path, *args):
+        call_command('import_books', path, '--skip-index', *args, stdout=io.StringIO(), stderr=io.StringIO())
+
+    def test_import_dedupes_and_links_genres(self):
+        Books.objects.create(title='Dune', author='Frank Herbert', description='...', price=10)
+        path = self.write(
+            'title,author,price,genres\n'
+            'DUNE,frank herbert,10,\n'
+            'Emma,Jane Austen,8,"Romance, Classics"\n'
+            'Emma,Jane Austen,8,\n'
+            ',Nobody,1,\n'
+        )
+        self.run_import(path, '--transaction-size', '2')
+        self.assertEqual(Books.objects.count(), 2)
+        self.assertEqual(Books.objects.get(title='Emma').get_genre_list(), ['Classics', 'Romance'])
+        self.assertFalse(os.path.exists(f'{path}.checkpoint'))
+
+    def test_bad_rows_are_skipped_not_fatal(self):
+        path = self.write('\n'.join(json.dumps(row) for row in [
+            {'title': 'Numbers', 'author': 'X', 'genres': 42},
+            {'title': 'Nested', 'author': 'X', 'genres': '[1, 2]'},
+            {'title': 'Objects', 'author': 'X', 'genres': [{'name': 'Fiction'}]},
+            {'title': 'Infinite', 'author': 'X', 'price': 'inf'},
+            {'title': 'Not a number', 'author': 'X', 'price': 'NaN'},
+            {'title': 'Bad date', 'author': 'X', 'published_date': '2020-13-45'},
+            {'title': 'Huge', 'author': 'X', 'price': '1e20'},
+            {'title': 'Vague date', 'author': 'X', 'published_date': 'yesterday'},
+            {'title': ['List'], 'author': 'X'},
+            {'title': 1984, 'author': 'George Orwell', 'price': 9, 'genres': '["Dystopia"]'},
+        ]) + '\n', suffix='.jsonl')
+        self.run_import(path)
+        book = Books.objects.get()
+        self.assertEqual((book.title, book.get_genre_list()), ('1984', ['Dystopia']))
+
+    def test_resume_from_checkpoint(self):
+        path = self.write('{"title": "A", "author": "X"}\n{"title": "B", "author": "X"}\n', suffix='.jsonl')
+        with open(f'{path}.checkpoint', 'w') as f:
+            json.dump({'rows': 1, 'imported': 1, 'duplicates': 0, 'errors': 0}, f)
+        self.run_import(path)
+        self.assertEqual(list(Books.objects.values_list('title', flat=True)), ['B'])
+
+
+class BatchWriteTests(CacheIsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email='reader@example.com', username='reader', password='secret')
+        self.client.force_login(self.user)
+
+    def post(self, name, items):
+        return self.client.post(reverse(name), items, content_type='application/json')
+
+    def test_book_batch(self):
+        response = self.post('api-book-batch-create', [
+            {'title': 'Dune', 'author': 'Frank Herbert', 'description': '...', 'price': 10, 'genres': 'Science Fiction'},
+            {'title': 'No price', 'author': 'Anon', 'description': '...'},
+        ])
+        self.assertEqual(response.status_code, 207)
+        body = response.json()
+        self.assertEqual([r['status'] for r in body['results']], ['created', 'error'])
+        self.assertIn('price', body['results'][1]['errors'])
+        book = Books.objects.get(pk=body['results'][0]['id'])
+        self.assertEqual(book.get_genre_list(), ['Science Fiction'])
+        self.assertEqual(book.created_by, self.user)
+        self.assertEqual(search_book_ids('dune'), [book.pk])
+
+    def test_review_batch_uses_a_constant_number_of_queries(self):
+        books = [Books.objects.create(title=f'Book {i}', author='A', description='...', price=1) for i in range(30)]
+        Review.objects.create(book=books[0], user=self.user, rating=1, comment='Already')
+        items = [{'book': book.pk, 'rating': 4, 'comment': 'Good'} for book in books]
+        items += [{'book': books[1].pk, 'rating': 5, 'comment': 'Twice'}, {'book': 0, 'rating': 5, 'comment': 'x'},
+                  {'book': books[2].pk, 'rating': 9, 'comment': 'Out of range'}]
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.post('api-review-batch-create', items)
+        self.assertEqual(response.status_code, 207)
+        self.assertLess(len(ctx), 15)
+        body = response.json()
+        self.assertEqual((body['created'], body['failed']), (29, 4))
+        self.assertEqual(body['results'][0]['errors'], {'book': ['You have already reviewed this book.']})
+        books[1].refresh_from_db()
+        self.assertEqual((books[1].rating_count, books[1].rating_avg, books[1].rating_histogram), (1, 4.0, {'4': 1}))
+
+    def test_review_batch_reports_a_concurrent_duplicate(self):
+        books = [Books.objects.create(title=f'Book {i}', author='A', description='...', price=1) for i in range(2)]
+        # Written by a parallel request after this one checked for existing reviews
+        Review.objects.create(book=books[0], user=self.user, rating=1, comment='Parallel')
+        reviewed_books = ReviewBatchCreateAPIView.reviewed_books
+        calls = []
+
+        def check(*args):
+            calls.append(args)
+            return set() if len(calls) == 1 else reviewed_books(*args)
+
+        with mock.patch.object(ReviewBatchCreateAPIView, 'reviewed_books', side_effect=check):
+            response = self.post('api-review-batch-create', [
+                {'book': book.pk, 'rating': 4, 'comment': 'Good'} for book in books
+            ])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([r['status'] for r in response.json()['results']], ['error', 'created'])
+        self.assertEqual(len(calls), 2)
+        books[1].refresh_from_db()
+        self.assertEqual((books[1].rating_count, books[1].rating_avg), (1, 4.0))
+
+    def test_rejects_non_list(self):
+        self.assertEqual(self.post('api-review-batch-create', {'book': 1}).status_code, 400)
+
+
+class FakeGoogleResponse:
+    status_code = 200
+    headers = {}
+
+    def __init__(self, url):
+        self.url = url
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        volume_id = self.url.rstrip('/').rsplit('/', 1)[-1]
+        item = {'id': volume_id if volume_id != 'volumes' else 'vol1', 'volumeInfo': {'title': f'Title {volume_id}'}}
+        return item if volume_id != 'volumes' else {'totalItems': 1, 'items': [item]}
+
+
+class GoogleClientTests(CacheIsolatedTestCase):
+    def test_deadline_bounds_retries(self):
+        client = GoogleBooksClient('https://books.example.com', max_retries=5, timeout=10)
+        with mock.patch.object(client.session, 'get', side_effect=requests.Timeout('slow')) as get, \
+                mock.patch.object(client, '_delay', return_value=0.2):
+            started = time.monotonic()
+            with self.assertRaises(requests.Timeout):
+                client.get('/volumes/v1', deadline=0.3)
+        # The second backoff would overrun the deadline, and no attempt may outlast it
+        self.assertEqual(get.call_count, 2)
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertLessEqual(get.call_args_list[1].kwargs['timeout'], 0.1)
+
+    def test_max_retries_per_call(self):
+        client = GoogleBooksClient('https://books.example.com', max_retries=5)
+        with mock.patch.object(client.session, 'get', side_effect=requests.ConnectionError('down')) as get:
+            with self.assertRaises(requests.ConnectionError):
+                client.fetch('https://books.example.com/cover.jpg', max_retries=0)
+        self.assertEqual(get.call_count, 1)
+
+
+class WarmGoogleBooksTests(CacheIsolatedTestCase):
+    def warm(self, *args):
+        out = io.StringIO()
+        with mock.patch.object(get_client().session, 'get', side_effect=lambda url, **kw: FakeGoogleResponse(url)) as get:
+            call_command('warm_google_books', *args, stdout=out, stderr=io.StringIO())
+        return get.call_count, out.getvalue()
+
+    def test_warms_featured_queries_and_popular_books_within_budget(self):
+        GoogleBook.objects.create(google_id='hot', title='Hot', view_count=10)
+        GoogleBook.objects.create(google_id='cold', title='Cold')
+        calls, _ = self.warm('--query', 'a', '--query', 'b')
+        self.assertEqual(calls, 3)
+        self.assertTrue(cache.get(search_cache_key('a', 0, GoogleBooksService.FEATURED_PER_QUERY)))
+        self.assertIsNotNone(GoogleBook.objects.get(google_id='hot').fetched_at)
+        self.assertIsNone(GoogleBook.objects.get(google_id='cold').fetched_at)
+
+        # Everything is fresh now; a warmer run with a tiny margin calls nothing
+        calls, _ = self.warm('--query', 'a', '--query', 'b', '--ahead', '60')
+        self.assertEqual(calls, 0)
+
+        cache.clear()
+        calls, output = self.warm('--query', 'a', '--query', 'b', '--budget', '1')
+        self.assertEqual(calls, 1)
+        self.assertIn('2 entries left unwarmed', output)
+
+
+class FeaturedBooksTests(CacheIsolatedTestCase):
+    def test_slow_or_failing_categories_only_cost_their_own_results(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def search_books(query, max_results):
+            if query == 'slow':
+                release.wait(10)
+                raise requests.Timeout('slow upstream')
+            if query == 'broken':
+                raise requests.ConnectionError('upstream down')
+            return {'books': [mock.Mock(google_id=f'{query}-{i}') for i in range(max_results)]}
+
+        service = GoogleBooksService()
+        with mock.patch.object(GoogleBooksService, 'FEATURED_QUERIES', ['fiction', 'slow', 'broken', 'history']), \
+                mock.patch.object(service, 'search_books', side_effect=search_books):
+            started = time.monotonic()
+            books = service.get_featured_books(max_results=12, deadline=0.2)
+            elapsed = time.monotonic() - started
+        self.assertEqual([book.google_id for book in books], ['fiction-0', 'fiction-1', 'history-0', 'history-1'])
+        self.assertLess(elapsed, 2)
+
+
+class GoogleBookDetailFreshnessTests(CacheIsolatedTestCase):
+    def get_details(self, google_id, fail=False):
+        def fake_get(url, **kwargs):
+            if fail:
+                raise requests.ConnectionError('down')
+            return FakeGoogleResponse(url)
+        with mock.patch.object(get_client().session, 'get', side_effect=fake_get) as get, \
+                mock.patch.object(get_client(), 'max_retries', 0), \
+                mock.patch('books.services.refresh_in_background') as background:
+            book = GoogleBooksService().get_book_details(google_id)
+        return book, get.call_count, background.call_count
+
+    def test_fresh_rows_are_served_without_calling_the_api(self):
+        GoogleBook.objects.create(google_id='vol1', title='Stored', fetched_at=timezone.now())
+        book, calls, refreshes = self.get_details('vol1')
+        self.assertEqual((book.title, calls, refreshes), ('Stored', 0, 0))
+
+    def test_stale_rows_are_served_and_refreshed_in_the_background(self):
+        stale = timezone.now() - datetime.timedelta(days=1)
+        GoogleBook.objects.create(google_id='vol1', title='Stored', fetched_at=stale)
+        book, calls, refreshes = self.get_details('vol1', fail=True)
+        self.assertEqual((book.title, calls, refreshes), ('Stored', 0, 1))
+
+    def test_unknown_books_are_fetched_once(self):
+        book, calls, _ = self.get_details('vol2')
+        self.assertEqual((book.title, calls), ('Title vol2', 1))
+        self.assertIsNone(self.get_details('vol3', fail=True)[0])
+
+    def test_unchanged_payload_still_counts_as_fetched(self):
+        service = GoogleBooksService()
+        with mock.patch.object(get_client().session, 'get', side_effect=lambda url, **kw: FakeGoogleResponse(url)):
+            service._fetch_details('vol1')
+            GoogleBook.objects.update(fetched_at=None)
+            updated_at = GoogleBook.objects.get().updated_at
+            service._fetch_details('vol1')
+        book = GoogleBook.objects.get()
+        self.assertIsNotNone(book.fetched_at)
+        self.assertEqual(book.updated_at, updated_at)
+
+    def test_views_are_sampled_and_revalidations_not_counted(self):
+        GoogleBook.objects.create(google_id='vol1', title='Stored', fetched_at=timezone.now())
+        url = reverse('google_book_detail', args=['vol1'])
+        with override_settings(GOOGLE_BOOK_VIEW_SAMPLE_RATE=1):
+            etag = self.client.get(url)['ETag']
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(GoogleBook.objects.get().view_count, 1)
+
+        with override_settings(GOOGLE_BOOK_VIEW_SAMPLE_RATE=10), CaptureQueriesContext(connection) as ctx:
+            for _ in range(50):
+                GoogleBook.record_view('vol1')
+        views = GoogleBook.objects.get().view_count - 1
+        self.assertEqual(views % 10, 0)
+        self.assertEqual(len(ctx), views // 10)
+
+
+class GoogleBookLocalSearchTests(CacheIsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        service = GoogleBooksService()
+        service._store_books([
+            {'google_id': 'a', 'title': 'The Left Hand of Darkness', 'authors': ['Ursula K. Le Guin'],
+             'categories': ['Fiction']},
+            {'google_id': 'b', 'title': 'Darkness Visible', 'authors': ['William Styron'], 'categories': ['Memoir']},
+        ])
+
+    def test_backends(self):
+        for backend in (SQLiteFTSBackend(GOOGLE_BOOKS), InvertedIndexBackend(corpus=GOOGLE_BOOKS)):
+            titles = [GoogleBook.objects.get(pk=pk).title for pk, _ in backend.search('le guin')]
+            self.assertEqual(titles, ['The Left Hand of Darkness'])
+
+    def test_api_and_view(self):
+        response = self.client.get(reverse('api-google-book-search'), {'q': 'darkness'})
+        self.assertEqual(len(response.json()['results']), 2)
+        response = self.client.get(reverse('api-google-book-search'), {'q': 'memoir'})
+        self.assertEqual([book['google_id'] for book in response.json()['results']], ['b'])
+        response = self.client.get(reverse('google_books_local_search'), {'q': 'styron'})
+        self.assertEqual([book.google_id for book in response.context['books']], ['b'])
+
+    def test_view_pages_by_cursor(self):
+        GoogleBook.objects.bulk_create([
+            GoogleBook(google_id=f'popular-{i:02d}', title=f'Popular {i}', view_count=i) for i in range(25)
+        ])
+        response = self.client.get(reverse('google_books_local_search'))
+        first = [book.google_id for book in response.context['books']]
+        self.assertEqual(first[:2], ['popular-24', 'popular-23'])
+        self.assertEqual(len(first), 20)
+        self.assertIsNone(response.context['previous_url'])
+        self.assertContains(response, 'cursor=')
+
+        response = self.client.get(reverse('google_books_local_search') + response.context['next_url'])
+        second = [book.google_id for book in response.context['books']]
+        self.assertEqual(len(second), 7)
+        self.assertFalse(set(first) & set(second))
+        self.assertIsNone(response.context['next_url'])
+
+        response = self.client.get(reverse('google_books_local_search'), {'cursor': 'garbage'})
+        self.assertEqual([book.google_id for book in response.context['books']], first)
+
+    def test_updates_are_reindexed(self):
+        GoogleBooksService()._store_books([
+            {'google_id': 'b', 'title': 'Sophie\'s Choice', 'authors': ['William Styron'], 'categories': ['Fiction']},
+        ])
+        self.assertEqual(list(GoogleBook.objects.search('sophie').values_list('google_id', flat=True)), ['b'])
+        self.assertFalse(GoogleBook.objects.search('visible').exists())
+
+
+class CoverVariantTests(CacheIsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name, STORAGES={
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        })
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.media_root = media_root.name
+
+    def upload(self, size=(1200, 1800), color='navy'):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, color).save(buffer, 'PNG')
+        return SimpleUploadedFile('cover.png', buffer.getvalue(), content_type='image/png')
+
+    def test_variants_rendered_on_save(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            book = Books.objects.create(title='Dune', author='Frank Herbert', description='', price=10, image=self.upload())
+            # Rendered once the transaction commits, not inside it
+            self.assertEqual(Books.objects.get(pk=book.pk).image_variants, {})
+        variants = Books.objects.get(pk=book.pk).image_variants
+        self.assertEqual(variants['card']['width'], 213)
+        self.assertEqual(variants['card_2x']['height'], 640)
+        self.assertEqual(len(variants['files']), len(images.VARIANTS) * len(images.FORMATS))
+        for name in variants['files']:
+            self.assertTrue(os.path.exists(os.path.join(self.media_root, name)))
+        self.assertEqual(variants['detail']['jpeg'], f"/media/{variants['files'][5]}")
+        with Image.open(os.path.join(self.media_root, variants['files'][0])) as rendered:
+            self.assertEqual((rendered.format, rendered.size), ('WEBP', (213, 320)))
+
+        # Saving other fields keeps the variants; a new image replaces them and their files
+        book.price = 12
+        with self.captureOnCommitCallbacks(execute=True):
+            book.save()
+        self.assertEqual(Books.objects.get(pk=book.pk).image_variants, variants)
+        book.image = self.upload(color='red')
+        with self.captureOnCommitCallbacks(execute=True):
+            book.save()
+        replaced = Books.objects.get(pk=book.pk).image_variants
+        self.assertNotEqual(replaced['files'], variants['files'])
+        for name in variants['files']:
+            self.assertFalse(os.path.exists(os.path.join(self.media_root, name)))
+
+        response = self.client.get(reverse('book_list'))
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, f"{replaced['card_2x']['webp']} 427w")
+
+    def test_clearing_the_image_deletes_its_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            book = Books.objects.create(title='Dune', author='Frank Herbert', description='', price=10, image=self.upload())
+        files = Books.objects.get(pk=book.pk).image_variants['files']
+        book.image = None
+        with self.captureOnCommitCallbacks(execute=True):
+            book.save()
+        self.assertEqual(Books.objects.get(pk=book.pk).image_variants, {})
+        for name in files:
+            self.assertFalse(os.path.exists(os.path.join(self.media_root, name)))
+
+    def test_backfill_command(self):
+        book = Books.objects.create(title='Dune', author='Frank Herbert', description='', price=10, image=self.upload())
+        Books.objects.filter(pk=book.pk).update(image_variants={})
+        out = io.StringIO()
+        call_command('generate_image_variants', stdout=out)
+        self.assertIn('1 books rendered', out.getvalue())
+        self.assertIn('detail_2x', Books.objects.get(pk=book.pk).image_variants)
+        call_command('generate_image_variants', stdout=out)
+        self.assertIn('0 books rendered, 1 already up to date', out.getvalue())
+
+
+class FakeCoverResponse(FakeGoogleResponse):
+    headers = {'Content-Type': 'image/jpeg'}
+    closed = False
+
+    @property
+    def content(self):
+        # Same bytes for every URL of one book, so content addressing can dedupe them
+        return b'\xff\xd8cover-of-' + self.url.split('id=')[1].split('&')[0].encode() + b'\x00' * 1000
+
+    def iter_content(self, chunk_size):
+        content = self.content
+        for start in range(0, len(content), chunk_size):
+            yield content[start:start + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+class GoogleCoverProxyTests(CacheIsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.covers = covers.CoverCache(root.name, max_bytes=2500, max_image_bytes=10000)
+        patcher = mock.patch.object(covers, '_cover_cache', self.covers)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.book = GoogleBook.objects.create(
+            google_id='g1', title='One', image_url='http://books.google.com/books/content?id=g1&zoom=1',
+        )
+
+    def get(self, url, **headers):
+        with mock.patch.object(get_client().session, 'get', side_effect=lambda url, **kw: FakeCoverResponse(url)) as get:
+            response = self.client.get(url, **headers)
+        return response, get
+
+    def test_fetched_once_and_served_immutable(self):
+        url = self.book.cover_url
+        response, upstream = self.get(url)
+        self.assertEqual(upstream.call_args.args[0], 'https://books.google.com/books/content?id=g1&zoom=1')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'\xff\xd8cover-of-g1'))
+
+        response, upstream = self.get(url)
+        self.assertEqual(upstream.call_count, 0)
+        response, _ = self.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        # A changed image_url gets a new address; the old one redirects to it
+        GoogleBook.objects.filter(pk=self.book.pk).update(image_url='https://books.google.com/books/content?id=g1&zoom=2')
+        response, _ = self.get(reverse('google_book_cover', args=['g1', 'stale']))
+        self.assertRedirects(response, GoogleBook.objects.get(pk=self.book.pk).cover_url, fetch_redirect_response=False)
+
+    def test_identical_content_shared_and_lru_eviction(self):
+        other = GoogleBook.objects.create(
+            google_id='g1-copy', title='Same cover', image_url='https://books.google.com/books/content?id=g1&zoom=5',
+        )
+        self.get(self.book.cover_url)
+        self.get(other.cover_url)
+        self.assertEqual(len(_covers_on_disk(self.covers)), 1)
+
+        # Budget fits two covers: serving g1 again keeps it, g2 (least recent) goes when g3 arrives
+        for google_id in ('g2', 'g3'):
+            GoogleBook.objects.create(google_id=google_id, title=google_id,
+                                      image_url=f'https://books.google.com/books/content?id={google_id}')
+        self.get(GoogleBook.objects.get(google_id='g2').cover_url)
+        # g1 was served before g2; both were last used over TOUCH_INTERVAL ago
+        old = time.time() - 2 * covers.TOUCH_INTERVAL
+        for path in _covers_on_disk(self.covers):
+            last_used = old if b'g2' in open(path, 'rb').read() else old - 10
+            os.utime(path, (last_used, last_used))
+        self.get(self.book.cover_url)
+        self.get(GoogleBook.objects.get(google_id='g3').cover_url)
+        contents = sorted(open(path, 'rb').read().rstrip(b'\x00') for path in _covers_on_disk(self.covers))
+        self.assertEqual(contents, [b'\xff\xd8cover-of-g1', b'\xff\xd8cover-of-g3'])
+
+    def test_cold_fetch_is_one_short_attempt_with_a_size_cap(self):
+        google = 'https://books.google.com/books/content?id=g1&zoom=1'
+        with mock.patch.object(get_client().session, 'get', side_effect=requests.Timeout('slow')) as get:
+            response = self.client.get(self.book.cover_url)
+        self.assertRedirects(response, google, fetch_redirect_response=False)
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(get.call_args.kwargs['timeout'], self.covers.timeout)
+
+        def endless_body(chunk_size):
+            while True:
+                yield b'\x00' * chunk_size
+
+        huge = FakeCoverResponse(google)
+        huge.iter_content = endless_body
+        with mock.patch.object(get_client().session, 'get', return_value=huge) as get:
+            response = self.client.get(self.book.cover_url)
+        self.assertRedirects(response, google, fetch_redirect_response=False)
+        self.assertTrue(get.call_args.kwargs['stream'])
+        self.assertTrue(huge.closed)
+        self.assertFalse(os.path.exists(os.path.join(self.covers.root, 'blobs')))
+
+
+def _covers_on_disk(cover_cache):
+    return [entry[2] for entry in cover_cache._blobs()]
+
+
+class MetricsTests(CacheIsolatedTestCase):
+    def scrape(self, **extra):
+        return self.client.get(reverse('metrics'), **extra)
+
+    def counter(self, text, line_start):
+        values = [float(line.rsplit(' ', 1)[1]) for line in text.splitlines() if line.startswith(line_start)]
+        return sum(values)
+
+    def test_views_google_calls_and_cache_lookups_are_exported(self):
+        self.client.get(reverse('book_list'))
+        with mock.patch.object(get_client().session, 'get', side_effect=lambda url, **kw: FakeGoogleResponse(url)):
+            GoogleBooksService().search_books('metrics test')
+            GoogleBooksService().search_books('metrics test')
+        text = self.scrape().content.decode()
+        self.assertIn('# TYPE bookstore_http_request_duration_seconds histogram', text)
+        self.assertIn('bookstore_http_request_duration_seconds_bucket{method="GET",view="book_list",le="+Inf"}', text)
+        self.assertGreater(self.counter(text, 'bookstore_db_queries_total{view="book_list"}'), 0)
+        self.assertGreater(self.counter(text, 'bookstore_google_books_request_duration_seconds_count{endpoint="volumes"'), 0)
+        self.assertGreater(self.counter(text, 'bookstore_cache_lookups_total{prefix="google_books_search",result="hit"}'), 0)
+        self.assertIn('bookstore_cache_hit_ratio{prefix="google_books_search"}', text)
+
+    def test_workers_are_summed(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            before = self.counter(self.scrape().content.decode(), 'bookstore_http_responses_total{status="200",view="home"}')
+            with open(os.path.join(directory, '99999-1.json'), 'w') as f:
+                json.dump({'counters': [['http_responses_total', [['status', '200'], ['view', 'home']], 7]],
+                           'histograms': []}, f)
+            after = self.counter(self.scrape().content.decode(), 'bookstore_http_responses_total{status="200",view="home"}')
+        self.assertEqual(after - before, 7)
+
+    def test_exited_workers_are_folded_into_one_file(self):
+        def snapshot(value):
+            return {'counters': [['http_responses_total', [['status', '200'], ['view', 'home']], value]],
+                    'histograms': []}
+
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            before = self.counter(self.scrape().content.decode(), 'bookstore_http_responses_total{status="200",view="home"}')
+            for name, value in [('99998-1.json', 2), ('99999-1.json', 3), ('99999-2.json', 4)]:
+                with open(os.path.join(directory, name), 'w') as f:
+                    json.dump(snapshot(value), f)
+            metrics.mark_process_dead(99999)
+            metrics.mark_process_dead(99998)
+            left = set(os.listdir(directory)) - {metrics._process_file}
+            self.assertEqual(left, {metrics.EXITED_FILE})
+            after = self.counter(self.scrape().content.decode(), 'bookstore_http_responses_total{status="200",view="home"}')
+            self.assertEqual(after - before, 9)
+            metrics.reset()
+            self.assertEqual(os.listdir(directory), [])
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_internal_access_only(self):
+        self.assertEqual(self.scrape(REMOTE_ADDR='203.0.113.5').status_code, 403)
+        self.assertEqual(self.scrape(REMOTE_ADDR='203.0.113.5', HTTP_AUTHORIZATION='Bearer s3cret').status_code, 200)
+        self.assertEqual(self.scrape(REMOTE_ADDR='10.1.2.3').status_code, 403)
+        self.assertEqual(self.scrape(REMOTE_ADDR='127.0.0.1').status_code, 200)
+
+    @override_settings(METRICS_TOKEN='s3cret', METRICS_REQUIRE_TOKEN=True)
+    def test_token_required_behind_proxy(self):
+        self.assertEqual(self.scrape(REMOTE_ADDR='127.0.0.1').status_code, 403)
+        self.assertEqual(self.scrape(REMOTE_ADDR='10.1.2.3', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self.scrape(REMOTE_ADDR='10.1.2.3', HTTP_AUTHORIZATION='Bearer s3cret').status_code, 200)
+
+
+class PerfToolsTests(CacheIsolatedTestCase):
+    def seed(self):
+        call_command('seed_perf_data', '--books', '40', '--users', '8', '--seed', '7', stdout=io.StringIO())
+        return list(Books.objects.order_by('pk').values_list('title', 'author', 'rating_count', 'rating_avg'))
+
+    def test_seed_is_deterministic_and_replaces_previous_run(self):
+        first = self.seed()
+        self.assertEqual(len(first), 40)
+        self.assertEqual(sum(row[2] for row in first), Review.objects.count())
+        self.assertEqual(self.seed(), first)
+        self.assertEqual(Books.objects.count(), 40)
+        self.assertEqual(User.objects.filter(username__startswith='perf_user_').count(), 8)
+
+    def test_benchmark_reports_percentiles_and_query_counts(self):
+        self.seed()
+        reviews = Review.objects.count()
+        # Left behind by an interrupted run
+        User.objects.create(email='benchmark_runner@example.com', username='benchmark_runner')
+        client = get_client()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'results.json')
+            scenarios = ['book_list_search', 'review_detail', 'api_book_detail', 'api_review_create']
+            args = ['--iterations', '3', '--warmup', '0', '--google-latency', '0', '--json', path]
+            for scenario in scenarios:
+                args += ['--scenario', scenario]
+            call_command('benchmark', *args, stdout=io.StringIO())
+            with open(path) as f:
+                report = json.load(f)
+            out = io.StringIO()
+            call_command('benchmark', *args, '--compare', path, stdout=out)
+        self.assertEqual(list(report['results']), scenarios)
+        for result in report['results'].values():
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+            self.assertGreaterEqual(result['queries_max'], result['queries_median'])
+        self.assertEqual(report['results']['api_review_create']['statuses'], [201])
+        self.assertIn('| p95', out.getvalue())
+        # The benchmark's own writes are cleaned up
+        self.assertEqual(Review.objects.count(), reviews)
+        self.assertFalse(User.objects.filter(username='benchmark_runner').exists())
+        # The stub client was only swapped in for the run
+        self.assertIs(get_client(), client)
@@ -20,12 +20,16 @@ urlpatterns += [
     path('login/', login_view, name='login'),
     path('register/', register_view, name='register'),
     path('review/<int:pk>/', views.review_detail, name='review_detail'),
+    path('review/<int:pk>/reviews/', views.review_list_fragment, name='review_list_fragment'),
     path('about/', views.about, name='about'),
     path('contact/', views.contact, name='contact'),
     path('api/', include('books.api_urls')),
+    path('metrics', views.metrics_view, name='metrics'),
     
     # Google Books URLs
     path('google-books/', views.google_books_search, name='google_books_search'),
+    path('google-books/local/', views.google_books_local_search, name='google_books_local_search'),
     path('google-books/book/<str:google_id>/', views.google_book_detail, name='google_book_detail'),
     path('google-books/book/<str:google_id>/read/', views.google_book_reader, name='google_book_reader'),
+    path('google-books/book/<str:google_id>/cover/<str:key>/', views.google_book_cover, name='google_book_cover'),
 ]
\ No newline at end of file
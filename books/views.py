@@ -7,17 +7,17 @@ from django.contrib.auth import authenticate
 from .models import User, Books, Review
 from .serializers import UserSerializer, LoginSerializer, BookSerializer, ReviewSerializer
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth import authenticate, login as auth_login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from .forms import RegisterForm, LoginForm, ReviewForm, BookForm
 from django.db.models import Count
-import random
 from django.core.paginator import Paginator
-from django.core.cache import cache
-from django.utils.text import slugify
-import requests
 from django.conf import settings
+from .pagination import KeysetPaginator, InvalidCursor, approximate_count, resolve_ordering
+from .cache import cache_response, is_cacheable, CATALOG_VERSION, book_version_name
+from .conditional import make_etag, latest, not_modified, set_validators
 
 
 # # Signup
@@ -109,8 +109,10 @@ from django.conf import settings
 
 
 def home(request):
-    all_books = list(Books.objects.all())
-    featured_books = random.sample(all_books, min(4, len(all_books))) if all_books else []
+    # Only the columns the cards show; ratings come from the stored aggregates
+    featured_books = Books.objects.only(
+        'title', 'author', 'image', 'image_variants', 'price', 'rating_avg'
+    ).random_sample(4)
     
     # Get featured Google Books
     try:
@@ -124,27 +126,25 @@ def home(request):
         'google_featured_books': google_featured_books
     })
 
+@cache_response('book_list', lambda request: [CATALOG_VERSION])
 def book_list(request):
-    books = Books.objects.all()
+    books = Books.objects.for_listing()
     search = request.GET.get('search', '').strip()
     author = request.GET.get('author', '')
     genre = request.GET.get('genre', '')
     if search:
-        books = books.filter(
-            title__icontains=search
-        ) | books.filter(
-            author__icontains=search
-        ) | books.filter(
-            genres__icontains=search
-        )
+        books = books.search(search)
     if author:
         books = books.filter(author__icontains=author)
     if genre:
-        books = books.filter(genres__icontains=genre)
+        books = books.with_genre(genre)
 
-    paginator = Paginator(books, 12)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    ordering = resolve_ordering(books, request.GET.get('ordering'))
+    paginator = KeysetPaginator(books, ordering, 12)
+    try:
+        page_obj = paginator.page(request.GET.get('cursor'))
+    except InvalidCursor:
+        page_obj = paginator.page()
 
     if request.method == 'POST' and request.user.is_authenticated:
         form = BookForm(request.POST, request.FILES)
@@ -152,6 +152,7 @@ def book_list(request):
             book = form.save(commit=False)
             book.created_by = request.user
             book.save()
+            form.save_m2m()
             messages.success(request, f'Book "{book.title}" added successfully!')
             return redirect('book_list')
         else:
@@ -163,13 +164,24 @@ def book_list(request):
         'books': page_obj,
         'form': form,
         'page_obj': page_obj,
+        'next_url': _cursor_url(request, page_obj.next_cursor),
+        'previous_url': _cursor_url(request, page_obj.previous_cursor),
         'author': author,
         'genre': genre,
         'search': search,
+        'ordering': ordering,
     })
 
+def _cursor_url(request, cursor):
+    if cursor is None:
+        return None
+    params = request.GET.copy()
+    params['cursor'] = cursor
+    return f'?{params.urlencode()}'
+
+@cache_response('review_detail', lambda request, pk: [book_version_name(pk)])
 def review_detail(request, pk):
-    book = get_object_or_404(Books, pk=pk)
+    book = get_object_or_404(Books.objects.prefetch_related('genres'), pk=pk)
     if request.method == 'POST':
         form = ReviewForm(request.POST)
         if form.is_valid():
@@ -180,10 +192,48 @@ def review_detail(request, pk):
             return redirect('review_detail', pk=book.pk)
     else:
         form = ReviewForm()
-    return render(request, 'books/review_detail.html', {
+    review_page = _review_page(request, book)
+
+    etag = last_modified = None
+    if is_cacheable(request):
+        reviews = review_page['reviews']
+        etag = make_etag(
+            request.build_absolute_uri(), book.pk, book.updated_at,
+            [(review.pk, review.updated_at) for review in reviews], reviews.next_cursor,
+        )
+        last_modified = latest(book.updated_at, *(review.updated_at for review in reviews))
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+
+    response = render(request, 'books/review_detail.html', {
         'book': book,
         'form': form,
+        **review_page,
     })
+    return set_validators(response, etag, last_modified) if etag else response
+
+REVIEWS_PAGE_SIZE = 10
+
+def _review_page(request, book):
+    reviews = book.reviews.select_related('user')
+    paginator = KeysetPaginator(reviews, 'recent', REVIEWS_PAGE_SIZE)
+    try:
+        page = paginator.page(request.GET.get('cursor'))
+    except InvalidCursor:
+        page = paginator.page()
+    more_url = None
+    if page.next_cursor:
+        more_url = f"{reverse('review_list_fragment', args=[book.pk])}?cursor={page.next_cursor}"
+    return {'reviews': page, 'more_reviews_url': more_url}
+
+@cache_response('review_list_fragment', lambda request, pk: [book_version_name(pk)])
+def review_list_fragment(request, pk):
+    """
+    The next page of a book's reviews as an HTML fragment for "Load more"
+    """
+    book = get_object_or_404(Books.objects.only('pk'), pk=pk)
+    return render(request, 'books/review_items.html', _review_page(request, book))
 
 # def register(request):
 #     if request.method == 'POST':
@@ -249,9 +299,18 @@ def contact(request):
     return render(request, 'books/contact.html')
 
 # Google Books Views
+import logging
+import requests
 from .services import GoogleBooksService
 from .models import GoogleBook
+from .covers import CoverError, cover_key, cover_url, get_cover_cache, source_url
 from django.core.paginator import Paginator
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseForbidden
+from django.utils.http import quote_etag
+from django.views.decorators.cache import never_cache
+from . import metrics
+
+logger = logging.getLogger(__name__)
 
 def google_books_search(request):
     """
@@ -294,11 +353,36 @@ def google_books_search(request):
         'total_items': total_items,
         'page_obj': page_obj,
         'error': error,
+        'search_url': reverse('google_books_search'),
         'is_google_books': True
     }
     
     return render(request, 'books/google_books_search.html', context)
 
+def google_books_local_search(request):
+    """
+    Search the GoogleBook rows we already stored, through the local full-text index (no API calls)
+    """
+    search_query = request.GET.get('q', '').strip()
+    books = GoogleBook.objects.search(search_query) if search_query else GoogleBook.objects.all()
+    paginator = KeysetPaginator(books, 'relevance' if search_query else 'popular', 20)
+    try:
+        page_obj = paginator.page(request.GET.get('cursor'))
+    except InvalidCursor:
+        page_obj = paginator.page()
+
+    return render(request, 'books/google_books_search.html', {
+        'books': page_obj,
+        'search_query': search_query,
+        'total_items': approximate_count(books) if search_query else None,
+        'page_obj': page_obj,
+        'next_url': _cursor_url(request, page_obj.next_cursor),
+        'previous_url': _cursor_url(request, page_obj.previous_cursor),
+        'search_url': reverse('google_books_local_search'),
+        'local_search': True,
+        'is_google_books': True,
+    })
+
 def google_book_detail(request, google_id):
     """
     Display detailed information about a Google Book
@@ -309,13 +393,25 @@ def google_book_detail(request, google_id):
     if not book:
         messages.error(request, 'Book not found or could not be retrieved.')
         return redirect('google_books_search')
-    
+
+    # The stored payload hash identifies the content; rows from before it existed fall back to updated_at
+    etag = last_modified = None
+    if is_cacheable(request):
+        etag = make_etag(request.build_absolute_uri(), book.google_id, book.content_hash or book.updated_at)
+        last_modified = book.updated_at
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+    # Revalidations above are not views
+    GoogleBook.record_view(google_id)
+
     context = {
         'book': book,
         'is_google_book': True
     }
     
-    return render(request, 'books/google_book_detail.html', context)
+    response = render(request, 'books/google_book_detail.html', context)
+    return set_validators(response, etag, last_modified) if etag else response
 
 def google_book_reader(request, google_id):
     """
@@ -327,6 +423,7 @@ def google_book_reader(request, google_id):
     if not book:
         messages.error(request, 'Book not found or could not be retrieved.')
         return redirect('google_books_search')
+    GoogleBook.record_view(google_id)
     
     if not book.web_reader_url:
         messages.warning(request, 'This book is not available for online reading.')
@@ -339,27 +436,48 @@ def google_book_reader(request, google_id):
     
     return render(request, 'books/google_book_reader.html', context)
 
-def get_google_books(query, start_index=0, max_results=2):
-    # ✅ Sanitize the cache key
-    safe_query = slugify(query)
-    cache_key = f"google_books_search_{safe_query}_{start_index}_{max_results}"
-
-    # Try cache first
-    data = cache.get(cache_key)
-    if data:
-        return data
-
-    # Otherwise call the API
-    params = {
-        'q': query,
-        'startIndex': start_index,
-        'maxResults': max_results,
-        'key': settings.GOOGLE_BOOKS_API_KEY
-    }
-    url = settings.GOOGLE_BOOKS_API_BASE_URL
-    response = requests.get(url, params=params)
-    data = response.json()
+# Cover addresses change with the source URL (books/covers.py), so clients may keep them forever
+COVER_CACHE_CONTROL = 'public, max-age=31536000, immutable'
 
-    # Save to cache
-    cache.set(cache_key, data, 60 * 60)  # 1 hour
-    return data
\ No newline at end of file
+def google_book_cover(request, google_id, key):
+    """
+    Serve a Google Books cover from the local cover cache, fetching it on first use
+    """
+    cache = get_cover_cache()
+    cover = cache.get(key)
+    if cover is None:
+        image_url = GoogleBook.objects.filter(google_id=google_id).values_list('image_url', flat=True).first()
+        if not image_url:
+            raise Http404('No cover for this book')
+        if cover_key(image_url) != key:
+            # The book's image changed since the page linking here was rendered
+            return redirect(cover_url(google_id, image_url))
+        try:
+            cover = cache.fetch(image_url)
+        except (CoverError, requests.RequestException, OSError) as e:
+            logger.warning(f"Could not proxy the cover of {google_id}: {e}")
+            response = redirect(source_url(image_url))
+            response['Cache-Control'] = 'public, max-age=300'
+            return response
+
+    path, content_type, digest = cover
+    etag = quote_etag(digest)
+    response = not_modified(request, etag)
+    if response is None:
+        try:
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+        except FileNotFoundError:
+            # Evicted by another worker since the lookup
+            return redirect(request.get_full_path())
+        set_validators(response, etag)
+    response['Cache-Control'] = COVER_CACHE_CONTROL
+    return response
+
+@never_cache
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint, for internal networks or METRICS_TOKEN holders only
+    """
+    if not metrics.is_internal(request):
+        return HttpResponseForbidden('Forbidden')
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
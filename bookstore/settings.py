@@ -246,6 +246,8 @@ REST_FRAMEWORK = {
 # MIDDLEWARE
 # ===============================
 MIDDLEWARE = [
+    'books.middleware.MetricsMiddleware',
+    'books.middleware.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -256,11 +258,43 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Per-request query count, DB time and repeated query shapes as Server-Timing
+# headers and 'books.sql' logs (books/middleware.py). Strict mode raises when a
+# view goes over SQL_QUERY_BUDGET queries or repeats one query shape more than
+# SQL_DUPLICATE_QUERY_LIMIT times. Off by default; CacheIsolatedTestCase in
+# books/tests.py turns it on for its tests through override_settings.
+SQL_INSTRUMENTATION = os.environ.get('SQL_INSTRUMENTATION') == '1'
+SQL_INSTRUMENTATION_STRICT = False
+SQL_QUERY_BUDGET = 50
+SQL_DUPLICATE_QUERY_LIMIT = 5
+
+# Prometheus metrics at /metrics (books/metrics.py). Each gunicorn worker
+# writes its totals to METRICS_DIR every METRICS_FLUSH_INTERVAL seconds and the
+# endpoint sums them; gunicorn.conf.py clears out the files of exited workers.
+# Readable with 'Authorization: Bearer <METRICS_TOKEN>', or
+# without it from METRICS_ALLOWED_NETWORKS unless METRICS_REQUIRE_TOKEN. On Render
+# every request reaches the app from the proxy's private address, so the token is
+# required there (and /metrics is closed until METRICS_TOKEN is set).
+METRICS_ENABLED = True
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(BASE_DIR, '.metrics'))
+METRICS_FLUSH_INTERVAL = 5
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+METRICS_ALLOWED_NETWORKS = ['127.0.0.0/8', '::1/128']
+METRICS_REQUIRE_TOKEN = 'RENDER' in os.environ
+
 # ===============================
 # CLOUDINARY MEDIA STORAGE
 # ===============================
 CLOUDINARY_URL = os.getenv('CLOUDINARY_URL')
-DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
+# Django 5.1+ only reads STORAGES. Uploads and their resized cover variants
+# (books/images.py) go to Cloudinary when it is configured, else to MEDIA_ROOT.
+STORAGES = {
+    'default': {
+        'BACKEND': 'cloudinary_storage.storage.MediaCloudinaryStorage' if CLOUDINARY_URL
+        else 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
@@ -274,6 +308,7 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 
 if 'RENDER' in os.environ:
     STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+    STORAGES['staticfiles'] = {'BACKEND': STATICFILES_STORAGE}
 
 # ===============================
 # TEMPLATES
@@ -337,16 +372,86 @@ SESSION_ENGINE = 'django.contrib.sessions.backends.db'
 # ===============================
 GOOGLE_BOOKS_API_KEY = os.environ.get('GOOGLE_BOOKS_API_KEY', '')
 GOOGLE_BOOKS_API_BASE_URL = 'https://www.googleapis.com/books/v1'
+# Featured categories are fetched in parallel on a bounded pool; the home page
+# waits at most GOOGLE_BOOKS_FEATURED_DEADLINE seconds for them.
+GOOGLE_BOOKS_MAX_WORKERS = 6
+GOOGLE_BOOKS_FEATURED_DEADLINE = 5
+# Shared keep-alive HTTP client (books/google_client.py)
+GOOGLE_BOOKS_HTTP_POOL_SIZE = int(os.environ.get('GOOGLE_BOOKS_HTTP_POOL_SIZE', 10))
+GOOGLE_BOOKS_HTTP_MAX_RETRIES = 3
+GOOGLE_BOOKS_HTTP_BACKOFF = 0.5
+GOOGLE_BOOKS_HTTP_TIMEOUT = 10
+# Total seconds, retries and backoff included, a page waits on one lookup;
+# warm_google_books calls keep the full retry policy above
+GOOGLE_BOOKS_HTTP_INTERACTIVE_DEADLINE = 4
+# Stored GoogleBook rows confirmed by the API within this many seconds are
+# served without calling it; older rows are served too, and refreshed in the background
+GOOGLE_BOOKS_DETAIL_MAX_AGE = 60 * 60 * 2
+# One Google Book page view in this many is written to view_count (weighted by
+# the rate); warm_google_books ranks the hot set by it
+GOOGLE_BOOK_VIEW_SAMPLE_RATE = 10
+# Cover images are proxied and kept on local disk (books/covers.py); the least
+# recently served are evicted once the directory exceeds the budget
+GOOGLE_COVER_CACHE_DIR = os.environ.get('GOOGLE_COVER_CACHE_DIR', os.path.join(BASE_DIR, '.covers'))
+GOOGLE_COVER_CACHE_MAX_BYTES = int(os.environ.get('GOOGLE_COVER_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+GOOGLE_COVER_MAX_IMAGE_BYTES = 2 * 1024 * 1024
+# A cold cover is fetched with one attempt of at most this many seconds, then
+# the browser is redirected to Google instead
+GOOGLE_COVER_FETCH_TIMEOUT = 3
+
+# ===============================
+# BOOK SEARCH
+# ===============================
+# 'auto' uses SQLite FTS5 on SQLite and the in-process inverted index elsewhere
+BOOK_SEARCH_BACKEND = os.environ.get('BOOK_SEARCH_BACKEND', 'auto')
+BOOK_SEARCH_MAX_RESULTS = 1000
+BOOK_SEARCH_INDEX_TTL = 300
 
 # ===============================
 # DEFAULT AUTO FIELD
 # ===============================
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# ===============================
+# CACHES
+# ===============================
+# 'default' is a two-tier cache (books/cache.py): a per-process L1 in front of
+# a cache shared by all gunicorn workers. The shared tier is Redis when
+# REDIS_URL is set, otherwise a file-based cache on local disk.
+REDIS_URL = os.environ.get('REDIS_URL')
+
 CACHES = {
     'default': {
+        'BACKEND': 'books.cache.TieredCache',
+        'OPTIONS': {
+            'L1': 'local',
+            'L2': 'shared',
+            'L1_TIMEOUT': 60,
+        },
+    },
+    'local': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         'LOCATION': 'default-cache',
-    }
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    } if REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('CACHE_DIR', os.path.join(BASE_DIR, '.cache')),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
 }
 
+# Expired entries read through books.cache.get_or_refresh are still served for
+# this long while one worker refreshes them in the background.
+CACHE_STALE_TIMEOUT = 60 * 60 * 24
+CACHE_REFRESH_LOCK_TIMEOUT = 60
+# Failed upstream lookups are remembered this long before being retried
+CACHE_NEGATIVE_TIMEOUT = 60
+# How long a worker waits for another worker's in-flight fetch of the same key
+SINGLE_FLIGHT_WAIT = 5
+
+# Lifetime of cached catalog pages (book list, book detail, API book detail).
+# Writes retire them earlier by bumping version counters, see books/cache.py
+RESPONSE_CACHE_TIMEOUT = 60 * 5
@@ -39,6 +39,11 @@ API ENDPOINTS:
 CACHING:
 - Search results are cached for 1 hour
 - Book details are cached for 2 hours
+- Expired results are served while one worker refreshes them in the background
+- `python manage.py warm_google_books` (run from cron) refreshes the featured
+  searches ('featured_categories' below) and the most viewed book details
+  before they expire, within a request budget
+- The cache is shared by all workers (file-based, or Redis when REDIS_URL is set)
 - Reduces API calls and improves performance
 
 ERROR HANDLING:
@@ -0,0 +1,20 @@
+"""
+Gunicorn settings, read automatically from the working directory.
+
+The hooks keep the per-worker Prometheus snapshots in METRICS_DIR
+(books/metrics.py) to one file per live worker.
+"""
+import os
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bookstore.settings')
+
+
+def on_starting(server):
+    # A new master starts from zero: drop the previous run's totals
+    from books import metrics
+    metrics.reset()
+
+
+def child_exit(server, worker):
+    from books import metrics
+    metrics.mark_process_dead(worker.pid)